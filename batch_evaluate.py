@@ -0,0 +1,129 @@
+"""Headless evaluation of Q-tables: every start configuration, all at once.
+
+Runs the greedy policy from each of the 6 400 reset configurations of
+`TaxiTwoPassengerEnv` (or `--samples M` seeded draws from the reset distribution)
+in lockstep against the compiled model, with the registered episode limit.
+
+Tables may be bare `.npy` files or `.qckpt` checkpoints.
+
+    python batch_evaluate.py q_table_two_passenger.npy q_table_two_passenger_tiebreak.npy --json results.json --csv results.csv
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+
+import numpy as np
+import gymnasium as gym
+
+from multi_taxi import CODEC, TaxiTwoPassengerEnv, TransitionModel, sample_ext_starts
+from checkpoint import load_q_table
+from policy import Policy, compile_policy, masked_greedy
+
+ENV_ID = "TaxiTwoPassenger-v0"
+
+
+def all_start_states() -> np.ndarray:
+    """Every extended state `_generate_random_state` can produce (25 cells × 4⁴ passenger layouts)."""
+    r, c, p1, d1, p2, d2 = np.meshgrid(*(np.arange(n) for n in (5, 5, 4, 4, 4, 4)), indexing="ij")
+    return CODEC.encode_batch(r, c, p1, d1, p2, d2).ravel() * 4
+
+
+def rollout(model: TransitionModel, act, starts: np.ndarray, max_steps: int):
+    """Rollouts from `starts`; returns per-episode (return, length, terminated).
+
+    ``act(ext_states, out)`` picks the actions for the live episodes.
+    """
+    states = starts.astype(np.int64)
+    n = len(states)
+    returns = np.zeros(n, dtype=np.int64)
+    lengths = np.full(n, max_steps, dtype=np.int64)
+    done = np.zeros(n, dtype=bool)
+    actions = np.empty(n, dtype=np.int8)
+    for t in range(max_steps):
+        live = np.flatnonzero(~done)
+        if not len(live):
+            break
+        s = states[live]
+        a = act(s, actions[: len(live)])
+        returns[live] += model.reward[s, a]
+        term = model.terminated[s, a]
+        states[live] = model.next_state[s, a]
+        lengths[live[term]] = t + 1
+        done[live[term]] = True
+    return returns, lengths, done
+
+
+def evaluate(Q: np.ndarray, samples: int | None = None, seed: int = 0, tie_break: bool = False,
+             action_mask: bool = False) -> dict:
+    """Greedy evaluation of `Q`; with `action_mask` the argmax skips masked actions."""
+    spec = gym.spec(ENV_ID)
+    model = TaxiTwoPassengerEnv().model
+    starts = all_start_states() if samples is None else sample_ext_starts(np.random.default_rng(seed), samples)
+    if action_mask:
+        rng = np.random.default_rng(seed) if tie_break else None
+        act = lambda s, out: masked_greedy(Q[s >> 2], model.action_mask[s], rng)
+    else:
+        policy = Policy(compile_policy(Q), tie_break=tie_break, seed=seed)
+        act = lambda s, out: policy.act_batch(s >> 2, out=out)
+
+    start = time.perf_counter()
+    returns, lengths, completed = rollout(model, act, starts, spec.max_episode_steps)
+    elapsed = time.perf_counter() - start
+
+    done_lengths = lengths[completed] if completed.any() else np.full(1, np.nan)  # NaN when nothing finished
+    pct = lambda x, q: float(np.percentile(x, q))
+    return {
+        "episodes": len(starts),
+        "reward_threshold": spec.reward_threshold,
+        "success_rate": float((returns >= spec.reward_threshold).mean()),
+        "completion_rate": float(completed.mean()),
+        "stuck_episodes": int((~completed).sum()),
+        "steps_mean": float(done_lengths.mean()),
+        "steps_p50": pct(done_lengths, 50),
+        "steps_p90": pct(done_lengths, 90),
+        "steps_p99": pct(done_lengths, 99),
+        "return_mean": float(returns.mean()),
+        "return_std": float(returns.std()),
+        "return_min": int(returns.min()),
+        "return_p10": pct(returns, 10),
+        "return_p50": pct(returns, 50),
+        "return_p90": pct(returns, 90),
+        "return_max": int(returns.max()),
+        "seconds": elapsed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tables", nargs="*", default=["q_table_two_passenger.npy"])
+    parser.add_argument("--samples", type=int, default=None, help="evaluate M seeded reset draws instead of all starts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tie-break", action="store_true", help="break greedy ties randomly instead of lowest action")
+    parser.add_argument("--action-mask", action="store_true", help="only consider actions allowed by the action mask")
+    parser.add_argument("--json", default=None, help="write results to this file ('-' for stdout)")
+    parser.add_argument("--csv", default=None, help="write one summary row per table to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for path in args.tables:
+        res = evaluate(load_q_table(path), args.samples, args.seed, args.tie_break, args.action_mask)
+        results[path] = res
+        print(f"{path}: success {res['success_rate']:.1%} (return >= {res['reward_threshold']}), "
+              f"completed {res['completion_rate']:.1%}, stuck {res['stuck_episodes']}, "
+              f"steps mean/p50/p99 {res['steps_mean']:.1f}/{res['steps_p50']:.0f}/{res['steps_p99']:.0f}, "
+              f"return mean {res['return_mean']:.1f} — {res['episodes']} episodes in {res['seconds'] * 1000:.0f} ms",
+              file=sys.stderr)
+
+    if args.json:
+        out = sys.stdout if args.json == "-" else open(args.json, "w")
+        json.dump(results, out, indent=2)
+        if out is not sys.stdout:
+            out.close()
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["table", *next(iter(results.values()))])
+            writer.writeheader()
+            for path, res in results.items():
+                writer.writerow({"table": path, **res})
@@ -0,0 +1,421 @@
+"""Benchmarks for the env, codec, trainers and evaluators.
+
+Every benchmark reports a throughput (higher is better). Results can be saved as a
+JSON baseline and later runs compared against it; anything slower than the
+baseline by more than the threshold is flagged and the exit status is 1.
+
+    python bench.py                                     # run everything
+    python bench.py --only env_step_raw,codec_decode6   # run a subset
+    python bench.py --save benchmarks/baseline.json
+    python bench.py --compare benchmarks/baseline.json --threshold 0.15
+    python bench.py --importtime multi_taxi             # where the import time of a module goes
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, unit: str):
+    """Register `fn(n) -> ops` as a benchmark; `fn` does `n`-sized work and returns the ops it performed."""
+    def register(fn):
+        BENCHMARKS[name] = (fn, unit)
+        return fn
+    return register
+
+
+def measure(fn, n: int, repeat: int) -> float:
+    """Best-of-`repeat` throughput of `fn(n)` in ops/second."""
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ops = fn(n)
+        best = max(best, ops / (time.perf_counter() - start))
+    return best
+
+
+# -----------------------------------------------------------------------------
+#  Environment
+# -----------------------------------------------------------------------------
+def _env_steps(env, n):
+    env.reset(seed=0)
+    actions = np.random.default_rng(0).integers(6, size=n).tolist()
+    for a in actions:
+        _, _, terminated, truncated, _ = env.step(a)
+        if terminated or truncated:
+            env.reset()
+    return n
+
+
+@benchmark("env_step_raw", "steps/s")
+def env_step_raw(n):
+    from multi_taxi import TaxiTwoPassengerEnv
+    return _env_steps(TaxiTwoPassengerEnv(), n)
+
+
+@benchmark("env_step_gym", "steps/s")
+def env_step_gym(n):
+    import gymnasium as gym
+    import multi_taxi  # noqa: F401
+    return _env_steps(gym.make("TaxiTwoPassenger-v0"), n)
+
+
+@benchmark("env_step_instrumented", "steps/s")
+def env_step_instrumented(n):
+    from multi_taxi import TaxiTwoPassengerEnv
+    env = TaxiTwoPassengerEnv()
+    env.enable_instrumentation()
+    return _env_steps(env, n)
+
+
+@benchmark("env_reset_raw", "resets/s")
+def env_reset_raw(n):
+    from multi_taxi import TaxiTwoPassengerEnv
+    env = TaxiTwoPassengerEnv()
+    env.reset(seed=0)
+    for _ in range(n):
+        env.reset()
+    return n
+
+
+@benchmark("env_reset_gym", "resets/s")
+def env_reset_gym(n):
+    import gymnasium as gym
+    import multi_taxi  # noqa: F401
+    env = gym.make("TaxiTwoPassenger-v0")
+    env.reset(seed=0)
+    for _ in range(n):
+        env.reset()
+    return n
+
+
+@benchmark("env_step_recorded", "steps/s")
+def env_step_recorded(n):
+    import tempfile
+    from multi_taxi import TaxiTwoPassengerEnv
+    from trajectory import TrajectoryRecorder
+    with tempfile.TemporaryDirectory() as tmp:
+        env = TrajectoryRecorder(TaxiTwoPassengerEnv(), tmp)
+        n = _env_steps(env, n)
+        env.close()
+    return n
+
+
+@benchmark("env_init", "envs/s")
+def env_init(n):
+    from multi_taxi import TaxiTwoPassengerEnv
+    for _ in range(n // 100):
+        TaxiTwoPassengerEnv().reset(seed=0)
+    return n // 100
+
+
+@benchmark("taxi_v3_init", "envs/s")
+def taxi_v3_init(n):
+    from gymnasium.envs.toy_text.taxi import TaxiEnv
+    count = max(1, n // 10000)
+    for _ in range(count):
+        TaxiEnv()
+    return count
+
+
+@benchmark("vector_env_step", "steps/s")
+def vector_env_step(n):
+    from multi_taxi import TaxiTwoPassengerVectorEnv
+    env = TaxiTwoPassengerVectorEnv(1024)
+    env.reset(seed=0)
+    actions = np.random.default_rng(0).integers(6, size=(max(1, n // 1024), 1024))
+    for a in actions:
+        env.step(a)
+    return actions.size
+
+
+@benchmark("k_env_step_k4", "steps/s")
+def k_env_step_k4(n):
+    from k_passenger_taxi import TaxiKPassengerEnv
+    return _env_steps(TaxiKPassengerEnv(4), n)
+
+
+@benchmark("k_env_step_batch_k4", "steps/s")
+def k_env_step_batch_k4(n):
+    from k_passenger_taxi import TaxiKPassengerEnv
+    env = TaxiKPassengerEnv(4)
+    rng = np.random.default_rng(0)
+    states = env.sample_ext_starts(rng, 4096)
+    rounds = max(1, n // 4096)
+    for _ in range(rounds):
+        states = env.step_batch(states, rng.integers(6, size=4096))[0]
+    return rounds * 4096
+
+
+@benchmark("env_server_step", "steps/s")
+def env_server_step(n):
+    """64 concurrent sessions stepping through an in-process `env_server` over a Unix socket."""
+    import asyncio
+    import os
+    import tempfile
+    from env_client import load_test
+    from env_server import EnvServer
+    from rpc import start_server
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            address = "unix:" + os.path.join(tmp, "env.sock")
+            async with await start_server(EnvServer(), address, max_inflight=256):
+                return (await load_test(address, 64, 1, n))["steps"]
+    return asyncio.run(run())
+
+
+@benchmark("render_batch", "frames/s")
+def render_batch(n):
+    from rasterize import FrameRasterizer
+    raster = FrameRasterizer(downsample=4)
+    states = np.random.default_rng(0).integers(10000, size=n)
+    out = np.empty((1000, *raster.frame_shape), dtype=np.uint8)
+    for i in range(0, n, 1000):
+        raster.render(states[i:i + 1000], out=out[: len(states[i:i + 1000])])
+    return n
+
+
+# -----------------------------------------------------------------------------
+#  State codec
+# -----------------------------------------------------------------------------
+@benchmark("codec_encode", "calls/s")
+def codec_encode(n):
+    from multi_taxi import CODEC
+    encode = CODEC.encode
+    for i in range(n):
+        encode(3, 2, 1, 0, 4, 3)
+    return n
+
+
+@benchmark("codec_decode6", "calls/s")
+def codec_decode6(n):
+    from multi_taxi import CODEC
+    decode = CODEC.decode
+    for i in range(n):
+        decode(i % 10000)
+    return n
+
+
+@benchmark("codec_encode_batch", "states/s")
+def codec_encode_batch(n):
+    from multi_taxi import CODEC
+    fields = CODEC.decode_batch(np.random.default_rng(0).integers(CODEC.n_states, size=4096))
+    rounds = max(1, n // 100)
+    for _ in range(rounds):
+        CODEC.encode_batch(*fields)
+    return rounds * 4096
+
+
+@benchmark("codec_decode_batch", "states/s")
+def codec_decode_batch(n):
+    from multi_taxi import CODEC
+    states = np.random.default_rng(0).integers(CODEC.n_states, size=4096)
+    rounds = max(1, n // 100)
+    for _ in range(rounds):
+        CODEC.decode_batch(states)
+    return rounds * 4096
+
+
+# -----------------------------------------------------------------------------
+#  Training and evaluation
+# -----------------------------------------------------------------------------
+@benchmark("train_scalar", "episodes/s")
+def train_scalar(n):
+    """The `q_learning_taxi.py` loop, without printing or saving."""
+    import gymnasium as gym
+    import multi_taxi  # noqa: F401
+    episodes = max(1, n // 1000)
+    env = gym.make("TaxiTwoPassenger-v0")
+    env.reset(seed=0)
+    random.seed(0)
+    Q = np.zeros((env.observation_space.n, 6), dtype=np.float32)
+    epsilon = 1.0
+    for _ in range(episodes):
+        state, _ = env.reset()
+        for _ in range(200):
+            if random.random() < epsilon:
+                action = random.randint(0, 5)
+            else:
+                q_vals = Q[state]
+                candidates = np.where(np.isclose(q_vals, np.max(q_vals), atol=1e-8))[0]
+                action = int(random.choice(candidates))
+            next_state, reward, terminated, truncated, _ = env.step(action)
+            target = reward if terminated else reward + 0.99 * np.max(Q[next_state])
+            Q[state, action] += 0.1 * (target - Q[state, action])
+            state = next_state
+            if terminated or truncated:
+                break
+        epsilon = max(0.01, epsilon * 0.9998)
+    return episodes
+
+
+@benchmark("train_vector", "episodes/s")
+def train_vector(n):
+    from vector_q_learning import VectorQLearner
+    learner = VectorQLearner(seed=0)
+    learner.train(max(1, n // 10), report_every=0)
+    return learner.episodes_done
+
+
+@benchmark("eval_greedy_scalar", "steps/s")
+def eval_greedy_scalar(n):
+    from multi_taxi import TaxiTwoPassengerEnv
+    from policy import Policy
+    policy = Policy.from_q_table(np.load("q_table_two_passenger.npy"), seed=0)
+    env = TaxiTwoPassengerEnv()
+    state, _ = env.reset(seed=0)
+    for i in range(n):
+        state, _, terminated, _, _ = env.step(policy.act(state))
+        if terminated or i % 200 == 199:
+            state, _ = env.reset()
+    return n
+
+
+@benchmark("policy_server_act", "decisions/s")
+def policy_server_act(n):
+    """64 concurrent single-state queries against an in-process `policy_server` over a Unix socket."""
+    import asyncio
+    import os
+    import tempfile
+    from policy_client import load_test
+    from policy_server import PolicyServer, ServedModel
+    from rpc import start_server
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            address = "unix:" + os.path.join(tmp, "policy.sock")
+            server = PolicyServer([ServedModel("main", "q_table_two_passenger.npy", seed=0)])
+            async with await start_server(server, address, max_inflight=256):
+                return (await load_test(address, 64, n))["decisions"]
+    return asyncio.run(run())
+
+
+@benchmark("eval_batch", "episodes/s")
+def eval_batch(n):
+    from batch_evaluate import evaluate
+    return evaluate(np.load("q_table_two_passenger.npy"))["episodes"]
+
+
+# -----------------------------------------------------------------------------
+#  Startup
+# -----------------------------------------------------------------------------
+HEADLESS_FORBIDDEN = ("pygame",)  # never imported unless something renders
+
+
+def import_profile(modules: str) -> list[tuple[str, int, int]]:
+    """``(module, self_us, cumulative_us)`` for every import of ``import {modules}`` in a fresh interpreter."""
+    import subprocess
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modules}"],
+                         capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if line.startswith("import time:") and "|" in line and not line.rstrip().endswith("| imported package"):
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def _startup(modules: str, n: int) -> int:
+    """Fresh interpreters that import `modules`, failing if a headless path pulls in a render dependency."""
+    runs = max(1, n // 20000)
+    for _ in range(runs):
+        loaded = {name.strip() for name, _, _ in import_profile(modules)}
+        bad = loaded.intersection(HEADLESS_FORBIDDEN)
+        if bad:
+            raise RuntimeError(f"`import {modules}` imported {', '.join(sorted(bad))}")
+    return runs
+
+
+@benchmark("startup_multi_taxi", "processes/s")
+def startup_multi_taxi(n):
+    return _startup("multi_taxi", n)
+
+
+@benchmark("startup_worker", "processes/s")
+def startup_worker(n):
+    """What a sweep or evaluation worker imports before its first episode."""
+    return _startup("vector_q_learning, batch_evaluate", n)
+
+
+# -----------------------------------------------------------------------------
+#  Baselines
+# -----------------------------------------------------------------------------
+def run(names, n: int, repeat: int) -> dict:
+    results = {}
+    for name in names:
+        fn, unit = BENCHMARKS[name]
+        rate = measure(fn, n, repeat)
+        results[name] = {"rate": rate, "unit": unit}
+        print(f"{name:<24} {rate:>16,.1f} {unit}", flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Names of benchmarks that got slower than `baseline` by more than `threshold`."""
+    regressions = []
+    print(f"\n{'benchmark':<24} {'baseline':>14} {'current':>14} {'change':>8}")
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]["rate"], res["rate"]
+        change = new / old - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<24} {old:>14,.1f} {new:>14,.1f} {change:>+7.1%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", default=None, help="comma-separated benchmark names")
+    parser.add_argument("--n", type=int, default=100000, help="work size per round")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", default=None, help="write results as a JSON baseline")
+    parser.add_argument("--compare", default=None, help="compare against a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before flagging")
+    parser.add_argument("--list", action="store_true")
+    parser.add_argument("--importtime", default=None, metavar="MODULES",
+                        help="print the slowest imports of `import MODULES` (python -X importtime) and exit")
+    args = parser.parse_args()
+
+    if args.importtime:
+        rows = import_profile(args.importtime)
+        total = sum(cumulative for name, _, cumulative in rows if not name.startswith("  "))
+        print(f"{'self ms':>8} {'cumul ms':>9}  module   (import {args.importtime}: {total / 1000:.1f} ms in total)")
+        for name, self_us, cumulative_us in sorted(rows, key=lambda r: -r[2])[:25]:
+            print(f"{self_us / 1000:>8.1f} {cumulative_us / 1000:>9.1f} {name}")
+        sys.exit(0)
+
+    if args.list:
+        print("\n".join(f"{name} ({unit})" for name, (_, unit) in BENCHMARKS.items()))
+        sys.exit(0)
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    results = run(names, args.n, args.repeat)
+    if args.save:
+        meta = {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "date": time.strftime("%Y-%m-%d"),
+            "n": args.n,
+        }
+        with open(args.save, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,107 @@
+"""Versioned Q-table checkpoints with a JSON header and a memory-mappable payload.
+
+File layout (`.qckpt`)::
+
+    b"TAXIQCKP" | uint32 format version | uint32 header length | JSON header | pad to 64 | raw array
+
+The header records which env the table belongs to (id, observation encoding
+version, layout hash), the array dtype/shape and whatever training state the
+writer adds: hyperparameters, epsilon, episode index, RNG state. Writes go to a
+temporary file that is renamed over the target, so a crash never leaves a torn
+checkpoint behind.
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+from multi_taxi import ENCODING_VERSION, TaxiTwoPassengerEnv, layout_hash
+
+MAGIC = b"TAXIQCKP"
+FORMAT_VERSION = 1
+ENV_ID = "TaxiTwoPassenger-v0"
+_PREFIX = struct.Struct("<8sII")
+_ALIGN = 64
+
+
+def env_fingerprint(env: TaxiTwoPassengerEnv | None = None) -> dict:
+    """The fields a table must match to be used with `env` (default: a fresh env)."""
+    env = env or TaxiTwoPassengerEnv()
+    return {
+        "env_id": ENV_ID,
+        "encoding_version": ENCODING_VERSION,
+        "layout_hash": layout_hash(env.desc, env.locs, env.obstacles),
+        "n_states": int(env.observation_space.n),
+        "n_actions": int(env.action_space.n),
+    }
+
+
+def save_checkpoint(path: str, Q: np.ndarray, env: TaxiTwoPassengerEnv | None = None, **meta):
+    """Atomically write `Q` plus `meta` (anything JSON-serialisable) to `path`."""
+    Q = np.ascontiguousarray(Q)
+    header = {**env_fingerprint(env), **meta, "dtype": Q.dtype.str, "shape": list(Q.shape)}
+    blob = json.dumps(header).encode()
+    offset = -(-(_PREFIX.size + len(blob)) // _ALIGN) * _ALIGN
+    blob += b" " * (offset - _PREFIX.size - len(blob))
+
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(blob)))
+        f.write(blob)
+        f.write(Q.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_header(path: str) -> dict:
+    with open(path, "rb") as f:
+        magic, version, length = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a Q-table checkpoint")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"{path} uses checkpoint format v{version}; this code reads up to v{FORMAT_VERSION}")
+        header = json.loads(f.read(length))
+    header["payload_offset"] = _PREFIX.size + length
+    return header
+
+
+def check_compatible(header: dict, env: TaxiTwoPassengerEnv | None = None):
+    """Raise ValueError if a checkpoint header does not belong to `env`."""
+    expected = env_fingerprint(env)
+    wrong = {k: (header.get(k), v) for k, v in expected.items() if header.get(k) != v}
+    if header.get("shape") != [expected["n_states"], expected["n_actions"]]:
+        wrong["shape"] = (header.get("shape"), [expected["n_states"], expected["n_actions"]])
+    if wrong:
+        details = ", ".join(f"{k}={got!r} (env has {want!r})" for k, (got, want) in wrong.items())
+        raise ValueError(f"Q-table does not match the environment: {details}")
+
+
+def load_checkpoint(path: str, env: TaxiTwoPassengerEnv | None = None, mmap: bool = True, check: bool = True):
+    """Return ``(Q, header)``. With `mmap` the table is mapped read-only without copying."""
+    header = read_header(path)
+    if check:
+        check_compatible(header, env)
+    dtype, shape, offset = np.dtype(header["dtype"]), tuple(header["shape"]), header["payload_offset"]
+    if mmap:
+        Q = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+    else:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            Q = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return Q, header
+
+
+def load_q_table(path: str, env: TaxiTwoPassengerEnv | None = None, mmap: bool = True) -> np.ndarray:
+    """Load a checkpoint or a bare legacy `.npy` table, refusing ones that don't fit `env`.
+
+    Bare `.npy` files carry no metadata, so only their shape can be checked.
+    """
+    if path.endswith(".npy"):
+        Q = np.load(path, mmap_mode="r" if mmap else None)
+        expected = env_fingerprint(env)
+        if Q.shape != (expected["n_states"], expected["n_actions"]):
+            raise ValueError(f"{path} has shape {Q.shape}, env needs {(expected['n_states'], expected['n_actions'])}")
+        return Q
+    return load_checkpoint(path, env, mmap=mmap)[0]
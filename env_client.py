@@ -0,0 +1,211 @@
+"""Clients for `env_server.py`, and a load generator.
+
+This module imports neither gymnasium nor `multi_taxi`. An agent talking to a
+running server only pays for NumPy and a socket:
+
+    env = RemoteEnv("unix:/tmp/taxi.sock")
+    obs, info = env.reset(seed=0)
+    obs, reward, terminated, truncated, info = env.step(info["action_mask"].argmax())
+
+`RemoteEnv` uses a blocking socket and serves one session. `AsyncEnvClient`
+multiplexes any number of `AsyncRemoteEnv` sessions over one asyncio connection.
+Observations, rewards, termination/truncation (at the registered 200-step limit)
+and ``info["action_mask"]`` match ``gym.make("TaxiTwoPassenger-v0")``. The same
+reset seed gives the same episode.
+
+Load generator, reporting per-step latency percentiles and aggregate throughput:
+
+    python env_server.py --address unix:/tmp/taxi.sock &
+    python env_client.py --address unix:/tmp/taxi.sock --sessions 256 --connections 4 --steps 200000
+    python env_client.py --spawn --sessions 64       # starts (and stops) its own server
+"""
+import argparse
+import asyncio
+import os
+import random
+import struct
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from rpc import BlockingRpcClient, RpcClient, parse_address
+
+# -----------------------------------------------------------------------------
+#  Protocol (payloads of the `rpc` frames)
+# -----------------------------------------------------------------------------
+OP_CREATE, OP_RESET, OP_STEP, OP_CLOSE = 1, 2, 3, 4
+SESSION = struct.Struct("<I")        # CREATE reply, CLOSE request
+RESET_REQ = struct.Struct("<Iq")     # session, seed (-1: continue the session's RNG stream)
+RESET_RESP = struct.Struct("<HB")    # observation, action-mask bits
+STEP_REQ = struct.Struct("<IB")      # session, action
+STEP_RESP = struct.Struct("<HhBB")   # observation, reward, terminated | truncated << 1, action-mask bits
+NO_SEED = -1
+
+# Same read-only mask templates as `multi_taxi._ACTION_MASKS`, rebuilt here to avoid importing it;
+# infos get copies, as the env's do
+_ACTION_MASKS = tuple(np.array([(m >> a) & 1 for a in range(6)], dtype=np.int8) for m in range(64))
+for _mask in _ACTION_MASKS:
+    _mask.flags.writeable = False
+
+
+def _reset_result(payload: bytes):
+    obs, mask = RESET_RESP.unpack(payload)
+    return obs, {"action_mask": _ACTION_MASKS[mask].copy()}
+
+
+def _step_result(payload: bytes):
+    obs, reward, flags, mask = STEP_RESP.unpack(payload)
+    return obs, reward, bool(flags & 1), bool(flags & 2), {"action_mask": _ACTION_MASKS[mask].copy()}
+
+
+# -----------------------------------------------------------------------------
+#  Clients
+# -----------------------------------------------------------------------------
+class RemoteEnv:
+    """One server-side session over a blocking connection, with the gym `reset`/`step` signatures."""
+
+    def __init__(self, address: str):
+        self._rpc = BlockingRpcClient(address)
+        self.session, = SESSION.unpack(self._rpc.call(OP_CREATE))
+
+    def reset(self, *, seed: int | None = None, options=None):
+        return _reset_result(self._rpc.call(OP_RESET, RESET_REQ.pack(self.session, NO_SEED if seed is None else seed)))
+
+    def step(self, action: int):
+        return _step_result(self._rpc.call(OP_STEP, STEP_REQ.pack(self.session, action)))
+
+    def close(self):
+        if self._rpc is not None:
+            self._rpc.call(OP_CLOSE, SESSION.pack(self.session))
+            self._rpc.close()
+            self._rpc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncRemoteEnv:
+    """One server-side session; `reset`/`step` are coroutines with the gym return values."""
+
+    def __init__(self, rpc: RpcClient, session: int):
+        self._rpc = rpc
+        self.session = session
+
+    async def reset(self, *, seed: int | None = None, options=None):
+        return _reset_result(await self._rpc.call(OP_RESET, RESET_REQ.pack(self.session, NO_SEED if seed is None else seed)))
+
+    async def step(self, action: int):
+        return _step_result(await self._rpc.call(OP_STEP, STEP_REQ.pack(self.session, action)))
+
+    async def close(self):
+        await self._rpc.call(OP_CLOSE, SESSION.pack(self.session))
+
+
+class AsyncEnvClient:
+    """One asyncio connection; concurrent steps from its sessions are batched by the server."""
+
+    def __init__(self, rpc: RpcClient):
+        self.rpc = rpc
+
+    @classmethod
+    async def connect(cls, address: str) -> "AsyncEnvClient":
+        return cls(await RpcClient.connect(address))
+
+    async def make(self) -> AsyncRemoteEnv:
+        session, = SESSION.unpack(await self.rpc.call(OP_CREATE))
+        return AsyncRemoteEnv(self.rpc, session)
+
+    async def close(self):
+        await self.rpc.close()
+
+
+# -----------------------------------------------------------------------------
+#  Load generator
+# -----------------------------------------------------------------------------
+async def _agent(env: AsyncRemoteEnv, seed: int, steps: int, latencies: np.ndarray, counts: list):
+    """Uniformly random actions for `steps` steps, resetting on termination or truncation."""
+    rng = random.Random(seed)
+    clock = time.perf_counter
+    await env.reset(seed=seed)
+    for i in range(steps):
+        action = rng.randrange(6)
+        start = clock()
+        _, _, terminated, truncated, _ = await env.step(action)
+        latencies[i] = clock() - start
+        if terminated or truncated:
+            counts[0] += 1
+            await env.reset()
+
+
+async def load_test(address: str, sessions: int, connections: int, steps: int, seed: int = 0) -> dict:
+    """Run `sessions` concurrent random agents over `connections` connections, `steps` steps in total."""
+    clients = [await AsyncEnvClient.connect(address) for _ in range(connections)]
+    envs = [await clients[i % connections].make() for i in range(sessions)]
+    per_session = max(1, steps // sessions)
+    latencies = np.zeros((sessions, per_session))
+    counts = [0]
+    start = time.perf_counter()
+    await asyncio.gather(*(_agent(env, seed + i, per_session, latencies[i], counts) for i, env in enumerate(envs)))
+    elapsed = time.perf_counter() - start
+    for env in envs:
+        await env.close()
+    for client in clients:
+        await client.close()
+    us = latencies.ravel() * 1e6
+    return {
+        "sessions": sessions,
+        "connections": connections,
+        "steps": latencies.size,
+        "episodes": counts[0],
+        "seconds": elapsed,
+        "steps_per_sec": latencies.size / elapsed,
+        "latency_p50_us": float(np.percentile(us, 50)),
+        "latency_p90_us": float(np.percentile(us, 90)),
+        "latency_p99_us": float(np.percentile(us, 99)),
+        "latency_max_us": float(us.max()),
+    }
+
+
+def spawn_server(address: str, timeout: float = 30.0) -> subprocess.Popen:
+    """Start ``env_server.py`` at `address` and wait until it accepts connections."""
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "env_server.py"),
+                               "--address", address], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            RemoteEnv(address).close()
+            return server
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError(f"env_server.py did not come up at {address}")
+            time.sleep(0.05)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", default="unix:/tmp/taxi_env.sock")
+    parser.add_argument("--sessions", type=int, default=64, help="concurrent agents, each with its own env session")
+    parser.add_argument("--connections", type=int, default=1, help="connections the sessions are spread over")
+    parser.add_argument("--steps", type=int, default=100000, help="total steps across all sessions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spawn", action="store_true", help="start a server at --address for the run")
+    args = parser.parse_args()
+
+    parse_address(args.address)
+    server = spawn_server(args.address) if args.spawn else None
+    try:
+        res = asyncio.run(load_test(args.address, args.sessions, args.connections, args.steps, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print(f"{res['steps']:,} steps ({res['episodes']:,} episodes) from {res['sessions']} sessions over "
+          f"{res['connections']} connection(s) in {res['seconds']:.2f}s: {res['steps_per_sec']:,.0f} steps/s; "
+          f"step latency p50 {res['latency_p50_us']:.0f} µs, p90 {res['latency_p90_us']:.0f} µs, "
+          f"p99 {res['latency_p99_us']:.0f} µs, max {res['latency_max_us']:.0f} µs")
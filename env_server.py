@@ -0,0 +1,220 @@
+"""Local env server: many `TaxiTwoPassenger-v0` sessions hosted by one process.
+
+Agents connect over a Unix socket or localhost TCP (see `rpc.py` for framing and
+`env_client.py` for the protocol and clients). They create sessions and reset,
+step and close them without importing gymnasium or building an env themselves.
+
+A session is one slot in flat arrays of extended states and step counters. It
+has no env object. `step` requests are not executed one by one. They are queued,
+and everything that arrives in one event-loop iteration (up to `max_batch`, or
+within `batch_window` seconds) is advanced with one gather from the packed step
+table. Each connection then gets its replies in a single write. Resets draw from
+a per-session generator exactly as `TaxiTwoPassengerEnv.reset` does, so a seeded
+remote episode equals a local one.
+
+Backpressure: at most `max_sessions` sessions exist at once, and each connection
+may have `max_inflight` unanswered requests before the server stops reading it.
+
+    python env_server.py --address unix:/tmp/taxi_env.sock
+    python env_server.py --address 127.0.0.1:7070 --max-batch 4096 --batch-window-us 200
+"""
+import argparse
+import asyncio
+import itertools
+
+import numpy as np
+import gymnasium as gym
+
+from multi_taxi import CODEC, TaxiTwoPassengerEnv
+from env_client import (NO_SEED, OP_CLOSE, OP_CREATE, OP_RESET, OP_STEP, RESET_REQ, RESET_RESP, SESSION,
+                        STEP_REQ, STEP_RESP)
+from rpc import HEADER, RpcError, start_server
+
+ENV_ID = "TaxiTwoPassenger-v0"
+# One STEP reply frame: rpc header followed by the STEP_RESP payload
+_STEP_FRAME = np.dtype([("length", "<u4"), ("op", "u1"), ("req_id", "<u4"),
+                        ("obs", "<u2"), ("reward", "<i2"), ("flags", "u1"), ("mask", "u1")])
+assert _STEP_FRAME.itemsize == HEADER.size + STEP_RESP.size
+
+
+class EnvServer:
+    """Session table plus the step batcher; the `rpc.Connection` handler."""
+
+    def __init__(self, max_sessions: int = 65536, max_batch: int = 4096, batch_window: float = 0.0):
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.max_episode_steps = gym.spec(ENV_ID).max_episode_steps
+        self._packed = TaxiTwoPassengerEnv()._packed.ravel()
+
+        self._ext = np.zeros(max_sessions, dtype=np.int64)    # extended state of each slot
+        self._steps = np.zeros(max_sessions, dtype=np.int32)  # steps since the slot's last reset
+        self._ready = np.zeros(max_sessions, dtype=bool)      # reset since it was created
+        self._rngs: list[np.random.Generator | None] = [None] * max_sessions
+        self._free = list(range(max_sessions - 1, -1, -1))
+        self._sessions: dict[int, tuple] = {}  # session id -> (slot, owning connection)
+        self._owned: dict[object, set] = {}    # connection -> its session ids
+        self._ids = itertools.count(1)
+
+        self._queue_conns, self._queue_ids, self._queue_slots, self._queue_actions = [], [], [], []
+        self._queued = set()  # slots with a step waiting in the queue
+        self._flush_handle = None
+        self.steps_done = self.batches = 0
+
+    # -------------------------------------------------------------------------
+    #  rpc handler
+    # -------------------------------------------------------------------------
+    def handle(self, conn, op: int, req_id: int, payload: bytes):
+        if op == OP_STEP:
+            session, action = STEP_REQ.unpack(payload)
+            if action >= 6:
+                raise RpcError(f"invalid action {action}")
+            slot = self._slot(conn, session)
+            if not self._ready[slot]:
+                raise RpcError("cannot step a session before reset")
+            self._enqueue_step(conn, req_id, slot, action)
+        elif op == OP_RESET:
+            session, seed = RESET_REQ.unpack(payload)
+            conn.reply(op, req_id, RESET_RESP.pack(*self._reset(self._slot(conn, session), seed)))
+        elif op == OP_CREATE:
+            conn.reply(op, req_id, SESSION.pack(self._create(conn)))
+        elif op == OP_CLOSE:
+            session, = SESSION.unpack(payload)
+            self._slot(conn, session)
+            self._close(session)
+            conn.reply(op, req_id)
+        else:
+            raise RpcError(f"unknown opcode {op}")
+
+    def disconnected(self, conn):
+        for session in list(self._owned.get(conn, ())):
+            self._close(session)
+        self._owned.pop(conn, None)
+
+    # -------------------------------------------------------------------------
+    #  Sessions
+    # -------------------------------------------------------------------------
+    def _slot(self, conn, session: int) -> int:
+        entry = self._sessions.get(session)
+        if entry is None or entry[1] is not conn:
+            raise RpcError(f"unknown session {session}")
+        return entry[0]
+
+    def _create(self, conn) -> int:
+        if not self._free:
+            raise RpcError(f"server full ({len(self._sessions)} sessions)")
+        slot = self._free.pop()
+        session = next(self._ids) & 0xFFFFFFFF
+        self._sessions[session] = (slot, conn)
+        self._owned.setdefault(conn, set()).add(session)
+        self._ready[slot] = False
+        self._rngs[slot] = None
+        return session
+
+    def _close(self, session: int):
+        slot, conn = self._sessions.pop(session)
+        self._owned[conn].discard(session)
+        if slot in self._queued:  # let the queued step run; the slot is recycled after the flush
+            self._flush()
+        self._ready[slot] = False
+        self._rngs[slot] = None
+        self._free.append(slot)
+
+    def _reset(self, slot: int, seed: int):
+        """Same draws as `TaxiTwoPassengerEnv.reset` on a generator seeded like `gym.Env.reset`."""
+        if slot in self._queued:
+            self._flush()
+        rng = self._rngs[slot]
+        if seed != NO_SEED or rng is None:
+            rng = self._rngs[slot] = np.random.default_rng(None if seed == NO_SEED else seed)
+        rng.random()
+        r, c = rng.integers(5, size=2)
+        p1, p2 = rng.integers(4, size=2)
+        d1, d2 = rng.integers(4, size=2)
+        obs = CODEC.encode(r, c, p1, d1, p2, d2)
+        self._ext[slot] = obs * 4
+        self._steps[slot] = 0
+        self._ready[slot] = True
+        return obs, self._packed.item(obs * 4 * 6) >> 41
+
+    # -------------------------------------------------------------------------
+    #  Step batching
+    # -------------------------------------------------------------------------
+    def _enqueue_step(self, conn, req_id: int, slot: int, action: int):
+        if slot in self._queued:  # a second step for the same session must see the first one's result
+            self._flush()
+        self._queue_conns.append(conn)
+        self._queue_ids.append(req_id)
+        self._queue_slots.append(slot)
+        self._queue_actions.append(action)
+        self._queued.add(slot)
+        if len(self._queue_slots) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = (loop.call_later(self.batch_window, self._flush) if self.batch_window > 0
+                                  else loop.call_soon(self._flush))
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        n = len(self._queue_slots)
+        if not n:
+            return
+        slots = np.array(self._queue_slots, dtype=np.intp)
+        packed = self._packed[self._ext[slots] * 6 + np.array(self._queue_actions, dtype=np.int64)]
+        ext = packed & 0xFFFF
+        self._ext[slots] = ext
+        steps = self._steps[slots] + 1
+        self._steps[slots] = steps
+
+        frames = np.empty(n, dtype=_STEP_FRAME)
+        frames["length"] = STEP_RESP.size
+        frames["op"] = OP_STEP
+        frames["req_id"] = self._queue_ids
+        frames["obs"] = ext >> 2
+        frames["reward"] = (packed >> 17 & 0xFFFF) - 0x8000
+        frames["flags"] = (packed >> 16 & 1) | (steps >= self.max_episode_steps) << 1
+        frames["mask"] = self._packed[ext * 6] >> 41
+        data = frames.tobytes()
+
+        # One write per connection; requests from one connection are usually adjacent
+        conns, size = self._queue_conns, _STEP_FRAME.itemsize
+        start = 0
+        for i in range(1, n + 1):
+            if i == n or conns[i] is not conns[start]:
+                conns[start].reply_frames(data[start * size: i * size], i - start)
+                start = i
+
+        self._queue_conns, self._queue_ids, self._queue_slots, self._queue_actions = [], [], [], []
+        self._queued.clear()
+        self.steps_done += n
+        self.batches += 1
+
+
+async def serve(address: str, max_sessions: int, max_batch: int, batch_window: float, max_inflight: int):
+    server = EnvServer(max_sessions, max_batch, batch_window)
+    async with await start_server(server, address, max_inflight) as listener:
+        print(f"serving {ENV_ID} at {address} (max {max_sessions} sessions, batches of up to {max_batch})", flush=True)
+        try:
+            await listener.serve_forever()
+        finally:
+            if server.batches:
+                print(f"{server.steps_done:,} steps in {server.batches:,} batches "
+                      f"(mean batch {server.steps_done / server.batches:.1f})", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", default="unix:/tmp/taxi_env.sock", help="unix:/path or host:port")
+    parser.add_argument("--max-sessions", type=int, default=65536)
+    parser.add_argument("--max-batch", type=int, default=4096, help="flush the step queue at this size")
+    parser.add_argument("--batch-window-us", type=float, default=0.0,
+                        help="wait this long for more steps before flushing (0: end of the loop iteration)")
+    parser.add_argument("--max-inflight", type=int, default=256, help="unanswered requests per connection")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.address, args.max_sessions, args.max_batch, args.batch_window_us * 1e-6,
+                          args.max_inflight))
+    except KeyboardInterrupt:
+        pass
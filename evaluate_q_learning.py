@@ -1,38 +1,38 @@
 import time
-import random
 import numpy as np
 import gymnasium as gym
-from gymnasium.envs.registration import register
-
-# Register the environment
-register(
-    id="TaxiTwoPassenger-v0",
-    entry_point="multi_taxi:TaxiTwoPassengerEnv",
-    max_episode_steps=200,
-    reward_threshold=40,
-)
-
-# Load environment and q table
-env = gym.make("TaxiTwoPassenger-v0", render_mode="human")
-Q   = np.load("q_table_two_passenger.npy")
+import multi_taxi  # noqa: F401  (registers TaxiTwoPassenger-v0)
+from checkpoint import load_q_table
+from policy import load_or_compile, masked_greedy
+from trajectory import TrajectoryRecorder
+
+# Load environment and the compiled greedy policy (built next to the q table on first use)
+env    = gym.make("TaxiTwoPassenger-v0", render_mode="human")
+policy = load_or_compile("q_table_two_passenger.npy")
+use_action_mask = False  # restrict the greedy choice to info["action_mask"]
+Q      = load_q_table("q_table_two_passenger.npy") if use_action_mask else None  # masked choice needs the values
+rng    = np.random.default_rng()
+trajectory_path = None   # e.g. "runs/evaluate": record every step; inspect with `python trajectory.py replay`
+if trajectory_path:
+    env = TrajectoryRecorder(env, trajectory_path, append=True)
 
 episodes  = 5
 max_steps = 200
 
 for ep in range(episodes):
-    state, _ = env.reset()
+    state, info = env.reset()
     env.render()
     total_reward = 0
     print(f"\n--- Episode {ep + 1} ---")
 
     for step in range(max_steps):
         # Greedy action, random tie-break
-        q_vals       = Q[state]
-        max_q        = q_vals.max()
-        best_actions = np.where(np.isclose(q_vals, max_q, atol=1e-8))[0]
-        action       = int(random.choice(best_actions))
+        if use_action_mask:
+            action = int(masked_greedy(Q[state][None], info["action_mask"][None] == 1, rng)[0])
+        else:
+            action = policy.act(state)
 
-        next_state, reward, terminated, truncated, _ = env.step(action)
+        next_state, reward, terminated, truncated, info = env.step(action)
         total_reward += reward
 
         print(f"Step {step + 1}")
@@ -0,0 +1,105 @@
+"""Optional hot-path counters and latency sampling for the taxi envs.
+
+`EnvStats` counts how often each reward branch of `TaxiTwoPassengerEnv.step` fires
+and times every `sample_every`-th call. Envs only touch it when instrumentation is
+switched on, so the uninstrumented step path pays nothing. Snapshots are plain
+dicts and can be merged across vector slots or worker processes.
+"""
+import time
+
+import numpy as np
+
+# Bit order of the per-transition event flags produced by `multi_taxi._batch_step`
+EVENT_NAMES = (
+    "wall_hit",
+    "obstacle_hit",
+    "illegal_pickup",
+    "illegal_dropoff",
+    "shaping_bonus",
+    "completion_bonus",
+    "pickup",
+    "dropoff",
+)
+_BITS = np.arange(len(EVENT_NAMES), dtype=np.uint8)
+
+
+class EnvStats:
+    """Event counters plus a fixed-size reservoir of sampled call latencies (ns)."""
+
+    def __init__(self, sample_every: int = 64, max_samples: int = 4096):
+        self.sample_every = sample_every
+        self.calls = 0
+        self.transitions = 0
+        self.resets = 0
+        self.by_value = [0] * 256  # transitions per event bitmask; split into bits on snapshot
+        self.latencies = np.zeros(max_samples, dtype=np.int64)
+        self.n_samples = 0
+
+    def start_call(self) -> int:
+        """Count a call; returns a start timestamp if this call is sampled, else 0."""
+        self.calls += 1
+        return time.perf_counter_ns() if self.calls % self.sample_every == 0 else 0
+
+    def end_call(self, t0: int):
+        if t0:
+            self.latencies[self.n_samples % len(self.latencies)] = time.perf_counter_ns() - t0
+            self.n_samples += 1
+
+    def record(self, events: int):
+        self.transitions += 1
+        self.by_value[events] += 1
+
+    def record_batch(self, events: np.ndarray):
+        self.transitions += len(events)
+        for value, n in enumerate(np.bincount(events, minlength=256).tolist()):
+            self.by_value[value] += n
+
+    @property
+    def counts(self) -> list[int]:
+        by_value = np.array(self.by_value)
+        return [int(by_value[(np.arange(256) >> bit) & 1 == 1].sum()) for bit in _BITS]
+
+    def snapshot(self) -> dict:
+        samples = self.latencies[: min(self.n_samples, len(self.latencies))]
+        return {
+            "calls": self.calls,
+            "transitions": self.transitions,
+            "resets": self.resets,
+            "events": dict(zip(EVENT_NAMES, self.counts)),
+            "latency_samples_ns": samples.tolist(),
+            "latency_ns": _latency_summary(samples),
+        }
+
+
+def _latency_summary(samples) -> dict:
+    samples = np.asarray(samples)
+    if not len(samples):
+        return {"samples": 0}
+    p50, p90, p99 = np.percentile(samples, (50, 90, 99))
+    return {"samples": len(samples), "mean": float(samples.mean()), "p50": float(p50),
+            "p90": float(p90), "p99": float(p99), "max": int(samples.max())}
+
+
+def merge_snapshots(snapshots) -> dict:
+    """Combine snapshots from several envs or worker processes into one."""
+    snapshots = [s for s in snapshots if s]
+    samples = [x for s in snapshots for x in s["latency_samples_ns"]]
+    return {
+        "calls": sum(s["calls"] for s in snapshots),
+        "transitions": sum(s["transitions"] for s in snapshots),
+        "resets": sum(s["resets"] for s in snapshots),
+        "events": {name: sum(s["events"][name] for s in snapshots) for name in EVENT_NAMES},
+        "latency_samples_ns": samples,
+        "latency_ns": _latency_summary(samples),
+    }
+
+
+def format_snapshot(snapshot: dict) -> str:
+    n = max(1, snapshot["transitions"])
+    lines = [f"{snapshot['transitions']:,} transitions in {snapshot['calls']:,} calls, {snapshot['resets']:,} resets"]
+    lines += [f"  {name:<17} {count:>12,}  ({count / n:6.2%})" for name, count in snapshot["events"].items()]
+    lat = snapshot["latency_ns"]
+    if lat["samples"]:
+        lines.append(f"  call latency      mean {lat['mean']:,.0f} ns  p50 {lat['p50']:,.0f}  "
+                     f"p99 {lat['p99']:,.0f}  max {lat['max']:,} ({lat['samples']} samples)")
+    return "\n".join(lines)
@@ -0,0 +1,306 @@
+"""Taxi with K passengers: the `TaxiTwoPassengerEnv` rules for any number of riders.
+
+Observations use the same big-endian mixed-radix layout as `TaxiTwoPassengerEnv.encode`,
+extended to K (pickup location, destination) pairs: (row, col, p1, d1, ..., pK, dK).
+Passenger index 4 means "in the taxi". Pickup, dropoff, shaping and completion rewards
+carry over unchanged. With ``k=2`` the encoding and every transition match
+`TaxiTwoPassengerEnv`. `step_batch` keeps passengers along the last axis of [N, K]
+arrays, so a batch step is the same few array operations whatever K is; the scalar
+`step` walks plain lists.
+
+State space and memory per K (float32 Q-table of shape (n_states, 6)):
+
+     K    observations    dense Q-table
+     1             500          12 KB
+     2          10 000         240 KB
+     3         200 000         4.8 MB
+     4       4 000 000          96 MB
+     5      80 000 000         1.9 GB
+     6   1 600 000 000          38 GB
+
+Dense tables are practical up to K = 4. Beyond that, most encoded states can never
+occur, for example any state where two passengers share the taxi. Store only the
+states that are visited. ``python k_passenger_taxi.py --memory`` prints the table,
+including the extended (hidden delivered flag) model sizes, and ``--bench`` measures
+step and codec throughput per K.
+
+    python k_passenger_taxi.py --bench --k 2,3,4,6
+"""
+import argparse
+import time
+from functools import lru_cache
+
+import numpy as np
+import gymnasium as gym
+from gymnasium import spaces
+from gymnasium.envs.toy_text.taxi import MAP
+
+from multi_taxi import _ACTIONS, _layout_arrays
+from state_codec import StateCodec
+
+if "TaxiKPassenger-v0" not in gym.registry:
+    gym.register(
+        id="TaxiKPassenger-v0",
+        entry_point="k_passenger_taxi:TaxiKPassengerEnv",
+        max_episode_steps=400,
+        kwargs={"k": 3},
+    )
+
+
+@lru_cache(maxsize=None)
+def k_passenger_codec(k: int) -> StateCodec:
+    """The `StateCodec` for (row, col, p1, d1, ..., pK, dK), shared by every env with this K."""
+    fields = ("taxi_row", "taxi_col") + tuple(f"{name}{i}" for i in range(1, k + 1) for name in ("p", "d"))
+    return StateCodec((5, 5) + (5, 4) * k, fields)
+
+
+def state_counts(k: int) -> tuple[int, int]:
+    """(observations, extended states) for K passengers."""
+    n_obs = 25 * 20**k
+    return n_obs, n_obs << k
+
+
+def _batch_step_k(layout, r, c, p, d, delivered, action):
+    """`multi_taxi._batch_step` with passengers along the last axis of [N, K] arrays.
+
+    Returns (r, c, p, delivered, reward, terminated, events); inputs are left untouched.
+    """
+    can_right, can_left, blocked, loc_r, loc_c = layout
+    n, k = p.shape
+    rows = np.arange(n)
+
+    down, up = (action == 0) & (r < 4), (action == 1) & (r > 0)
+    right, left = (action == 2) & can_right[r, c], (action == 3) & can_left[r, c]
+    new_r = r + down - up
+    new_c = c + right - left
+    wall = (action < 4) & ~(down | up | right | left)
+    hit = blocked[new_r, new_c]
+    new_r = np.where(hit, r, new_r)
+    new_c = np.where(hit, c, new_c)
+    reward = np.where(wall | hit, -11, -1).astype(np.int32)
+
+    def at(loc):
+        return (loc_r[loc] == new_r[:, None]) & (loc_c[loc] == new_c[:, None])
+
+    occupied = (p == 4).any(axis=1)
+    rider = (p == 4).argmax(axis=1)
+    carrying = occupied[:, None] & (np.arange(k) == rider[:, None])  # the first rider, as in the 2-passenger env
+    new_p, new_delivered = p.copy(), delivered.copy()
+
+    # Pickup: the lowest-numbered passenger waiting at the taxi gets in
+    pickup = action == 4
+    waiting_here = (p < 4) & at(p) & ~delivered
+    take = pickup & ~occupied & waiting_here.any(axis=1)
+    new_p[rows[take], waiting_here.argmax(axis=1)[take]] = 4
+    reward = np.where(pickup, np.where(take, reward + 10, -10), reward)
+
+    # Dropoff: only at the rider's own destination
+    dropoff = action == 5
+    drop = dropoff & occupied & at(d)[rows, rider]
+    new_p[rows[drop], rider[drop]] = d[rows[drop], rider[drop]]
+    new_delivered[rows[drop], rider[drop]] = True
+    reward = np.where(dropoff, np.where(drop, 20, -10), reward)
+
+    # Reward shaping on the pre-step layout: +1 per waiting passenger (empty taxi)
+    # or per rider destination that the move brought closer
+    def closer(loc):
+        old = np.abs(loc_r[loc] - r[:, None]) + np.abs(loc_c[loc] - c[:, None])
+        new = np.abs(loc_r[loc] - new_r[:, None]) + np.abs(loc_c[loc] - new_c[:, None])
+        return new < old
+
+    shaping = (
+        (~occupied[:, None] & (p < 4) & ~new_delivered & closer(p))
+        | (carrying & ~new_delivered & closer(d))
+    ).sum(axis=1, dtype=np.int32)
+    reward += shaping
+
+    terminated = new_delivered.all(axis=1)
+    reward += np.where(terminated, 100, 0)
+
+    events = np.zeros(n, dtype=np.uint8)
+    for bit, hit_event in enumerate((
+        wall, hit, pickup & ~take, dropoff & ~drop, shaping > 0, terminated, take, drop,
+    )):
+        events |= hit_event.astype(np.uint8) << bit
+    return new_r, new_c, new_p, new_delivered, reward, terminated, events
+
+
+class TaxiKPassengerEnv(gym.Env):
+    """5 × 5 grid, `k` passengers, otherwise the same rules as `TaxiTwoPassengerEnv`."""
+
+    metadata = {"render_modes": []}
+
+    def __init__(self, k: int = 3, render_mode: str | None = None):
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        self.k = k
+        self.desc = np.asarray(MAP, dtype="c")
+        self.locs = [(0, 0), (0, 4), (4, 0), (4, 3)]
+        self.obstacles = {(1, 1), (3, 3)}
+        self.codec = k_passenger_codec(k)
+        self.observation_space = spaces.Discrete(self.codec.n_states)
+        self.action_space = spaces.Discrete(6)
+        self.render_mode = render_mode
+        self._layout = _layout_arrays(self.desc, self.locs, self.obstacles)
+        self._can_right, self._can_left = self._layout[0].tolist(), self._layout[1].tolist()
+        self.lastaction = None
+
+    # --- Codec ---------------------------------------------------------------
+    def encode(self, r, c, p, d, check: bool = True) -> np.ndarray:
+        """Observation index from taxi position and [..., K] passenger location/destination arrays."""
+        p, d = np.asarray(p), np.asarray(d)
+        pairs = (field for i in range(self.k) for field in (p[..., i], d[..., i]))
+        return self.codec.encode_batch(r, c, *pairs, check=check)
+
+    def decode(self, s, check: bool = True):
+        """Inverse of `encode`: (r, c, p[..., K], d[..., K]) as int64 arrays."""
+        fields = self.codec.decode_batch(s, dtype=np.int64, check=check)
+        return fields[0], fields[1], np.stack(fields[2::2], axis=-1), np.stack(fields[3::2], axis=-1)
+
+    def encode_ext(self, s, delivered) -> np.ndarray:
+        """Extended state: the observation plus the K hidden delivered flags (bit i = passenger i)."""
+        bits = np.asarray(delivered, dtype=np.int64) << np.arange(self.k)
+        return (np.asarray(s, dtype=np.int64) << self.k) | bits.sum(axis=-1)
+
+    def decode_ext(self, i):
+        i = np.asarray(i, dtype=np.int64)
+        return i >> self.k, (i[..., None] >> np.arange(self.k) & 1).astype(bool)
+
+    # --- Dynamics ------------------------------------------------------------
+    def _encode_one(self, r: int, c: int, p, d) -> int:
+        """`codec.encode` for the plain lists of `step`, whose fields are in range by construction."""
+        i = r * 5 + c
+        for pi, di in zip(p, d):
+            i = (i * 5 + pi) * 4 + di
+        return i
+
+    def reset(self, *, seed: int | None = None, options=None):
+        super().reset(seed=seed)
+        rng = self.np_random
+        self.taxi_row, self.taxi_col = rng.integers(5, size=2).tolist()
+        self.p = rng.integers(4, size=self.k).tolist()
+        self.d = rng.integers(4, size=self.k).tolist()
+        self.delivered = [False] * self.k
+        self.lastaction = None
+        self.s = self._encode_one(self.taxi_row, self.taxi_col, self.p, self.d)
+        return self.s, {}
+
+    def step(self, action: int):
+        """Plain-Python step over lists; `_batch_step_k` is the array version of the same rules."""
+        assert action in _ACTIONS
+        r, c, p, d, delivered, locs = self.taxi_row, self.taxi_col, self.p, self.d, self.delivered, self.locs
+        can_right, can_left = self._can_right, self._can_left
+        nr, nc = r, c
+        if action == 0 and r < 4:
+            nr += 1
+        elif action == 1 and r > 0:
+            nr -= 1
+        elif action == 2 and can_right[r][c]:
+            nc += 1
+        elif action == 3 and can_left[r][c]:
+            nc -= 1
+        reward = -11 if action < 4 and nr == r and nc == c else -1
+        if (nr, nc) in self.obstacles:
+            nr, nc, reward = r, c, -11
+
+        rider = p.index(4) if 4 in p else None
+        if action == 4:
+            reward = -10
+            if rider is None:
+                for i in range(self.k):
+                    if p[i] < 4 and not delivered[i] and locs[p[i]] == (nr, nc):
+                        p[i], reward = 4, 9
+                        break
+        elif action == 5:
+            reward = -10
+            if rider is not None and locs[d[rider]] == (nr, nc):
+                p[rider], delivered[rider], reward = d[rider], True, 20
+        elif nr != r or nc != c:
+            # Reward shaping: +1 for each target the move brought closer
+            if rider is None:
+                targets = [locs[pi] for pi, done in zip(p, delivered) if pi < 4 and not done]
+            else:
+                targets = [] if delivered[rider] else [locs[d[rider]]]
+            for tr, tc in targets:
+                reward += abs(tr - nr) + abs(tc - nc) < abs(tr - r) + abs(tc - c)
+
+        terminated = all(delivered)
+        if terminated:
+            reward += 100
+        self.taxi_row, self.taxi_col = nr, nc
+        self.lastaction = action
+        self.s = self._encode_one(nr, nc, p, d)
+        return self.s, reward, terminated, False, {}
+
+    def step_batch(self, ext_states, actions):
+        """Step many extended states at once; returns (next_ext_states, rewards, terminated, events)."""
+        s, delivered = self.decode_ext(ext_states)
+        r, c, p, d = self.decode(s)
+        r, c, p, delivered, reward, terminated, events = _batch_step_k(
+            self._layout, r, c, p, d, delivered, np.asarray(actions)
+        )
+        return self.encode_ext(self.encode(r, c, p, d, check=False), delivered), reward, terminated, events
+
+    def sample_ext_starts(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        """`n` extended start states from the `reset` distribution."""
+        r, c = rng.integers(5, size=(2, n))
+        p, d = rng.integers(4, size=(2, n, self.k))
+        return self.encode(r, c, p, d) << self.k
+
+
+# -----------------------------------------------------------------------------
+#  Memory guidance and benchmarks
+# -----------------------------------------------------------------------------
+def _fmt_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if n < 1000:
+            return f"{n:,.0f} {unit}" if unit == "B" else f"{n:,.1f} {unit}"
+        n /= 1000
+    return f"{n:,.1f} PB"
+
+
+def memory_table(ks):
+    print(f"{'K':>2}  {'observations':>15}  {'extended':>17}  {'Q float32':>10}  {'packed model':>12}")
+    for k in ks:
+        n_obs, n_ext = state_counts(k)
+        print(f"{k:>2}  {n_obs:>15,}  {n_ext:>17,}  {_fmt_bytes(n_obs * 6 * 4):>10}  {_fmt_bytes(n_ext * 6 * 8):>12}")
+
+
+def bench(ks, n: int = 20000, batch: int = 4096):
+    print(f"{'K':>2}  {'scalar steps/s':>14}  {'batch steps/s':>14}  {'decode states/s':>15}")
+    for k in ks:
+        env = TaxiKPassengerEnv(k)
+        env.reset(seed=0)
+        actions = np.random.default_rng(0).integers(6, size=n).tolist()
+        start = time.perf_counter()
+        for t, a in enumerate(actions):
+            _, _, terminated, _, _ = env.step(a)
+            if terminated or t % 200 == 199:
+                env.reset()
+        scalar = n / (time.perf_counter() - start)
+
+        rng = np.random.default_rng(0)
+        states = env.sample_ext_starts(rng, batch)
+        rounds = max(1, 5 * n // batch)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            states = env.step_batch(states, rng.integers(6, size=batch))[0]
+        batched = rounds * batch / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        env.decode(states >> k)
+        decode = batch / (time.perf_counter() - start)
+        print(f"{k:>2}  {scalar:>14,.0f}  {batched:>14,.0f}  {decode:>15,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", default="1,2,3,4,5,6", help="comma-separated passenger counts")
+    parser.add_argument("--memory", action="store_true", help="print state counts and table sizes")
+    parser.add_argument("--bench", action="store_true", help="measure step and codec throughput")
+    args = parser.parse_args()
+    ks = [int(k) for k in args.k.split(",")]
+    if args.memory or not args.bench:
+        memory_table(ks)
+    if args.bench:
+        bench(ks)
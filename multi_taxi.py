@@ -1,19 +1,39 @@
-import pygame
 import numpy as np
-import time
+import hashlib
+import os
+from functools import cached_property
+from typing import NamedTuple
 import gymnasium as gym
 from gymnasium import spaces
-from gymnasium.envs.toy_text.taxi import TaxiEnv
+from gymnasium.envs.toy_text.taxi import MAP, TaxiEnv
+from gymnasium.error import DependencyNotInstalled
+from instrumentation import EnvStats
+from state_codec import StateCodec
 
 # -----------------------------------------------------------------------------
 #  Environment registration (so `gym.make()` can find it)
 # -----------------------------------------------------------------------------
-gym.register(
-    id="TaxiTwoPassenger-v0",
-    entry_point="multi_taxi:TaxiTwoPassengerEnv",
-    max_episode_steps=200,
-    reward_threshold=40,  # 2 passengers × +20 each
-)
+# Idempotent, so reloading this module (or importing it under two names) does not
+# warn. Rendering imports pygame lazily in `_render_gui`, which keeps this module
+# importable, and cheap to import, in headless workers.
+if "TaxiTwoPassenger-v0" not in gym.registry:
+    gym.register(
+        id="TaxiTwoPassenger-v0",
+        entry_point="multi_taxi:TaxiTwoPassengerEnv",
+        max_episode_steps=200,
+        reward_threshold=40,  # 2 passengers × +20 each
+    )
+
+_ACTIONS = frozenset(range(6))
+# One read-only template per 6-bit mask. `info["action_mask"]` is a copy, because gymnasium's
+# env checker warns when the infos of `reset` and the following `step` share an object
+_ACTION_MASKS = tuple(np.array([(m >> a) & 1 for a in range(6)], dtype=np.int8) for m in range(64))
+for _mask in _ACTION_MASKS:
+    _mask.flags.writeable = False
+ENCODING_VERSION = 1  # observation layout of `CODEC`
+# The one codec for observations; everything that encodes or decodes states goes through it
+CODEC = StateCodec((5, 5, 5, 4, 5, 4), ("taxi_row", "taxi_col", "p1", "d1", "p2", "d2"))
+_TAXI_V3_CODEC = StateCodec((5, 5, 5, 4), ("taxi_row", "taxi_col", "passenger", "destination"))
 
 # -----------------------------------------------------------------------------
 #  TaxiTwoPassengerEnv
@@ -22,141 +42,138 @@ class TaxiTwoPassengerEnv(TaxiEnv):
     """5 × 5 grid, two passengers, otherwise same rules as Taxi-v3."""
 
     # 25 cells × (5 locs × 4 dests)²  = 10 000 states
-    observation_space: spaces.Discrete = spaces.Discrete(25 * 5 * 4 * 5 * 4)
+    observation_space: spaces.Discrete = spaces.Discrete(CODEC.n_states)
+    codec = CODEC
 
     def __init__(self, render_mode: str | None = None):
-        super().__init__(render_mode=render_mode)
+        # TaxiEnv.__init__ is deliberately skipped: it builds the 500-state Taxi-v3 `P`
+        # dict, which this env never uses. Only the attributes we rely on are set here.
+        self.desc = np.asarray(MAP, dtype="c")
+        self.locs = [(0, 0), (0, 4), (4, 0), (4, 3)]
+        self.locs_colors = [(255, 0, 0), (0, 255, 0), (255, 255, 0), (0, 0, 255)]
+        self.max_row, self.max_col = 4, 4
+        self.action_space = spaces.Discrete(6)
         self.observation_space = TaxiTwoPassengerEnv.observation_space
+        self.render_mode = render_mode
+        self.fickle_passenger = self.fickle_step = False
+        self.lastaction = None
         self.window, self.clock = None, None
         self.passenger_in_taxi: int | None = None  # 0,1, or None (stores index 0 or 1)
         self.obstacles = {(1, 1), (3, 3)} #locations of obstacles
         self.passengers_delivered = [False, False] # [passenger1_delivered, passenger2_delivered]
+        self.stats: EnvStats | None = None
+
+    def enable_instrumentation(self, sample_every: int = 64):
+        """Start counting reward-branch events and sampling step latency.
+
+        The instrumented step/reset are installed as instance attributes, so the
+        normal class methods stay untouched and cost nothing while this is off.
+        """
+        self.stats = EnvStats(sample_every)
+        self.step, self.reset = self._instrumented_step, self._instrumented_reset
+
+    def disable_instrumentation(self):
+        self.stats = None
+        self.__dict__.pop("step", None)
+        self.__dict__.pop("reset", None)
+
+    def stats_snapshot(self) -> dict | None:
+        return None if self.stats is None else self.stats.snapshot()
+
+    def _instrumented_step(self, action: int):
+        stats = self.stats
+        t0 = stats.start_call()
+        events = self._packed.item(self.encode_ext(self.s, *self.passengers_delivered) * 6 + action) >> 33 & 0xFF
+        out = TaxiTwoPassengerEnv.step(self, action)
+        stats.end_call(t0)
+        stats.record(events)
+        return out
+
+    def _instrumented_reset(self, *, seed: int | None = None, options=None):
+        self.stats.resets += 1
+        return TaxiTwoPassengerEnv.reset(self, seed=seed, options=options)
+
+    @cached_property
+    def model(self) -> "TransitionModel":
+        """Compiled tables for this layout, built (or mapped from disk) on first use."""
+        return load_model(self.desc, self.locs, self.obstacles)
+
+    @cached_property
+    def _packed(self) -> np.ndarray:
+        return load_model(self.desc, self.locs, self.obstacles, packed=True)
+
+    @cached_property
+    def P(self):
+        """Toy-text style `P[s][a] = [(prob, next_s, reward, terminated)]` over extended states."""
+        m = self.model
+        return {
+            s: {a: [(1.0, int(m.next_state[s, a]), int(m.reward[s, a]), bool(m.terminated[s, a]))] for a in range(6)}
+            for s in range(N_EXT_STATES)
+        }
 
     @staticmethod
     def encode(r: int, c: int, p1: int, d1: int, p2: int | None = None, d2: int | None = None) -> int:
-        """If p2/d2 omitted => fall back to Taxi-v3 encoding (500 states)."""
+        """`CODEC.encode`, or `encode_batch` for arrays. If p2/d2 omitted => Taxi-v3 encoding (500 states)."""
         if p2 is None or d2 is None:
-            i = r; i = i * 5 + c; i = i * 5 + p1; i = i * 4 + d1
-            return i
-        i = r; i = i * 5 + c; i = i * 5 + p1; i = i * 4 + d1; i = i * 5 + p2; i = i * 4 + d2
-        return i
+            fields, codec = (r, c, p1, d1), _TAXI_V3_CODEC
+        else:
+            fields, codec = (r, c, p1, d1, p2, d2), CODEC
+        if any(isinstance(f, np.ndarray) for f in fields):
+            return codec.encode_batch(*fields)
+        return codec.encode(*fields)
 
     @staticmethod
-    def decode(i: int):
-        dest = i % 4; i //= 4
-        passenger = i % 5; i //= 5
-        c = i % 5; i //= 5
-        r = i
-        return r, c, passenger, dest
+    def encode_ext(s: int, delivered1: bool, delivered2: bool) -> int:
+        """Extended state: the observation plus the hidden delivered flags (40 000 states).
+
+        `passenger_in_taxi` needs no extra bits: it is 0/1 exactly when p1/p2 == 4.
+        """
+        return s * 4 + delivered1 + 2 * delivered2
+
+    @staticmethod
+    def decode_ext(i: int):
+        return i >> 2, bool(i & 1), bool(i & 2)
 
     @staticmethod
-    def decode6(i: int):
-        d2 = i % 4; i //= 4
-        p2 = i % 5; i //= 5
-        d1 = i % 4; i //= 4
-        p1 = i % 5; i //= 5
-        c = i % 5; i //= 5
-        r = i
-        return r, c, p1, d1, p2, d2
+    def decode(i: int):
+        """(r, c, p1, d1, p2, d2) of an observation; arrays give int64 arrays (see `CODEC.decode_batch`)."""
+        if isinstance(i, np.ndarray):
+            return CODEC.decode_batch(i, dtype=np.int64)
+        return CODEC.decode(i)
+
+    decode6 = decode  # the name used before `decode` covered the two-passenger layout
 
     def _generate_random_state(self, rng):
         r, c = rng.integers(5, size=2)
         p1, p2 = rng.integers(4, size=2)
         d1, d2 = rng.integers(4, size=2)
         self.passenger_in_taxi = None
-        return self.encode(r, c, p1, d1, p2, d2)
+        return CODEC.encode(r, c, p1, d1, p2, d2)
 
     def reset(self, *, seed: int | None = None, options=None):
         self.passenger_in_taxi = None
         self.passengers_delivered = [False, False]
-        orig_mode, self.render_mode = self.render_mode, None
-        super().reset(seed=seed)
-        self.render_mode = orig_mode
+        self.lastaction = None
+        gym.Env.reset(self, seed=seed)
+        self.np_random.random()  # TaxiEnv.reset draws a Taxi-v3 start here; keep seeded streams unchanged
         self.s = self._generate_random_state(self.np_random)
         self.state = self.s
         if self.render_mode == "human":
             self._render_gui("human")
-        return int(self.s), {}
+        return int(self.s), {"action_mask": _ACTION_MASKS[self._packed.item(self.encode_ext(self.s, False, False) * 6) >> 41].copy()}
 
     def step(self, action: int):
-        assert self.action_space.contains(action)
-        reward, terminated = -1, False # Default reward is -1 per step
-        r, c, p1, d1, p2, d2 = self.decode6(self.s)
-
-        # Store current taxi, passenger locations, and passenger in taxi status for reward shaping
-        old_r, old_c = r, c
-        old_p1_loc, old_p2_loc = p1, p2 # Store passenger locations BEFORE action
-        old_passenger_in_taxi = self.passenger_in_taxi
-
-        # Movement and illegal move penalties
-        r, c, illegal = self._move(r, c, action)
-        reward += illegal
-
-        if action == 4: # Pickup action
-            if self.passenger_in_taxi is None: # Only allow pickup if taxi is empty
-                if p1 < 4 and (r, c) == self.locs[p1] and not self.passengers_delivered[0]:
-                    p1, self.passenger_in_taxi = 4, 0
-                    reward += 10 # Increased reward for successful pickup
-                elif p2 < 4 and (r, c) == self.locs[p2] and not self.passengers_delivered[1]:
-                    p2, self.passenger_in_taxi = 4, 1
-                    reward += 10 # Increased reward for successful pickup
-                else:
-                    reward = -10 # Illegal pickup (no passenger at location or already delivered)
-            else: # Taxi already has a passenger
-                reward = -10 # Illegal pickup
-        elif action == 5: # Dropoff action
-            if self.passenger_in_taxi == 0 and p1 == 4 and (r, c) == self.locs[d1]:
-                p1, self.passenger_in_taxi = d1, None
-                self.passengers_delivered[0] = True
-                reward = +20 # Large reward for delivering passenger 1
-            elif self.passenger_in_taxi == 1 and p2 == 4 and (r, c) == self.locs[d2]:
-                p2, self.passenger_in_taxi = d2, None
-                self.passengers_delivered[1] = True
-                reward = +20 # Large reward for delivering passenger 2
-            else:
-                reward = -10 # Illegal dropoff
-
-        self.s = self.encode(r, c, p1, d1, p2, d2)
-        self.state = self.s
+        assert action in _ACTIONS
+        delivered1, delivered2 = self.passengers_delivered
+        packed = self._packed.item((self.s * 4 + delivered1 + 2 * delivered2) * 6 + action)  # encode_ext, inlined
+        ns, terminated, reward = packed & 0xFFFF, bool(packed & 0x10000), (packed >> 17 & 0xFFFF) - 0x8000
 
-        # --- Reward Shaping for movement progress ---
-        # Reward for moving closer to a passenger
-        if old_passenger_in_taxi is None: # Only if taxi is empty
-            # Check for passenger 1
-            if old_p1_loc < 4 and not self.passengers_delivered[0]:
-                target_row, target_col = self.locs[old_p1_loc]
-                old_dist = abs(target_row - old_r) + abs(target_col - old_c)
-                new_dist = abs(target_row - r) + abs(target_col - c)
-                if new_dist < old_dist:
-                    reward += 1 # More substantial reward for moving closer to an available passenger
-            # Check for passenger 2
-            if old_p2_loc < 4 and not self.passengers_delivered[1]:
-                target_row, target_col = self.locs[old_p2_loc]
-                old_dist = abs(target_row - old_r) + abs(target_col - old_c)
-                new_dist = abs(target_row - r) + abs(target_col - c)
-                if new_dist < old_dist:
-                    reward += 1 # More substantial reward for moving closer to an available passenger
-        else: # If a passenger is in the taxi, reward for moving closer to *their* destination
-            if old_passenger_in_taxi == 0 and not self.passengers_delivered[0]: # Passenger 1 in taxi
-                target_row, target_col = self.locs[d1]
-                old_dist = abs(target_row - old_r) + abs(target_col - old_c)
-                new_dist = abs(target_row - r) + abs(target_col - c)
-                if new_dist < old_dist:
-                    reward += 1 # More substantial reward for moving closer to the destination
-            elif old_passenger_in_taxi == 1 and not self.passengers_delivered[1]: # Passenger 2 in taxi
-                target_row, target_col = self.locs[d2]
-                old_dist = abs(target_row - old_r) + abs(target_col - old_c)
-                new_dist = abs(target_row - r) + abs(target_col - c)
-                if new_dist < old_dist:
-                    reward += 1 # More substantial reward for moving closer to the destination
-
-        # Episode terminates only if *both* passengers are delivered
-        if self.passengers_delivered[0] and self.passengers_delivered[1]:
-            terminated = True
-            # A final bonus for completing the overall task
-            reward += 100 # Significant bonus for successful completion
-
-        return int(self.s), reward, terminated, False, {}
+        self.s = ns >> 2
+        self.state = self.s
+        self.passengers_delivered = [bool(ns & 1), bool(ns & 2)]
+        _, _, p1, _, p2, _ = CODEC.decode(self.s)
+        self.passenger_in_taxi = 0 if p1 == 4 else 1 if p2 == 4 else None
+        return int(self.s), reward, terminated, False, {"action_mask": _ACTION_MASKS[self._packed.item(ns * 6) >> 41].copy()}
 
     def _move(self, row: int, col: int, action: int):
         new_row, new_col = row, col
@@ -182,65 +199,395 @@ class TaxiTwoPassengerEnv(TaxiEnv):
 
         return new_row, new_col, illegal
 
-    def _render_gui(self, mode):
-        if self.window is None:
-            pygame.init()
-            pygame.display.init()
-            self.window = pygame.display.set_mode((700, 400))
-            pygame.display.set_caption("Taxi – Two Passengers")
-        if self.clock is None:
-            self.clock = pygame.time.Clock()
-
-
-        WHITE, BLACK = (255,255,255), (0,0,0)
-        YELLOW, ORANGE = (255,255,0), (255,165,0)
-        RED, GREEN, BLUE = (255,0,0), (0,200,0), (0,0,255)
-        cell_w, cell_h, border = 100, 80, 4
-        self.window.fill(WHITE)
-        for c in range(6): pygame.draw.line(self.window, BLACK, (c*cell_w,0), (c*cell_w,cell_h*5),border)
-        for r in range(6): pygame.draw.line(self.window, BLACK, (0,r*cell_h), (cell_w*5,r*cell_h),border)
+    # --- Rendering -----------------------------------------------------------
+    # The board, obstacles, destinations and legend never change, so they are drawn
+    # once into `_board`. Each frame only erases last frame's sprites from that
+    # cached board and draws the taxi and passengers again (dirty rects).
+    WINDOW_SIZE = (700, 400)
+    CELL_W, CELL_H, BORDER = 100, 80, 4
+    WHITE, BLACK, GRAY = (255, 255, 255), (0, 0, 0), (160, 160, 160)
+    YELLOW, ORANGE = (255, 255, 0), (255, 165, 0)
+    DEST_COLORS = [(255, 0, 0), (0, 200, 0), (255, 255, 0), (0, 0, 255)]
+    LEGEND = [
+        ("Taxi", "Yellow rectangle"),
+        ("Passenger 1", "Black circle"),
+        ("Passenger 2", "Orange circle"),
+        ("Destinations", "Colored squares"),
+        ("Obstacle", "Gray square"),
+    ]
 
-        GRAY = (160, 160, 160)
+    def _draw_board(self):
+        import pygame
+        cell_w, cell_h, border = self.CELL_W, self.CELL_H, self.BORDER
+        board = pygame.Surface(self.WINDOW_SIZE)
+        board.fill(self.WHITE)
+        for c in range(6): pygame.draw.line(board, self.BLACK, (c*cell_w,0), (c*cell_w,cell_h*5),border)
+        for r in range(6): pygame.draw.line(board, self.BLACK, (0,r*cell_h), (cell_w*5,r*cell_h),border)
         for (r, c) in self.obstacles:
-            obs_rect = pygame.Rect(c*cell_w+10, r*cell_h+10, cell_w-20, cell_h-20)
-            pygame.draw.rect(self.window, GRAY, obs_rect)
-        row, col, p1, d1, p2, d2 = self.decode6(self.s)
-        dest_colors = [RED, GREEN, YELLOW, BLUE]
+            pygame.draw.rect(board, self.GRAY, pygame.Rect(c*cell_w+10, r*cell_h+10, cell_w-20, cell_h-20))
         for idx,(rr,cc) in enumerate(self.locs):
             rect = pygame.Rect(cc*cell_w+10, rr*cell_h+10, cell_w-20, cell_h-20)
-            pygame.draw.rect(self.window, dest_colors[idx], rect, width=border)
-        def pos(i): return self.locs[i][1], self.locs[i][0]
+            pygame.draw.rect(board, self.DEST_COLORS[idx], rect, width=border)
+        font = pygame.font.SysFont(None,18)
+        for i,(title,desc) in enumerate(self.LEGEND):
+            board.blit(font.render(f"{title}: {desc}", True, self.BLACK), (520,20 + i*25))
+        return board
+
+    def _draw_sprites(self, surface):
+        """Draw the taxi and passengers for the current state; returns the rects touched."""
+        import pygame
+        cell_w, cell_h = self.CELL_W, self.CELL_H
+        row, col, p1, d1, p2, d2 = CODEC.decode(self.s)
+        rects = []
+
+        def passenger(loc, color, width=0):
+            cy, cx = self.locs[loc]
+            rects.append(pygame.draw.circle(surface, color, (cx*cell_w+cell_w//2, cy*cell_h+cell_h//2), 10, width))
+
         if p1<4: # Passenger 1 is at a location
-            cx,cy = pos(p1)
-            pygame.draw.circle(self.window, BLACK, (cx*cell_w+cell_w//2, cy*cell_h+cell_h//2),10)
+            passenger(p1, self.BLACK)
         elif self.passengers_delivered[0]: # Passenger 1 delivered, render at destination
-            cx,cy = pos(d1)
-            pygame.draw.circle(self.window, BLACK, (cx*cell_w+cell_w//2, cy*cell_h+cell_h//2),10, width=2) # outline
+            passenger(d1, self.BLACK, width=2) # outline
         if p2<4: # Passenger 2 is at a location
-            cx,cy = pos(p2)
-            pygame.draw.circle(self.window, ORANGE, (cx*cell_w+cell_w//2, cy*cell_h+cell_h//2),10)
+            passenger(p2, self.ORANGE)
         elif self.passengers_delivered[1]: # Passenger 2 delivered, render at destination
-            cx,cy = pos(d2)
-            pygame.draw.circle(self.window, ORANGE, (cx*cell_w+cell_w//2, cy*cell_h+cell_h//2),10, width=2) # outline
+            passenger(d2, self.ORANGE, width=2) # outline
 
         taxi_rect = pygame.Rect(col*cell_w+20, row*cell_h+20, cell_w-40, cell_h-40)
-        pygame.draw.rect(self.window, YELLOW, taxi_rect)
+        rects.append(pygame.draw.rect(surface, self.YELLOW, taxi_rect))
         if self.passenger_in_taxi==0:
-            pygame.draw.circle(self.window, BLACK, taxi_rect.center,10)
+            pygame.draw.circle(surface, self.BLACK, taxi_rect.center,10)
         elif self.passenger_in_taxi==1:
-            pygame.draw.circle(self.window, ORANGE, taxi_rect.center,10)
-        # legend
-        font = pygame.font.SysFont(None,18)
-        legends = [
-            ("Taxi","Yellow rectangle"),
-            ("Passenger 1","Black circle"),
-            ("Passenger 2","Orange circle"),
-            ("Destinations","Colored squares"),
-            ("Obstacle", "Gray square"),
-
-        ]
-        for i,(title,desc) in enumerate(legends):
-            txt = font.render(f"{title}: {desc}", True, BLACK)
-            self.window.blit(txt, (520,20 + i*25))
-        pygame.event.pump(); self.clock.tick(15); pygame.display.flip()
-        if mode=="rgb_array": return np.transpose(pygame.surfarray.array3d(self.window),(1,0,2))
\ No newline at end of file
+            pygame.draw.circle(surface, self.ORANGE, taxi_rect.center,10)
+        return rects
+
+    def _render_gui(self, mode):
+        try:
+            import pygame
+        except ImportError as e:
+            raise DependencyNotInstalled(
+                'pygame is not installed, run `pip install "gymnasium[toy-text]"`'
+            ) from e
+        if self.window is None:
+            if mode == "human":
+                pygame.init()
+                pygame.display.init()
+                self.window = pygame.display.set_mode(self.WINDOW_SIZE)
+                pygame.display.set_caption("Taxi – Two Passengers")
+            else:  # rgb_array renders offscreen and never needs a display
+                pygame.font.init()
+                self.window = pygame.Surface(self.WINDOW_SIZE)
+            self._board = self._draw_board()
+            self.window.blit(self._board, (0, 0))
+            self._sprite_rects = [self.window.get_rect()]
+        if self.clock is None:
+            self.clock = pygame.time.Clock()
+
+        old_rects = self._sprite_rects
+        for rect in old_rects:
+            self.window.blit(self._board, rect, rect)
+        self._sprite_rects = self._draw_sprites(self.window)
+
+        if mode == "human":
+            pygame.event.pump(); self.clock.tick(15)
+            pygame.display.update(old_rects + self._sprite_rects)
+        else:
+            return np.transpose(pygame.surfarray.array3d(self.window),(1,0,2))
+
+
+# -----------------------------------------------------------------------------
+#  TaxiTwoPassengerVectorEnv
+# -----------------------------------------------------------------------------
+def _layout_arrays(desc, locs, obstacles):
+    """Turn the map description into the lookup arrays used by `_batch_step`."""
+    can_right = np.zeros((5, 5), dtype=bool)
+    can_left = np.zeros((5, 5), dtype=bool)
+    for r in range(5):
+        for c in range(5):
+            can_right[r, c] = c < 4 and desc[1 + r, 2 * c + 2] == b":"
+            can_left[r, c] = c > 0 and desc[1 + r, 2 * c] == b":"
+    blocked = np.zeros((5, 5), dtype=bool)
+    for (r, c) in obstacles:
+        blocked[r, c] = True
+    # index 4 ("in taxi") maps off the board so it never matches a taxi cell
+    loc_r = np.array([r for r, _ in locs] + [-100], dtype=np.int16)
+    loc_c = np.array([c for _, c in locs] + [-100], dtype=np.int16)
+    return can_right, can_left, blocked, loc_r, loc_c
+
+
+def _batch_step(layout, r, c, p1, d1, p2, d2, in_taxi, delivered1, delivered2, action):
+    """Array version of `TaxiTwoPassengerEnv.step` (same branches, same rewards).
+
+    `in_taxi` uses -1 for an empty taxi. Returns the new fields followed by the
+    reward, terminated and `EVENT_NAMES` bit arrays; the inputs are left untouched.
+    """
+    can_right, can_left, blocked, loc_r, loc_c = layout
+
+    # Movement and illegal move penalties (mirrors `_move`)
+    down, up = (action == 0) & (r < 4), (action == 1) & (r > 0)
+    right, left = (action == 2) & can_right[r, c], (action == 3) & can_left[r, c]
+    new_r = r + down - up
+    new_c = c + right - left
+    wall = (action < 4) & ~(down | up | right | left)
+    hit = blocked[new_r, new_c]
+    new_r = np.where(hit, r, new_r)
+    new_c = np.where(hit, c, new_c)
+    reward = np.where(wall | hit, -11, -1).astype(np.int32)
+
+    def at(loc):
+        return (loc_r[loc] == new_r) & (loc_c[loc] == new_c)
+
+    new_p1, new_p2, new_in_taxi = p1.copy(), p2.copy(), in_taxi.copy()
+    new_del1, new_del2 = delivered1.copy(), delivered2.copy()
+
+    # Pickup: passenger 1 has priority when both wait at the same spot
+    pickup = action == 4
+    empty = in_taxi == -1
+    take1 = pickup & empty & (p1 < 4) & at(p1) & ~delivered1
+    take2 = pickup & empty & ~take1 & (p2 < 4) & at(p2) & ~delivered2
+    new_p1[take1], new_in_taxi[take1] = 4, 0
+    new_p2[take2], new_in_taxi[take2] = 4, 1
+    reward = np.where(pickup, np.where(take1 | take2, reward + 10, -10), reward)
+
+    # Dropoff
+    dropoff = action == 5
+    drop1 = dropoff & (in_taxi == 0) & (p1 == 4) & at(d1)
+    drop2 = dropoff & ~drop1 & (in_taxi == 1) & (p2 == 4) & at(d2)
+    new_p1[drop1], new_del1[drop1] = d1[drop1], True
+    new_p2[drop2], new_del2[drop2] = d2[drop2], True
+    new_in_taxi[drop1 | drop2] = -1
+    reward = np.where(dropoff, np.where(drop1 | drop2, 20, -10), reward)
+
+    # Reward shaping for movement progress, judged on the pre-step passenger layout
+    def closer(loc):
+        old = np.abs(loc_r[loc] - r) + np.abs(loc_c[loc] - c)
+        new = np.abs(loc_r[loc] - new_r) + np.abs(loc_c[loc] - new_c)
+        return new < old
+
+    shaping = (
+        (empty & (p1 < 4) & ~new_del1 & closer(p1)).astype(np.int32)
+        + (empty & (p2 < 4) & ~new_del2 & closer(p2))
+        + ((in_taxi == 0) & ~new_del1 & closer(d1))
+        + ((in_taxi == 1) & ~new_del2 & closer(d2))
+    )
+    reward += shaping
+
+    terminated = new_del1 & new_del2
+    reward += np.where(terminated, 100, 0)
+
+    events = np.zeros(reward.shape, dtype=np.uint8)
+    for bit, hit_event in enumerate((
+        wall, hit, pickup & ~(take1 | take2), dropoff & ~(drop1 | drop2),
+        shaping > 0, terminated, take1 | take2, drop1 | drop2,
+    )):
+        events |= hit_event.astype(np.uint8) << bit
+    return new_r, new_c, new_p1, new_p2, new_in_taxi, new_del1, new_del2, reward, terminated, events
+
+
+class TaxiTwoPassengerVectorEnv(gym.vector.VectorEnv):
+    """N independent `TaxiTwoPassengerEnv` episodes stepped together with NumPy.
+
+    Transitions and rewards are identical to the scalar env, so Q-tables trained
+    on either are interchangeable. Finished slots are reset in the same call; the
+    observation they finished on is reported in ``info["final_obs"]``.
+    """
+
+    metadata = {"autoreset_mode": gym.vector.AutoresetMode.SAME_STEP}
+
+    def __init__(self, num_envs: int, max_episode_steps: int = 200, instrument: bool = False):
+        self.num_envs = num_envs
+        self.max_episode_steps = max_episode_steps
+        self.single_observation_space = TaxiTwoPassengerEnv.observation_space
+        self.single_action_space = spaces.Discrete(6)
+        self.observation_space = spaces.MultiDiscrete(np.full(num_envs, self.single_observation_space.n))
+        self.action_space = spaces.MultiDiscrete(np.full(num_envs, 6))
+        self.render_mode = None
+
+        self.locs = [(0, 0), (0, 4), (4, 0), (4, 3)]
+        self.obstacles = {(1, 1), (3, 3)}
+        self.desc = np.asarray(MAP, dtype="c")
+        self._layout = _layout_arrays(self.desc, self.locs, self.obstacles)
+
+        self.taxi_row = np.zeros(num_envs, dtype=np.int16)
+        self.taxi_col = np.zeros(num_envs, dtype=np.int16)
+        self.p1 = np.zeros(num_envs, dtype=np.int16)
+        self.d1 = np.zeros(num_envs, dtype=np.int16)
+        self.p2 = np.zeros(num_envs, dtype=np.int16)
+        self.d2 = np.zeros(num_envs, dtype=np.int16)
+        self.passenger_in_taxi = np.full(num_envs, -1, dtype=np.int8)  # -1 => empty
+        self.passengers_delivered = np.zeros((num_envs, 2), dtype=bool)
+        self.steps = np.zeros(num_envs, dtype=np.int32)
+        self.stats = EnvStats() if instrument else None
+
+    def stats_snapshot(self) -> dict | None:
+        return None if self.stats is None else self.stats.snapshot()
+
+    def _observations(self):
+        return CODEC.encode_batch(self.taxi_row, self.taxi_col, self.p1, self.d1, self.p2, self.d2, check=False)
+
+    def _reset_slots(self, mask):
+        n = int(mask.sum())
+        rng = self.np_random
+        self.taxi_row[mask], self.taxi_col[mask] = rng.integers(5, size=(2, n))
+        self.p1[mask], self.p2[mask] = rng.integers(4, size=(2, n))
+        self.d1[mask], self.d2[mask] = rng.integers(4, size=(2, n))
+        self.passenger_in_taxi[mask] = -1
+        self.passengers_delivered[mask] = False
+        self.steps[mask] = 0
+        if self.stats is not None:
+            self.stats.resets += n
+
+    def reset(self, *, seed: int | None = None, options=None):
+        super().reset(seed=seed)
+        self._reset_slots(np.ones(self.num_envs, dtype=bool))
+        return self._observations(), {}
+
+    def step(self, actions):
+        stats = self.stats
+        if stats is not None:
+            t0 = stats.start_call()
+        actions = np.asarray(actions)
+        assert actions.shape == (self.num_envs,) and ((actions >= 0) & (actions < 6)).all()
+        (self.taxi_row, self.taxi_col, self.p1, self.p2, self.passenger_in_taxi,
+         delivered1, delivered2, reward, terminated, events) = _batch_step(
+            self._layout, self.taxi_row, self.taxi_col, self.p1, self.d1, self.p2, self.d2,
+            self.passenger_in_taxi, self.passengers_delivered[:, 0], self.passengers_delivered[:, 1],
+            actions,
+        )
+        self.passengers_delivered[:, 0], self.passengers_delivered[:, 1] = delivered1, delivered2
+        self.steps += 1
+        truncated = self.steps >= self.max_episode_steps
+
+        obs = self._observations()
+        info = {}
+        done = terminated | truncated
+        if done.any():
+            info["final_obs"] = np.where(done, obs, 0)
+            info["_final_obs"] = done
+            self._reset_slots(done)
+            obs = self._observations()
+        if stats is not None:
+            stats.record_batch(events)
+            stats.end_call(t0)
+        return obs, reward, terminated, truncated, info
+
+
+# -----------------------------------------------------------------------------
+#  Compiled transition model
+# -----------------------------------------------------------------------------
+N_EXT_STATES = TaxiTwoPassengerEnv.observation_space.n * 4
+_PENALTY_EVENTS = 0b1111  # wall_hit | obstacle_hit | illegal_pickup | illegal_dropoff
+
+
+class TransitionModel(NamedTuple):
+    """Dense deterministic model over extended states, all arrays shaped [N_EXT_STATES, 6]."""
+    next_state: np.ndarray  # uint16, extended state index
+    reward: np.ndarray      # int16
+    terminated: np.ndarray  # bool
+    events: np.ndarray      # uint8, one bit per `EVENT_NAMES` entry
+    action_mask: np.ndarray  # bool, False where the action is a wall/obstacle hit or an illegal pickup/dropoff
+
+
+def compile_model(desc, locs, obstacles) -> TransitionModel:
+    """Run `_batch_step` once over every (extended state, action) pair."""
+    es = np.repeat(np.arange(N_EXT_STATES), 6)
+    action = np.tile(np.arange(6), N_EXT_STATES)
+    s, delivered1, delivered2 = es >> 2, (es & 1).astype(bool), (es & 2).astype(bool)
+    r, c, p1, d1, p2, d2 = CODEC.decode_batch(s, dtype=np.int64)
+    in_taxi = np.where(p1 == 4, 0, np.where(p2 == 4, 1, -1))
+
+    r, c, p1, p2, _, delivered1, delivered2, reward, terminated, events = _batch_step(
+        _layout_arrays(desc, locs, obstacles), r, c, p1, d1, p2, d2, in_taxi, delivered1, delivered2, action
+    )
+    next_es = TaxiTwoPassengerEnv.encode_ext(CODEC.encode_batch(r, c, p1, d1, p2, d2), delivered1, delivered2)
+    return TransitionModel(
+        next_state=next_es.astype(np.uint16).reshape(N_EXT_STATES, 6),
+        reward=reward.astype(np.int16).reshape(N_EXT_STATES, 6),
+        terminated=terminated.reshape(N_EXT_STATES, 6),
+        events=events.reshape(N_EXT_STATES, 6),
+        action_mask=(events & _PENALTY_EVENTS == 0).reshape(N_EXT_STATES, 6),
+    )
+
+
+def pack_model(model: TransitionModel) -> np.ndarray:
+    """Flatten a model into one int64 per (state, action) so `step` needs a single lookup.
+
+    Bits 0-15 hold the next state, bit 16 the terminated flag, bits 17-32 the
+    reward + 0x8000, bits 33-40 the event bits and bits 41-46 the action mask of
+    the state itself (the same in all six entries of a row).
+    """
+    return (
+        model.next_state.astype(np.int64)
+        | model.terminated.astype(np.int64) << 16
+        | (model.reward.astype(np.int64) + 0x8000) << 17
+        | model.events.astype(np.int64) << 33
+        | ((model.action_mask << np.arange(6)).sum(axis=1, keepdims=True) << 41)
+    ).ravel()
+
+
+# -----------------------------------------------------------------------------
+#  Model cache (in-process and on disk, memory-mapped read-only)
+# -----------------------------------------------------------------------------
+MODEL_VERSION = 3  # bump whenever the step semantics or the extended encoding change
+MODEL_CACHE_DIR = os.environ.get("MULTI_TAXI_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "multi_taxi"))
+_MODEL_FILES = ("next_state", "reward", "terminated", "events", "action_mask", "packed")
+_loaded_models: dict[str, dict[str, np.ndarray]] = {}
+
+
+def layout_hash(desc, locs, obstacles) -> str:
+    """Content hash of everything the compiled model depends on."""
+    h = hashlib.sha256(f"v{MODEL_VERSION}".encode())
+    h.update(np.asarray(desc, dtype="c").tobytes())
+    h.update(repr([tuple(l) for l in locs]).encode())
+    h.update(repr(sorted(obstacles)).encode())
+    return h.hexdigest()[:16]
+
+
+def _compile_to_disk(path: str, desc, locs, obstacles):
+    model = compile_model(desc, locs, obstacles)
+    arrays = dict(model._asdict(), packed=pack_model(model))
+    tmp = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    for name in _MODEL_FILES:
+        np.save(os.path.join(tmp, name + ".npy"), arrays[name])
+    try:
+        os.rename(tmp, path)  # atomic publish; loses the race gracefully if another worker won
+    except OSError:
+        for name in _MODEL_FILES:
+            os.remove(os.path.join(tmp, name + ".npy"))
+        os.rmdir(tmp)
+    return arrays
+
+
+def load_model(desc, locs, obstacles, packed: bool = False):
+    """Return the `TransitionModel` (or the packed step table) for a layout.
+
+    The first process compiles the tables into ``MODEL_CACHE_DIR/<layout_hash>/``;
+    later ones memory-map those files read-only, so every worker shares one physical
+    copy. Within a process all env instances share the same arrays.
+    """
+    key = layout_hash(desc, locs, obstacles)
+    arrays = _loaded_models.get(key)
+    if arrays is None:
+        path = os.path.join(MODEL_CACHE_DIR, key)
+        try:
+            arrays = {name: np.asarray(np.load(os.path.join(path, name + ".npy"), mmap_mode="r")) for name in _MODEL_FILES}
+        except (OSError, ValueError):
+            try:
+                os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+                arrays = _compile_to_disk(path, desc, locs, obstacles)
+            except OSError:  # read-only home etc.: fall back to an in-memory model
+                model = compile_model(desc, locs, obstacles)
+                arrays = dict(model._asdict(), packed=pack_model(model))
+        _loaded_models[key] = arrays
+    if packed:
+        return arrays["packed"]
+    return TransitionModel(*(arrays[name] for name in TransitionModel._fields))
+
+
+def sample_ext_starts(rng: np.random.Generator, n: int) -> np.ndarray:
+    """Draw `n` extended start states from the same distribution as `_generate_random_state`."""
+    r, c = rng.integers(5, size=(2, n))
+    p1, p2 = rng.integers(4, size=(2, n))
+    d1, d2 = rng.integers(4, size=(2, n))
+    return CODEC.encode_batch(r, c, p1, d1, p2, d2, check=False) * 4
@@ -0,0 +1,192 @@
+"""Hogwild-style Q-learning: K worker processes updating one shared-memory Q-table.
+
+Each worker runs its own `TaxiTwoPassengerEnv` episodes with an independent seeded
+RNG stream and writes to the shared table without locks. The coordinator owns the
+epsilon schedule (decayed per finished episode across all workers, as in
+`q_learning_taxi.py`), prints progress and saves the final table.
+
+    python parallel_q_learning.py --workers 8 --episodes 100000
+    python parallel_q_learning.py --bench 1,2,4,8 --episodes 20000
+"""
+import argparse
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from instrumentation import format_snapshot, merge_snapshots
+from multi_taxi import TaxiTwoPassengerEnv
+
+N_STATES, N_ACTIONS = TaxiTwoPassengerEnv.observation_space.n, 6
+EPSILON, STOP = 0, 1  # slots of the shared control array
+
+
+def _attach(name: str, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _worker(idx: int, workers: int, q_name: str, ctl_name: str, cnt_name: str, seed, alpha: float, gamma: float,
+            max_steps: int, stats_queue=None):
+    q_shm, Q = _attach(q_name, (N_STATES, N_ACTIONS), np.float32)
+    ctl_shm, control = _attach(ctl_name, (2,), np.float64)
+    cnt_shm, counters = _attach(cnt_name, (workers, 2), np.int64)  # [episodes, env steps]
+    rng = np.random.default_rng(seed)
+    env = TaxiTwoPassengerEnv()
+    if stats_queue is not None:
+        env.enable_instrumentation()
+    env.reset(seed=int(rng.integers(2**31)))
+    try:
+        while not control[STOP]:
+            epsilon = control[EPSILON]
+            state, _ = env.reset()
+            for step in range(max_steps):
+                if rng.random() < epsilon:
+                    action = int(rng.integers(N_ACTIONS))
+                else:
+                    q_vals = Q[state].tolist()
+                    max_q = max(q_vals)
+                    tol = 1e-8 + 1e-5 * abs(max_q)
+                    candidates = [a for a, q in enumerate(q_vals) if abs(q - max_q) <= tol]
+                    action = candidates[int(rng.random() * len(candidates))]
+
+                next_state, reward, terminated, _, _ = env.step(action)
+                # lock-free update: concurrent writers may occasionally clobber each other
+                target = reward if terminated else reward + gamma * Q[next_state].max()
+                Q[state, action] += alpha * (target - Q[state, action])
+                state = next_state
+                if terminated:
+                    break
+            counters[idx, 0] += 1
+            counters[idx, 1] += step + 1
+        if stats_queue is not None:
+            stats_queue.put(env.stats_snapshot())
+    finally:
+        del Q, control, counters
+        q_shm.close(); ctl_shm.close(); cnt_shm.close()
+
+
+def train(
+    episodes: int = 100000,
+    workers: int = 4,
+    alpha: float = 0.1,
+    gamma: float = 0.99,
+    epsilon: float = 1.0,
+    epsilon_decay: float = 0.9998,
+    min_epsilon: float = 0.01,
+    max_steps: int = 200,
+    seed: int | None = None,
+    report_every: float = 2.0,
+    log=print,
+    instrument: bool = False,
+):
+    """Run the worker pool until `episodes` episodes have finished; returns (Q, stats).
+
+    With `instrument`, each worker's env counters are merged into ``stats["env"]``.
+    """
+    q_shm = shared_memory.SharedMemory(create=True, size=N_STATES * N_ACTIONS * 4)
+    ctl_shm = shared_memory.SharedMemory(create=True, size=2 * 8)
+    cnt_shm = shared_memory.SharedMemory(create=True, size=workers * 2 * 8)
+    try:
+        Q = np.ndarray((N_STATES, N_ACTIONS), dtype=np.float32, buffer=q_shm.buf)
+        control = np.ndarray((2,), dtype=np.float64, buffer=ctl_shm.buf)
+        counters = np.ndarray((workers, 2), dtype=np.int64, buffer=cnt_shm.buf)
+        Q[:] = 0
+        counters[:] = 0
+        control[EPSILON], control[STOP] = epsilon, 0
+
+        seeds = np.random.SeedSequence(seed).spawn(workers)
+        stats_queue = mp.Queue() if instrument else None
+        procs = [
+            mp.Process(
+                target=_worker,
+                args=(i, workers, q_shm.name, ctl_shm.name, cnt_shm.name, seeds[i], alpha, gamma, max_steps, stats_queue),
+                daemon=True,
+            )
+            for i in range(workers)
+        ]
+        start = last_report = time.perf_counter()
+        for p in procs:
+            p.start()
+
+        done = 0
+        while done < episodes:
+            time.sleep(0.01)
+            done = int(counters[:, 0].sum())
+            control[EPSILON] = max(min_epsilon, epsilon * epsilon_decay ** done)
+            now = time.perf_counter()
+            if report_every and now - last_report >= report_every:
+                log(f"Episode {done:>6}/{episodes}: epsilon={control[EPSILON]:.3f}  "
+                    f"({done / (now - start):,.0f} episodes/s, {workers} workers)")
+                last_report = now
+            if not any(p.is_alive() for p in procs):
+                raise RuntimeError("all training workers exited early")
+        control[STOP] = 1
+        snapshots = []
+        while instrument and len(snapshots) < workers:
+            # a worker that died never sends its snapshot; once none is left alive, whatever is coming has arrived
+            alive = any(p.is_alive() for p in procs)
+            try:
+                snapshots.append(stats_queue.get(timeout=1.0))
+            except queue.Empty:
+                if not alive:
+                    codes = [p.exitcode for p in procs]
+                    raise RuntimeError(f"only {len(snapshots)} of {workers} workers sent stats (exit codes {codes})")
+        for p in procs:
+            p.join()
+
+        elapsed = time.perf_counter() - start
+        stats = {
+            "workers": workers,
+            "episodes": int(counters[:, 0].sum()),
+            "env_steps": int(counters[:, 1].sum()),
+            "seconds": elapsed,
+        }
+        stats["episodes_per_sec"] = stats["episodes"] / elapsed
+        if instrument:
+            stats["env"] = merge_snapshots(snapshots)
+        result = Q.copy()
+        del Q, control, counters
+        return result, stats
+    finally:
+        for shm in (q_shm, ctl_shm, cnt_shm):
+            shm.close()
+            shm.unlink()
+
+
+def bench(worker_counts, episodes: int, seed: int | None = None):
+    """Train the same number of episodes for each worker count and print the scaling curve."""
+    base = None
+    print(f"{'workers':>7}  {'episodes/s':>11}  {'steps/s':>11}  {'speedup':>7}")
+    for k in worker_counts:
+        _, stats = train(episodes=episodes, workers=k, seed=seed, report_every=0)
+        rate = stats["episodes_per_sec"]
+        base = base or rate
+        print(f"{k:>7}  {rate:>11,.0f}  {stats['env_steps'] / stats['seconds']:>11,.0f}  {rate / base:>6.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=mp.cpu_count())
+    parser.add_argument("--episodes", type=int, default=100000)
+    parser.add_argument("--alpha", type=float, default=0.1)
+    parser.add_argument("--gamma", type=float, default=0.99)
+    parser.add_argument("--epsilon-decay", type=float, default=0.9998)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", default="q_table_two_passenger.npy")
+    parser.add_argument("--instrument", action="store_true", help="collect and print env hot-path counters")
+    parser.add_argument("--bench", default=None, help="comma-separated worker counts, e.g. 1,2,4,8")
+    args = parser.parse_args()
+
+    if args.bench:
+        bench([int(k) for k in args.bench.split(",")], args.episodes, args.seed)
+    else:
+        Q, stats = train(args.episodes, args.workers, args.alpha, args.gamma,
+                         epsilon_decay=args.epsilon_decay, seed=args.seed, instrument=args.instrument)
+        np.save(args.out, Q)
+        print(f"\nTraining complete: {stats['episodes']} episodes in {stats['seconds']:.1f}s "
+              f"({stats['episodes_per_sec']:,.0f} episodes/s). Q-table saved as {args.out}.")
+        if args.instrument:
+            print(format_snapshot(stats["env"]))
@@ -0,0 +1,132 @@
+"""Compiled greedy policies: turn a float Q-table into a few bytes per state.
+
+A compiled policy stores, for every state, the first best action, a 6-bit mask of
+all actions tied for best (same `np.isclose(..., atol=1e-8)` rule the scripts use)
+and the number of tied actions. It is saved as one structured `.npy` next to the
+Q-table, e.g. `q_table_two_passenger.policy.npy`, and can be memory-mapped.
+
+    python policy.py q_table_two_passenger.npy
+"""
+import os
+import random
+import sys
+
+import numpy as np
+
+from checkpoint import load_q_table
+
+POLICY_DTYPE = np.dtype([("greedy", np.int8), ("ties", np.uint8), ("count", np.uint8)])
+
+
+def compile_policy(Q: np.ndarray) -> np.ndarray:
+    """Compile a `(n_states, n_actions)` Q-table into a `POLICY_DTYPE` array."""
+    Q = np.asarray(Q)
+    best = Q.max(axis=1, keepdims=True)
+    tied = np.isclose(Q, best, atol=1e-8)
+    table = np.empty(len(Q), dtype=POLICY_DTYPE)
+    table["greedy"] = tied.argmax(axis=1)
+    table["ties"] = (tied << np.arange(Q.shape[1])).sum(axis=1)
+    table["count"] = tied.sum(axis=1)
+    return table
+
+
+def masked_greedy(q_rows: np.ndarray, masks: np.ndarray, rng: np.random.Generator | None = None) -> np.ndarray:
+    """Best allowed action per row under the same tie rule as `compile_policy`.
+
+    Ties go to the lowest action, or are broken uniformly at random when `rng` is given.
+    """
+    q = np.where(masks, q_rows, -np.inf)
+    best = q.max(axis=1, keepdims=True)
+    tied = np.isclose(q, best, atol=1e-8)
+    return (tied if rng is None else tied * rng.random(q.shape)).argmax(axis=1)
+
+
+def policy_path(q_table_path: str) -> str:
+    root, _ = os.path.splitext(q_table_path)
+    return root + ".policy.npy"
+
+
+class Policy:
+    """Greedy action selection from a compiled table.
+
+    With ``tie_break=True`` tied actions are chosen uniformly at random, otherwise
+    the lowest tied action is used. `act` does no NumPy work per call and
+    `act_batch` reuses its scratch buffers between calls.
+    """
+
+    def __init__(self, table: np.ndarray, tie_break: bool = True, seed: int | None = None):
+        self.table = table
+        self.tie_break = tie_break
+        self.greedy = np.ascontiguousarray(table["greedy"])
+        self.counts = np.ascontiguousarray(table["count"])
+        # tied actions packed to the left of each row, so row[:count] are the candidates
+        bits = (table["ties"][:, None] >> np.arange(6)) & 1
+        order = np.argsort(-bits, axis=1, kind="stable")
+        self.tied_actions = order.astype(np.int8)
+        self._greedy_list = self.greedy.tolist()
+        self._counts_list = self.counts.tolist()
+        self._tied_list = [tuple(row) for row in self.tied_actions.tolist()]
+        self._random = random.Random(seed).random
+        self._rng = np.random.default_rng(seed)
+        self._counts_f = self.counts.astype(np.float64)
+        self._tied_flat = self.tied_actions.reshape(-1)
+        self._scratch_u = self._scratch_c = np.empty(0)
+        self._scratch_i = np.empty(0, dtype=np.intp)
+
+    @classmethod
+    def from_q_table(cls, Q: np.ndarray, **kwargs) -> "Policy":
+        return cls(compile_policy(Q), **kwargs)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "Policy":
+        return cls(np.load(path, mmap_mode="r"), **kwargs)
+
+    def act(self, state: int) -> int:
+        if self.tie_break:
+            count = self._counts_list[state]
+            if count > 1:
+                return self._tied_list[state][int(self._random() * count)]
+        return self._greedy_list[state]
+
+    def act_batch(self, states: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+        states = np.asarray(states)
+        n = len(states)
+        if out is None:
+            out = np.empty(n, dtype=np.int8)
+        if not self.tie_break:
+            return np.take(self.greedy, states, out=out)
+        if len(self._scratch_u) < n:
+            self._scratch_u, self._scratch_c = np.empty(n), np.empty(n)
+            self._scratch_i = np.empty(n, dtype=np.intp)
+        u, c, pick = self._scratch_u[:n], self._scratch_c[:n], self._scratch_i[:n]
+        self._rng.random(out=u)
+        u *= np.take(self._counts_f, states, out=c)
+        np.multiply(states, 6, out=pick)
+        np.add(pick, u, out=pick, casting="unsafe")  # row offset + floor(u * count)
+        return np.take(self._tied_flat, pick, out=out)
+
+
+def save_policy(table: np.ndarray, path: str):
+    tmp = path + ".tmp.npy"
+    np.save(tmp, table)
+    os.replace(tmp, path)
+
+
+def load_or_compile(q_table_path: str, **kwargs) -> Policy:
+    """Load the compiled policy saved next to `q_table_path`, compiling it first if it is missing or stale.
+
+    `q_table_path` may be a bare `.npy` table or a `.qckpt` checkpoint; tables that
+    don't match the environment are refused.
+    """
+    path = policy_path(q_table_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(q_table_path):
+        save_policy(compile_policy(load_q_table(q_table_path)), path)
+    return Policy.load(path, **kwargs)
+
+
+if __name__ == "__main__":
+    for q_path in sys.argv[1:] or ["q_table_two_passenger.npy"]:
+        table = compile_policy(load_q_table(q_path))
+        save_policy(table, policy_path(q_path))
+        print(f"{q_path} -> {policy_path(q_path)} ({table.nbytes:,} bytes, "
+              f"{int((table['count'] > 1).sum())} states with tied best actions)")
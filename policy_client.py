@@ -0,0 +1,179 @@
+"""Clients for `policy_server.py`, plus a stats dump and a load generator.
+
+Like `env_client.py`, this needs only NumPy and a socket. Models are looked up by
+name once; after that every query carries the model's 16-bit id.
+
+    client = PolicyClient("unix:/tmp/taxi_policy.sock")
+    action = client.act(state)                    # default model
+    actions = client.act_batch(states, "main")    # one round trip for many states
+    print(client.stats()["main"]["latency_us"])
+
+    python policy_client.py stats --address unix:/tmp/taxi_policy.sock
+    python policy_client.py load --address unix:/tmp/taxi_policy.sock --clients 256 --queries 200000
+    python policy_client.py load --address unix:/tmp/taxi_policy.sock --batch 1024
+"""
+import argparse
+import asyncio
+import json
+import random
+import struct
+import time
+
+import numpy as np
+
+from rpc import BlockingRpcClient, RpcClient
+
+# -----------------------------------------------------------------------------
+#  Protocol (payloads of the `rpc` frames)
+# -----------------------------------------------------------------------------
+OP_MODEL, OP_ACT, OP_ACT_BATCH, OP_STATS = 1, 2, 3, 4
+MODEL_ID = struct.Struct("<H")   # OP_MODEL reply (request: UTF-8 name, empty for the default model)
+ACT_REQ = struct.Struct("<HH")   # model id, state
+ACT_RESP = struct.Struct("<B")   # action
+# OP_ACT_BATCH: MODEL_ID followed by little-endian uint16 states; reply: one uint8 action per state
+# OP_STATS: empty request; reply: UTF-8 JSON, see `policy_server.ServedModel.stats`
+
+
+class PolicyClient:
+    """Blocking client, one request at a time."""
+
+    def __init__(self, address: str):
+        self._rpc = BlockingRpcClient(address)
+        self._ids: dict[str, int] = {}
+
+    def model_id(self, name: str = "") -> int:
+        if name not in self._ids:
+            self._ids[name], = MODEL_ID.unpack(self._rpc.call(OP_MODEL, name.encode()))
+        return self._ids[name]
+
+    def act(self, state: int, model: str = "") -> int:
+        return ACT_RESP.unpack(self._rpc.call(OP_ACT, ACT_REQ.pack(self.model_id(model), state)))[0]
+
+    def act_batch(self, states, model: str = "") -> np.ndarray:
+        payload = MODEL_ID.pack(self.model_id(model)) + np.asarray(states, dtype="<u2").tobytes()
+        return np.frombuffer(self._rpc.call(OP_ACT_BATCH, payload), dtype=np.uint8)
+
+    def stats(self) -> dict:
+        return json.loads(self._rpc.call(OP_STATS))
+
+    def close(self):
+        self._rpc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncPolicyClient:
+    """Asyncio client; concurrent `act` calls share the connection and are batched by the server."""
+
+    def __init__(self, rpc: RpcClient):
+        self.rpc = rpc
+        self._ids: dict[str, int] = {}
+
+    @classmethod
+    async def connect(cls, address: str) -> "AsyncPolicyClient":
+        return cls(await RpcClient.connect(address))
+
+    async def model_id(self, name: str = "") -> int:
+        if name not in self._ids:
+            self._ids[name], = MODEL_ID.unpack(await self.rpc.call(OP_MODEL, name.encode()))
+        return self._ids[name]
+
+    async def act(self, state: int, model: str = "") -> int:
+        return ACT_RESP.unpack(await self.rpc.call(OP_ACT, ACT_REQ.pack(await self.model_id(model), state)))[0]
+
+    async def act_batch(self, states, model: str = "") -> np.ndarray:
+        payload = MODEL_ID.pack(await self.model_id(model)) + np.asarray(states, dtype="<u2").tobytes()
+        return np.frombuffer(await self.rpc.call(OP_ACT_BATCH, payload), dtype=np.uint8)
+
+    async def stats(self) -> dict:
+        return json.loads(await self.rpc.call(OP_STATS))
+
+    async def close(self):
+        await self.rpc.close()
+
+
+# -----------------------------------------------------------------------------
+#  Load generator
+# -----------------------------------------------------------------------------
+async def load_test(address: str, clients: int, queries: int, batch: int = 1, model: str = "",
+                    connections: int = 1, seed: int = 0) -> dict:
+    """`clients` concurrent callers issue `queries` decisions in total, `batch` states per request."""
+    conns = [await AsyncPolicyClient.connect(address) for _ in range(connections)]
+    n_states = 10000
+    per_client = max(1, queries // (clients * batch))
+    latencies = np.zeros((clients, per_client))
+
+    async def caller(i):
+        client = conns[i % connections]
+        rng = random.Random(seed + i)
+        states = np.random.default_rng(seed + i).integers(n_states, size=(per_client, batch), dtype=np.uint16)
+        await client.model_id(model)
+        clock = time.perf_counter
+        for j in range(per_client):
+            start = clock()
+            if batch == 1:
+                await client.act(rng.randrange(n_states), model)
+            else:
+                await client.act_batch(states[j], model)
+            latencies[i, j] = clock() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller(i) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    for client in conns:
+        await client.close()
+    us = latencies.ravel() * 1e6
+    return {
+        "clients": clients,
+        "batch": batch,
+        "requests": latencies.size,
+        "decisions": latencies.size * batch,
+        "seconds": elapsed,
+        "decisions_per_sec": latencies.size * batch / elapsed,
+        "latency_p50_us": float(np.percentile(us, 50)),
+        "latency_p99_us": float(np.percentile(us, 99)),
+        "latency_max_us": float(us.max()),
+    }
+
+
+def format_stats(stats: dict) -> str:
+    lines = []
+    for name, s in stats.items():
+        lat = s["latency_us"]
+        lines.append(f"{name or '(default)'}: v{s['version']} from {s['path']}, {s['decisions']:,} decisions in "
+                     f"{s['requests']:,} requests / {s['batches']:,} batches, {s['qps']:,.0f} decisions/s recently; "
+                     f"latency p50 <= {lat['p50']} µs, p99 <= {lat['p99']} µs")
+        if s["last_error"]:
+            lines.append(f"  last reload failed: {s['last_error']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("stats", "load"))
+    parser.add_argument("--address", default="unix:/tmp/taxi_policy.sock")
+    parser.add_argument("--model", default="", help="model name (default: the server's first model)")
+    parser.add_argument("--clients", type=int, default=64, help="concurrent callers (load)")
+    parser.add_argument("--connections", type=int, default=1, help="connections the callers share (load)")
+    parser.add_argument("--queries", type=int, default=100000, help="total decisions (load)")
+    parser.add_argument("--batch", type=int, default=1, help="states per request; 1 uses single queries (load)")
+    parser.add_argument("--json", action="store_true", help="print raw JSON")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        with PolicyClient(args.address) as client:
+            stats = client.stats()
+        print(json.dumps(stats, indent=2) if args.json else format_stats(stats))
+    else:
+        res = asyncio.run(load_test(args.address, args.clients, args.queries, args.batch, args.model, args.connections))
+        if args.json:
+            print(json.dumps(res, indent=2))
+        else:
+            print(f"{res['decisions']:,} decisions in {res['requests']:,} requests of {res['batch']} from "
+                  f"{res['clients']} clients in {res['seconds']:.2f}s: {res['decisions_per_sec']:,.0f} decisions/s; "
+                  f"request latency p50 {res['latency_p50_us']:.0f} µs, p99 {res['latency_p99_us']:.0f} µs, "
+                  f"max {res['latency_max_us']:.0f} µs")
@@ -0,0 +1,282 @@
+"""Policy inference server: greedy actions from trained Q-tables over a local socket.
+
+Each served model comes from a source. The source may be a `.npy`/`.qckpt`
+Q-table, a compiled `.policy.npy`, or a glob whose newest match is used. Q-tables
+are compiled once with `policy.load_or_compile`, and the compiled table is
+memory-mapped read-only. Every `poll_interval` seconds the sources are checked.
+When a newer file appears, it is loaded off the event loop and swapped in
+between batches. A failed load keeps the old version serving and is reported in
+the stats.
+
+Single-state queries (`OP_ACT`) are not answered one by one. Everything that
+arrived during the current event-loop iteration is answered with one
+`Policy.act_batch` call per model (capped at `max_batch`). The batch therefore
+adapts to load. An idle server answers a lone query right away, and a busy one
+answers in proportionally larger batches, with no fixed timer adding latency.
+`OP_ACT_BATCH` requests are answered directly.
+
+Each model keeps request/decision/batch counters and a log2 histogram of
+server-side latency (receipt to reply, in µs). `OP_STATS` returns them as JSON;
+``python policy_client.py stats`` prints them.
+
+    python policy_server.py q_table_two_passenger.npy
+    python policy_server.py main=q_table_two_passenger.qckpt tiebreak=q_table_two_passenger_tiebreak.npy \\
+        latest='checkpoints/*.qckpt' --address unix:/tmp/taxi_policy.sock --no-tie-break
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from checkpoint import load_q_table
+from policy import Policy, compile_policy, load_or_compile
+from policy_client import ACT_REQ, ACT_RESP, MODEL_ID, OP_ACT, OP_ACT_BATCH, OP_MODEL, OP_STATS
+from rpc import HEADER, RpcError, start_server
+
+N_BUCKETS = 25  # bucket i counts latencies below 2**i µs (and at least 2**(i-1)); the last one is open-ended
+# One OP_ACT reply frame: rpc header followed by the ACT_RESP payload
+_ACT_FRAME = np.dtype([("length", "<u4"), ("op", "u1"), ("req_id", "<u4"), ("action", "u1")])
+assert _ACT_FRAME.itemsize == HEADER.size + ACT_RESP.size
+
+
+def load_policy(path: str, tie_break: bool = True, seed: int | None = None) -> Policy:
+    """A `Policy` for a compiled `.policy.npy` or a Q-table (compiled next to it, or in memory if that fails)."""
+    if path.endswith(".policy.npy"):
+        return Policy.load(path, tie_break=tie_break, seed=seed)
+    try:
+        return load_or_compile(path, tie_break=tie_break, seed=seed)
+    except PermissionError:  # read-only directory: keep the compiled table in memory
+        return Policy(compile_policy(load_q_table(path)), tie_break=tie_break, seed=seed)
+
+
+def _histogram_quantile(counts: np.ndarray, q: float) -> int:
+    """Upper bound (µs) of the bucket holding quantile `q`."""
+    total = counts.sum()
+    if not total:
+        return 0
+    return 1 << int(np.searchsorted(np.cumsum(counts), q * total))
+
+
+class ServedModel:
+    """One named policy: its current version, the queued single queries and the counters."""
+
+    def __init__(self, name: str, source: str, tie_break: bool = True, seed: int | None = None):
+        self.name, self.source = name, source
+        self.tie_break, self.seed = tie_break, seed
+        self.policy: Policy | None = None
+        self.path: str | None = None
+        self.version = 0
+        self.loaded_at = 0.0
+        self.last_error: str | None = None
+        self._key = None
+
+        self.requests = self.decisions = self.batches = 0
+        self.hist = np.zeros(N_BUCKETS, dtype=np.int64)
+        self._rate_mark = (time.monotonic(), 0)
+        self.queue_conns, self.queue_ids, self.queue_states, self.queue_t0 = [], [], [], []
+
+    @property
+    def n_states(self) -> int:
+        return len(self.policy.greedy)
+
+    def newest(self):
+        """``(path, mtime_ns, size)`` of the file the source currently points at."""
+        if glob.has_magic(self.source):
+            paths = [p for p in glob.glob(self.source)
+                     if self.source.endswith(".policy.npy") or not p.endswith(".policy.npy")]
+            if not paths:
+                raise FileNotFoundError(f"nothing matches {self.source}")
+            path = max(paths, key=os.path.getmtime)
+        else:
+            path = self.source
+        st = os.stat(path)
+        return path, st.st_mtime_ns, st.st_size
+
+    def swap(self, policy: Policy, key):
+        self.policy, self._key = policy, key
+        self.path = key[0]
+        self.version += 1
+        self.loaded_at = time.time()
+        self.last_error = None
+
+    def record(self, requests: int, decisions: int, latencies_ns):
+        self.requests += requests
+        self.decisions += decisions
+        self.batches += 1
+        buckets = np.minimum(np.frexp(np.asarray(latencies_ns) * 1e-3)[1].clip(0), N_BUCKETS - 1)
+        self.hist += np.bincount(buckets, minlength=N_BUCKETS)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        mark_time, mark_decisions = self._rate_mark
+        self._rate_mark = (now, self.decisions)
+        return {
+            "path": self.path,
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "last_error": self.last_error,
+            "n_states": self.n_states,
+            "tie_break": self.tie_break,
+            "requests": self.requests,
+            "decisions": self.decisions,
+            "batches": self.batches,
+            "mean_batch": self.decisions / max(1, self.batches),
+            "qps": (self.decisions - mark_decisions) / max(now - mark_time, 1e-9),  # since the previous stats call
+            "latency_us": {
+                "bucket_upper_bounds": [1 << i for i in range(N_BUCKETS)],
+                "counts": self.hist.tolist(),
+                "p50": _histogram_quantile(self.hist, 0.50),
+                "p90": _histogram_quantile(self.hist, 0.90),
+                "p99": _histogram_quantile(self.hist, 0.99),
+            },
+        }
+
+
+class PolicyServer:
+    """The `rpc.Connection` handler: model lookup, micro-batched `OP_ACT` and stats."""
+
+    def __init__(self, models: list[ServedModel], max_batch: int = 8192, poll_interval: float = 2.0):
+        if not models:
+            raise ValueError("no models to serve")
+        self.models = models
+        self.ids = {m.name: i for i, m in enumerate(models)}
+        self.ids[""] = 0
+        self.max_batch = max_batch
+        self.poll_interval = poll_interval
+        self._pending: set[ServedModel] = set()
+        self._flush_handle = None
+        for model in models:
+            key = model.newest()
+            model.swap(load_policy(key[0], model.tie_break, model.seed), key)
+
+    def _model(self, model_id: int) -> ServedModel:
+        if model_id >= len(self.models):
+            raise RpcError(f"unknown model id {model_id}")
+        return self.models[model_id]
+
+    def handle(self, conn, op: int, req_id: int, payload: bytes):
+        t0 = time.perf_counter_ns()
+        if op == OP_ACT:
+            model_id, state = ACT_REQ.unpack(payload)
+            model = self._model(model_id)
+            if state >= model.n_states:
+                raise RpcError(f"state {state} out of range for {model.n_states} states")
+            model.queue_conns.append(conn)
+            model.queue_ids.append(req_id)
+            model.queue_states.append(state)
+            model.queue_t0.append(t0)
+            if len(model.queue_states) >= self.max_batch:
+                self._flush_model(model)
+            else:
+                self._pending.add(model)
+                if self._flush_handle is None:
+                    self._flush_handle = asyncio.get_running_loop().call_soon(self._flush)
+        elif op == OP_ACT_BATCH:
+            model = self._model(MODEL_ID.unpack_from(payload)[0])
+            states = np.frombuffer(payload, dtype="<u2", offset=MODEL_ID.size)
+            if len(states) and states.max() >= model.n_states:
+                raise RpcError(f"state {int(states.max())} out of range for {model.n_states} states")
+            conn.reply(op, req_id, model.policy.act_batch(states).tobytes())
+            model.record(1, len(states), [time.perf_counter_ns() - t0])
+        elif op == OP_MODEL:
+            name = payload.decode()
+            if name not in self.ids:
+                raise RpcError(f"unknown model {name!r}; serving {sorted(m.name for m in self.models)}")
+            conn.reply(op, req_id, MODEL_ID.pack(self.ids[name]))
+        elif op == OP_STATS:
+            conn.reply(op, req_id, json.dumps({m.name: m.stats() for m in self.models}).encode())
+        else:
+            raise RpcError(f"unknown opcode {op}")
+
+    def disconnected(self, conn):
+        pass  # queued replies to a closed connection are dropped by `Connection`
+
+    def _flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, set()
+        for model in pending:
+            self._flush_model(model)
+
+    def _flush_model(self, model: ServedModel):
+        n = len(model.queue_states)
+        if not n:
+            return
+        frames = np.empty(n, dtype=_ACT_FRAME)
+        frames["length"] = ACT_RESP.size
+        frames["op"] = OP_ACT
+        frames["req_id"] = model.queue_ids
+        frames["action"] = model.policy.act_batch(np.array(model.queue_states, dtype=np.intp))
+        data = frames.tobytes()
+
+        conns, size = model.queue_conns, _ACT_FRAME.itemsize
+        start = 0
+        for i in range(1, n + 1):
+            if i == n or conns[i] is not conns[start]:
+                conns[start].reply_frames(data[start * size: i * size], i - start)
+                start = i
+        model.record(n, n, time.perf_counter_ns() - np.array(model.queue_t0, dtype=np.int64))
+        model.queue_conns, model.queue_ids, model.queue_states, model.queue_t0 = [], [], [], []
+
+    async def watch(self):
+        """Reload any model whose source points at a new or rewritten file."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for model in self.models:
+                try:
+                    key = model.newest()
+                    if key == model._key:
+                        continue
+                    policy = await loop.run_in_executor(None, load_policy, key[0], model.tie_break, model.seed)
+                except (OSError, ValueError) as e:  # missing, half-written or incompatible: keep serving the old one
+                    model.last_error = f"{type(e).__name__}: {e}"
+                    continue
+                model.swap(policy, key)
+                print(f"{model.name}: loaded v{model.version} from {model.path}", flush=True)
+
+
+def parse_model_args(specs: list[str], tie_break: bool, seed: int | None) -> list[ServedModel]:
+    """``name=source`` or a bare source (named after the file)."""
+    models = []
+    for spec in specs:
+        name, sep, source = spec.partition("=")
+        if not sep:
+            name, source = os.path.basename(spec).split(".")[0], spec
+        models.append(ServedModel(name, source, tie_break, seed))
+    return models
+
+
+async def serve(address: str, models: list[ServedModel], max_batch: int, poll_interval: float, max_inflight: int):
+    server = PolicyServer(models, max_batch, poll_interval)
+    async with await start_server(server, address, max_inflight) as listener:
+        for model in models:
+            print(f"{model.name}: v{model.version} from {model.path} ({model.n_states} states)", flush=True)
+        print(f"serving {len(models)} model(s) at {address}", flush=True)
+        watcher = asyncio.get_running_loop().create_task(server.watch())
+        try:
+            await listener.serve_forever()
+        finally:
+            watcher.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("models", nargs="*", default=["q_table_two_passenger.npy"],
+                        help="name=source or source; source is a Q-table, a .policy.npy or a glob (newest wins)")
+    parser.add_argument("--address", default="unix:/tmp/taxi_policy.sock", help="unix:/path or host:port")
+    parser.add_argument("--no-tie-break", dest="tie_break", action="store_false",
+                        help="always answer the lowest tied action instead of a random one")
+    parser.add_argument("--seed", type=int, default=None, help="seed for random tie-breaking")
+    parser.add_argument("--max-batch", type=int, default=8192, help="answer queued single queries at this size")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="seconds between checks for new files")
+    parser.add_argument("--max-inflight", type=int, default=256, help="unanswered requests per connection")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.address, parse_model_args(args.models, args.tie_break, args.seed),
+                          args.max_batch, args.poll_interval, args.max_inflight))
+    except KeyboardInterrupt:
+        pass
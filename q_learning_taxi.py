@@ -1,7 +1,11 @@
+import os
 import gymnasium as gym
 import numpy as np
 import random
 from multi_taxi import TaxiTwoPassengerEnv
+from replay import ReplayBuffer, TabularModel, load_planning_state, q_learning_update, save_planning_state
+from checkpoint import load_checkpoint, save_checkpoint
+from telemetry import TelemetryStream
 
 # Hyperparameters
 alpha         = 0.1       # learning rate
@@ -11,47 +15,134 @@ epsilon_decay = 0.9998    # decay epsilon more slowly to allow more exploration
 min_epsilon   = 0.01      # floor for epsilon
 episodes      = 100000    # increased total training episodes for better convergence
 max_steps     = 200       # max steps per episode (env caps at 200 anyway)
+use_action_mask = False   # explore, act and bootstrap only over info["action_mask"] actions
+replay_batch    = 0       # transitions replayed from the buffer per env step (0: no replay)
+planning_steps  = 0       # Dyna-Q updates from the learned model per env step (0: plain Q-learning)
+plan_every      = 32      # env steps between replay/planning rounds, which run as one batched update
+replay_capacity = 1 << 20 # transitions kept in the replay ring buffer (8 bytes each)
+checkpoint_path  = "q_table_two_passenger.qckpt"
+resume           = False   # continue from checkpoint_path; otherwise start from scratch and overwrite it
+planning_path    = "q_table_two_passenger.planning.npz"  # replay buffer, Dyna-Q model and masks at the checkpoint
+checkpoint_every = 5000    # episodes between checkpoints
+telemetry_path   = "training_telemetry.bin"  # per-episode records; watch with `python telemetry.py tail -f`
 
 # Set up environment and Q‐table
 env = gym.make("TaxiTwoPassenger-v0")
 n_states  = env.observation_space.n
 n_actions = env.action_space.n
 Q = np.zeros((n_states, n_actions), dtype=np.float32)
+hyperparameters = dict(alpha=alpha, gamma=gamma, epsilon_decay=epsilon_decay, min_epsilon=min_epsilon,
+                       episodes=episodes, max_steps=max_steps, use_action_mask=use_action_mask,
+                       replay_batch=replay_batch, planning_steps=planning_steps, plan_every=plan_every)
+
+# Replay buffer, Dyna-Q model and the per-state mask table (latest mask seen per state)
+buffer = ReplayBuffer(replay_capacity) if replay_batch else None
+model  = TabularModel(n_states, n_actions) if planning_steps else None
+masks  = np.ones((n_states, n_actions), dtype=bool) if use_action_mask else None
+plan_rng = np.random.default_rng(random.getrandbits(64))  # replay/planning draws; its state is checkpointed
+env_steps = 0
+
+# Resume from the last checkpoint, restoring every RNG stream and the planning state so the run continues exactly
+start_ep = 0
+if resume:
+    if not os.path.exists(checkpoint_path):
+        raise SystemExit(f"resume is set but {checkpoint_path} does not exist")
+    saved_Q, header = load_checkpoint(checkpoint_path, env.unwrapped, mmap=False)
+    if header.get("trainer") != "q_learning_taxi":
+        raise SystemExit(f"{checkpoint_path} was written by {header.get('trainer')!r}, not q_learning_taxi")
+    saved = header.get("hyperparameters", {})
+    # `episodes` may be raised to train a finished run further; everything else must match
+    differ = {k: (saved.get(k), v) for k, v in hyperparameters.items() if k != "episodes" and saved.get(k) != v}
+    if differ:
+        raise SystemExit(f"{checkpoint_path} was trained with different hyperparameters: "
+                         + ", ".join(f"{k}={got!r} (script has {want!r})" for k, (got, want) in differ.items()))
+    if header["episode"] >= episodes:
+        raise SystemExit(f"{checkpoint_path} is already at episode {header['episode']}; raise `episodes` to continue")
+    Q[:] = saved_Q
+    start_ep, epsilon, env_steps = header["episode"], header["epsilon"], header["env_steps"]
+    version, internal, gauss = header["rng_state"]["python"]
+    random.setstate((version, tuple(internal), gauss))
+    env.unwrapped.np_random.bit_generator.state = header["rng_state"]["env"]
+    plan_rng.bit_generator.state = header["rng_state"]["plan"]
+    if buffer is not None or model is not None or masks is not None:
+        load_planning_state(planning_path, start_ep, buffer, model, masks)
+    print(f"Resuming from {checkpoint_path} at episode {start_ep}")
+
+telemetry = TelemetryStream(telemetry_path, append=start_ep > 0)
 
 # Training loop
-for ep in range(episodes):
-    state, _     = env.reset()
+for ep in range(start_ep, episodes):
+    state, info  = env.reset()
     total_reward = 0
 
     for step in range(max_steps):
         # Epsilon-greedy action selection
         if random.random() < epsilon:
-            action = random.randint(0, n_actions - 1)
+            if use_action_mask:
+                action = int(random.choice(np.flatnonzero(info["action_mask"])))
+            else:
+                action = random.randint(0, n_actions - 1)
         else:
-            q_vals = Q[state]
+            q_vals = np.where(info["action_mask"], Q[state], -np.inf) if use_action_mask else Q[state]
             max_q  = np.max(q_vals)
 
             candidates = np.where(np.isclose(q_vals, max_q, atol=1e-8))[0]
             action = int(random.choice(candidates))
 
-        next_state, reward, terminated, truncated, _ = env.step(action)
+        next_state, reward, terminated, truncated, info = env.step(action)
         done = terminated or truncated
 
-        # Q-learning update
-        max_q_next = np.max(Q[next_state])
-        Q[state, action] += alpha * (reward + gamma * max_q_next - Q[state, action])
+        # Q-learning update; a terminating step has no next value to bootstrap from
+        if terminated:
+            target = reward
+        elif use_action_mask:
+            target = reward + gamma * np.max(Q[next_state][info["action_mask"] == 1])
+        else:
+            target = reward + gamma * np.max(Q[next_state])
+        Q[state, action] += alpha * (target - Q[state, action])
+
+        # Replay and planning, batched every `plan_every` env steps
+        env_steps += 1
+        if buffer is not None:
+            buffer.append(state, action, reward, next_state, terminated)
+        if model is not None:
+            model.update(state, action, reward, next_state, terminated)
+        if masks is not None:
+            masks[next_state] = info["action_mask"]
+        if env_steps % plan_every == 0:
+            if buffer is not None:
+                batch = buffer.sample(replay_batch * plan_every, plan_rng)
+                q_learning_update(Q, batch["state"], batch["action"], batch["reward"], batch["next_state"],
+                                  batch["done"], alpha, gamma, masks)
+            if model is not None:
+                q_learning_update(Q, *model.sample(planning_steps * plan_every, plan_rng), alpha, gamma, masks)
 
         state = next_state
         total_reward += reward
         if done:
             break
 
+    telemetry.record(ep + 1, total_reward, step + 1, sum(env.unwrapped.passengers_delivered), epsilon)
+
     # Decay epsilon
     epsilon = max(min_epsilon, epsilon * epsilon_decay)
 
+    if (ep + 1) % checkpoint_every == 0:
+        if buffer is not None or model is not None or masks is not None:
+            save_planning_state(planning_path, ep + 1, buffer, model, masks)
+        save_checkpoint(checkpoint_path, Q, env.unwrapped, trainer="q_learning_taxi",
+                        hyperparameters=hyperparameters, epsilon=epsilon, episode=ep + 1, env_steps=env_steps,
+                        rng_state={"python": random.getstate(), "env": env.unwrapped.np_random.bit_generator.state,
+                                   "plan": plan_rng.bit_generator.state})
+
     # Print progress
     if (ep + 1) % 3000 == 0:
-        print(f"Episode {ep + 1:>5}/{episodes}: epsilon={epsilon:.3f}  last_reward={total_reward}")
+        stats = telemetry.rolling()
+        print(f"Episode {ep + 1:>5}/{episodes}: epsilon={epsilon:.3f}  "
+              f"mean_reward={stats['mean_return']:.1f}  mean_steps={stats['mean_length']:.1f}  "
+              f"deliveries={stats['mean_deliveries']:.2f}  (last {stats['episodes']} episodes)")
+telemetry.close()
+
 # Save Q-table
 
 np.save("q_table_two_passenger.npy", Q)
@@ -0,0 +1,195 @@
+"""Q-table storage layouts behind one interface.
+
+Every layout keeps its action values in a 2-D `values` array and maps states to
+rows of it with `rows(states)`. Trainers read ``values[rows]`` and write with
+`scatter_q_update(values, rows, ...)`, whatever the layout.
+
+* `DenseQ`: one row per encoded state, the plain ``(n_states, n_actions)`` table.
+* `CompactQ`: one row per reachable state (see `reachable.py`). It is smaller and
+  denser in cache when much of the encoding can never occur.
+* `HashedQ`: rows are allocated on first insert through an open-addressing hash
+  table. Memory follows the states actually visited, which suits variants such as
+  `TaxiKPassengerEnv(5)` whose encodings do not fit a dense table.
+
+`CompactQ` and `HashedQ` reserve row 0 as an all-zero row for states they do not
+hold. Such states read as unvisited (all zeros) and must not be written.
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+LAYOUTS = ("dense", "compact", "hashed")
+_DENSE_LOOKUP_MAX = 1 << 24  # above this many states CompactQ binary-searches instead of using a lookup array
+_EMPTY = -1
+_FIBONACCI = np.uint64(11400714819323198485)  # 2**64 / golden ratio
+
+
+class QStore(ABC):
+    values: np.ndarray
+
+    @abstractmethod
+    def rows(self, states, insert: bool = False) -> np.ndarray:
+        """Row of `values` for each state; with `insert`, rows are allocated for new states."""
+
+    def __getitem__(self, states) -> np.ndarray:
+        return self.values[self.rows(states)]
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+    @abstractmethod
+    def to_dense(self, n_states: int) -> np.ndarray:
+        """The values as a ``(n_states, n_actions)`` table, zeros for states not held."""
+
+    @abstractmethod
+    def load_dense(self, Q: np.ndarray):
+        """Overwrite the stored values with those of a dense table."""
+
+
+class DenseQ(QStore):
+    def __init__(self, n_states: int, n_actions: int = 6, dtype=np.float32):
+        self.values = np.zeros((n_states, n_actions), dtype=dtype)
+
+    def rows(self, states, insert: bool = False) -> np.ndarray:
+        return np.asarray(states, dtype=np.intp)
+
+    def to_dense(self, n_states: int) -> np.ndarray:
+        return self.values
+
+    def load_dense(self, Q: np.ndarray):
+        self.values[:] = Q
+
+
+class CompactQ(QStore):
+    """Rows for a fixed, sorted set of `states` (typically `ReachableIndex.observations`)."""
+
+    def __init__(self, states: np.ndarray, n_states: int, n_actions: int = 6, dtype=np.float32):
+        self.states = np.asarray(states, dtype=np.int64)
+        self.values = np.zeros((len(self.states) + 1, n_actions), dtype=dtype)
+        self._lookup = None
+        if n_states <= _DENSE_LOOKUP_MAX:
+            self._lookup = np.zeros(n_states, dtype=np.int32)
+            self._lookup[self.states] = np.arange(1, len(self.states) + 1)
+
+    def rows(self, states, insert: bool = False) -> np.ndarray:
+        if self._lookup is not None:
+            return self._lookup[states]
+        states = np.asarray(states, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.states, states), len(self.states) - 1)
+        return np.where(self.states[pos] == states, pos + 1, 0)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.states.nbytes + (0 if self._lookup is None else self._lookup.nbytes)
+
+    def to_dense(self, n_states: int) -> np.ndarray:
+        Q = np.zeros((n_states, self.values.shape[1]), dtype=self.values.dtype)
+        Q[self.states] = self.values[1:]
+        return Q
+
+    def load_dense(self, Q: np.ndarray):
+        self.values[1:] = Q[self.states]
+
+
+class HashedQ(QStore):
+    """Rows allocated on demand; state -> row via a vectorized linear-probing hash table."""
+
+    def __init__(self, n_actions: int = 6, capacity: int = 1024, dtype=np.float32):
+        self._clear(capacity, n_actions, dtype)
+
+    def _clear(self, capacity: int, n_actions: int, dtype):
+        """Drop every state: only the zero row and an empty slot table sized for `capacity` states."""
+        self.n = 0  # rows in use, not counting the zero row
+        self.values = np.zeros((capacity + 1, n_actions), dtype=dtype)
+        self._alloc_slots(2 * capacity)
+
+    def _alloc_slots(self, size: int):
+        self._bits = max(4, int(size - 1).bit_length())
+        self._mask = (1 << self._bits) - 1
+        self._keys = np.full(1 << self._bits, _EMPTY, dtype=np.int64)
+        self._slot_rows = np.zeros(1 << self._bits, dtype=np.int32)
+
+    def _probe(self, keys: np.ndarray) -> np.ndarray:
+        """Slot holding each key, or the empty slot where it would be inserted."""
+        slot = ((keys.astype(np.uint64) * _FIBONACCI) >> np.uint64(64 - self._bits)).astype(np.intp)
+        pending = np.arange(len(keys))
+        while len(pending):
+            found = self._keys[slot[pending]]
+            pending = pending[(found != keys[pending]) & (found != _EMPTY)]
+            slot[pending] = (slot[pending] + 1) & self._mask
+        return slot
+
+    def _place(self, keys: np.ndarray, rows: np.ndarray):
+        """Insert distinct absent `keys`; when several claim one empty slot, one wins and the rest probe on."""
+        pending = np.arange(len(keys))
+        while len(pending):
+            slot = self._probe(keys[pending])
+            self._keys[slot] = keys[pending]
+            won = self._keys[slot] == keys[pending]
+            self._slot_rows[slot[won]] = rows[pending[won]]
+            pending = pending[~won]
+
+    def _insert(self, keys: np.ndarray):
+        rows = np.arange(self.n + 1, self.n + 1 + len(keys), dtype=np.int32)
+        self.n += len(keys)
+        if self.n + 1 > len(self.values):
+            grown = np.zeros((max(2 * len(self.values), self.n + 1), self.values.shape[1]), dtype=self.values.dtype)
+            grown[: len(self.values)] = self.values
+            self.values = grown
+        if 2 * self.n > len(self._keys):  # keep the load factor at or below 1/2
+            used = self._keys != _EMPTY
+            old_keys, old_rows = self._keys[used], self._slot_rows[used]
+            self._alloc_slots(2 * self.n)
+            self._place(old_keys, old_rows)
+        self._place(keys, rows)
+
+    def rows(self, states, insert: bool = False) -> np.ndarray:
+        """Rows of `states`; absent ones get new zeroed rows with `insert`, else the zero row."""
+        states = np.asarray(states, dtype=np.int64)
+        keys = states.reshape(-1)
+        slot = self._probe(keys)
+        found = self._keys[slot] == keys
+        if insert and not found.all():
+            self._insert(np.unique(keys[~found]))
+            slot = self._probe(keys)
+            found = self._keys[slot] == keys
+        return np.where(found, self._slot_rows[slot], 0).reshape(states.shape)
+
+    @property
+    def states(self) -> np.ndarray:
+        return self._keys[self._keys != _EMPTY]
+
+    @property
+    def nbytes(self) -> int:
+        return self.values[: self.n + 1].nbytes + self._keys.nbytes + self._slot_rows.nbytes
+
+    def to_dense(self, n_states: int) -> np.ndarray:
+        Q = np.zeros((n_states, self.values.shape[1]), dtype=self.values.dtype)
+        used = self._keys != _EMPTY
+        Q[self._keys[used]] = self.values[self._slot_rows[used]]
+        return Q
+
+    def load_dense(self, Q: np.ndarray):
+        """Replace the contents with the nonzero rows of `Q`.
+
+        All-zero rows are not stored, since they read the same as absent states. So
+        `n` and `states` after a save/load round trip count only the states whose
+        values were nonzero, which can be fewer than were inserted before.
+        """
+        states = np.flatnonzero(Q.any(axis=1))
+        self._clear(max(1, len(states)), Q.shape[1], self.values.dtype)
+        rows = self.rows(states, insert=True)  # may reallocate `values`
+        self.values[rows] = Q[states]
+
+
+def make_q_store(layout: str, n_states: int, n_actions: int = 6, k: int = 2, dtype=np.float32) -> QStore:
+    """A zeroed store; ``compact`` uses the reachable observations of the `k`-passenger env."""
+    if layout == "dense":
+        return DenseQ(n_states, n_actions, dtype)
+    if layout == "compact":
+        from reachable import reachable_index
+        return CompactQ(reachable_index(k).observations, n_states, n_actions, dtype)
+    if layout == "hashed":
+        return HashedQ(n_actions, dtype=dtype)
+    raise ValueError(f"unknown Q storage layout {layout!r}; expected one of {LAYOUTS}")
@@ -0,0 +1,267 @@
+"""Batch rasterizer: `TaxiTwoPassengerEnv` frames for many states at once, in NumPy.
+
+`_render_gui` draws one state at a time through pygame. `FrameRasterizer` draws the
+same picture for a whole array of observations. It copies a cached board into every
+frame, then stamps cached cell-sized sprite masks for the passengers and the taxi.
+Frames are `(N, H, W, 3)` uint8 and pixel-identical to ``render_mode="rgb_array"``.
+With `downsample=k` they equal ``frame[::k, ::k]``. The legend text is taken from
+pygame's font renderer when pygame is installed and left blank otherwise.
+
+`FrameWriter` streams frames into a growing `.npy` file through a memory map.
+`render` can write straight into the mapped file, so no intermediate copy is made.
+
+    python rasterize.py q_table_two_passenger.npy --episodes 100 --downsample 4 --out episodes.frames.npy
+    python rasterize.py --bench --downsample 4
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from multi_taxi import CODEC, TaxiTwoPassengerEnv, sample_ext_starts
+
+# cell sizes are multiples of these, so every cell starts on the sampling grid
+DOWNSAMPLE_FACTORS = (1, 2, 4, 5, 10, 20)
+
+
+def _circle(h: int, w: int, cy: int, cx: int, radius: int) -> np.ndarray:
+    """Mask of a filled `pygame.draw.circle` (same rasterization rule for the radii used here)."""
+    yy, xx = np.mgrid[:h, :w]
+    return (yy - cy + 0.5) ** 2 + (xx - cx + 0.5) ** 2 <= radius * radius - 2
+
+
+class FrameRasterizer:
+    """Renders observations of `env` (default: a fresh `TaxiTwoPassengerEnv`) as RGB frames."""
+
+    def __init__(self, env: TaxiTwoPassengerEnv | None = None, downsample: int = 1, legend: bool = True):
+        if downsample not in DOWNSAMPLE_FACTORS:
+            raise ValueError(f"downsample must be one of {DOWNSAMPLE_FACTORS}, got {downsample}")
+        env = env or TaxiTwoPassengerEnv()
+        self.env = env
+        self.k = k = downsample
+        cw, ch, border = env.CELL_W, env.CELL_H, env.BORDER
+        width, height = env.WINDOW_SIZE if legend else (5 * cw + border - 1, env.WINDOW_SIZE[1])
+        self.cell_h, self.cell_w = ch // k, cw // k
+        self.board = self._draw_board(env, height, width, legend)[::k, ::k].copy()
+        self.frame_shape = self.board.shape
+
+        # Sprite masks cover a whole cell so they stay aligned after downsampling
+        taxi = np.zeros((ch, cw), dtype=bool)
+        taxi[20:ch - 20, 20:cw - 20] = True
+        self._passenger = _circle(ch, cw, ch // 2, cw // 2, 10)[::k, ::k]
+        self._taxi = taxi[::k, ::k]
+        self._cell_origin = np.array([(r * ch // k, c * cw // k) for r in range(5) for c in range(5)])
+        self._loc_cell = np.array([r * 5 + c for r, c in env.locs])
+
+    @staticmethod
+    def _draw_board(env, height: int, width: int, legend: bool) -> np.ndarray:
+        """The static layer of `_render_gui` (grid, obstacles, destinations, legend) as an array."""
+        cw, ch, border = env.CELL_W, env.CELL_H, env.BORDER
+        board = np.empty((height, width, 3), dtype=np.uint8)
+        board[:] = env.WHITE
+        lo, hi = border // 2 - 1, border // 2  # a width-4 pygame line at y covers y-1 .. y+2
+        for c in range(6):
+            board[: 5 * ch + 1, max(0, c * cw - lo): c * cw + hi + 1] = env.BLACK
+        for r in range(6):
+            board[max(0, r * ch - lo): r * ch + hi + 1, : 5 * cw + 1] = env.BLACK
+        for (r, c) in env.obstacles:
+            board[r * ch + 10: (r + 1) * ch - 10, c * cw + 10: (c + 1) * cw - 10] = env.GRAY
+        for idx, (r, c) in enumerate(env.locs):
+            y0, y1, x0, x1 = r * ch + 10, (r + 1) * ch - 10, c * cw + 10, (c + 1) * cw - 10
+            color = env.DEST_COLORS[idx]
+            board[y0: y0 + border, x0:x1] = board[y1 - border: y1, x0:x1] = color
+            board[y0:y1, x0: x0 + border] = board[y0:y1, x1 - border: x1] = color
+        if legend:
+            text = _legend_pixels(env)
+            if text is not None:
+                ink = (text != env.WHITE).any(axis=2)
+                board[ink] = text[ink]
+        return board
+
+    def _stamp(self, out: np.ndarray, frames: np.ndarray, cells: np.ndarray, mask: np.ndarray, color):
+        """Paint `mask` in `color` into cell `cells[i]` of frame `frames[i]`."""
+        h, w = self.cell_h, self.cell_w
+        color = np.array(color, dtype=np.uint8)
+        order = np.argsort(cells, kind="stable")
+        bounds = np.flatnonzero(np.diff(cells[order])) + 1
+        for group in np.split(order, bounds):
+            if not len(group):
+                continue
+            y, x = self._cell_origin[cells[group[0]]]
+            sel = frames[group]
+            block = out[sel, y:y + h, x:x + w]
+            block[:, mask] = color
+            out[sel, y:y + h, x:x + w] = block
+
+    def render(self, states, out: np.ndarray | None = None) -> np.ndarray:
+        """Frames for an array of observations; fills and returns `out` if given.
+
+        Delivered passengers sit on their destination cell, and the passenger index
+        4 means "in the taxi", so observations alone determine the picture. Pass
+        ``ext_states >> 2`` to render extended states.
+        """
+        states = np.asarray(states, dtype=np.int64).reshape(-1)
+        n = len(states)
+        if out is None:
+            out = np.empty((n, *self.frame_shape), dtype=np.uint8)
+        out[:] = self.board
+        r, c, p1, _, p2, _ = CODEC.decode_batch(states, dtype=np.intp)
+        frames = np.arange(n)
+        env = self.env
+        for p, color in ((p1, env.BLACK), (p2, env.ORANGE)):
+            waiting = p < 4
+            self._stamp(out, frames[waiting], self._loc_cell[p[waiting]], self._passenger, color)
+        self._stamp(out, frames, r * 5 + c, self._taxi, env.YELLOW)
+        for p, color in ((p1, env.BLACK), (p2, env.ORANGE)):
+            riding = p == 4
+            self._stamp(out, frames[riding], (r * 5 + c)[riding], self._passenger, color)
+        return out
+
+
+def _legend_pixels(env) -> np.ndarray | None:
+    """The legend text as `_draw_board` renders it, or None without pygame."""
+    try:
+        import pygame
+    except ImportError:
+        return None
+    pygame.font.init()
+    surface = pygame.Surface(env.WINDOW_SIZE)
+    surface.fill(env.WHITE)
+    font = pygame.font.SysFont(None, 18)
+    for i, (title, desc) in enumerate(env.LEGEND):
+        surface.blit(font.render(f"{title}: {desc}", True, env.BLACK), (520, 20 + i * 25))
+    return np.transpose(pygame.surfarray.array3d(surface), (1, 0, 2))
+
+
+# -----------------------------------------------------------------------------
+#  Memory-mapped frame files
+# -----------------------------------------------------------------------------
+class FrameWriter:
+    """Appends frames to an `.npy` file of shape (N, H, W, 3), readable with `np.load(path, mmap_mode="r")`.
+
+    The file is grown in chunks and mapped; `append` renders directly into the
+    mapping. `close` trims the spare capacity and rewrites the header in place.
+    """
+
+    def __init__(self, path: str, rasterizer: FrameRasterizer, chunk: int = 4096):
+        self.path = path
+        self.rasterizer = rasterizer
+        self.frame_shape = rasterizer.frame_shape
+        self.frame_bytes = int(np.prod(self.frame_shape))
+        self.chunk = chunk
+        self.count = 0
+        self.capacity = 0
+        self._frames = None
+        with open(path, "wb") as f:
+            self._write_header(f)
+            self.header_len = f.tell()
+
+    def _write_header(self, f):
+        np.lib.format.write_array_header_1_0(
+            f, {"descr": "|u1", "fortran_order": False, "shape": (self.count, *self.frame_shape)}
+        )
+
+    def _reserve(self, n: int) -> np.ndarray:
+        if self.count + n > self.capacity:
+            self.capacity = max(2 * self.capacity, self.count + n, self.chunk)
+            if self._frames is not None:
+                self._frames.flush()
+            self._frames = None
+            os.truncate(self.path, self.header_len + self.capacity * self.frame_bytes)
+            self._frames = np.memmap(self.path, dtype=np.uint8, mode="r+", offset=self.header_len,
+                                     shape=(self.capacity, *self.frame_shape))
+        view = self._frames[self.count: self.count + n]
+        self.count += n
+        return view
+
+    def append(self, states) -> int:
+        """Render observations straight into the file; returns the index of the first new frame."""
+        states = np.asarray(states).reshape(-1)
+        first = self.count
+        self.rasterizer.render(states, out=self._reserve(len(states)))
+        return first
+
+    def write(self, frames: np.ndarray) -> int:
+        """Copy already rendered frames into the file; returns the index of the first one."""
+        first = self.count
+        self._reserve(len(frames))[:] = frames
+        return first
+
+    def close(self):
+        if self._frames is not None:
+            self._frames.flush()
+            self._frames = None
+        os.truncate(self.path, self.header_len + self.count * self.frame_bytes)
+        with open(self.path, "r+b") as f:
+            self._write_header(f)
+            assert f.tell() == self.header_len
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# -----------------------------------------------------------------------------
+#  Recording evaluation episodes
+# -----------------------------------------------------------------------------
+def record_episodes(Q: np.ndarray, writer: FrameWriter, episodes: int, seed: int = 0, max_steps: int = 200):
+    """Greedy rollouts from seeded starts, written episode by episode; returns each episode's first frame index."""
+    from policy import Policy, compile_policy
+
+    model = TaxiTwoPassengerEnv().model
+    policy = Policy(compile_policy(Q), tie_break=False, seed=seed)
+    states = sample_ext_starts(np.random.default_rng(seed), episodes)
+    trajectory = [states >> 2]
+    lengths = np.full(episodes, max_steps)
+    done = np.zeros(episodes, dtype=bool)
+    for t in range(max_steps):
+        actions = policy.act_batch(states >> 2)
+        terminated = model.terminated[states, actions]
+        states = np.where(done, states, model.next_state[states, actions])
+        trajectory.append(states >> 2)
+        lengths[terminated & ~done] = t + 1
+        done |= terminated
+        if done.all():
+            break
+    trajectory = np.stack(trajectory, axis=1)
+    return np.array([writer.append(trajectory[i, : lengths[i] + 1]) for i in range(episodes)])
+
+
+def bench(downsample: int, n: int = 20000, batch: int = 1000):
+    raster = FrameRasterizer(downsample=downsample)
+    states = np.random.default_rng(0).integers(TaxiTwoPassengerEnv.observation_space.n, size=n)
+    out = np.empty((batch, *raster.frame_shape), dtype=np.uint8)
+    start = time.perf_counter()
+    for i in range(0, n, batch):
+        raster.render(states[i:i + batch], out=out[: len(states[i:i + batch])])
+    rate = n / (time.perf_counter() - start)
+    print(f"downsample {downsample}: {raster.frame_shape} frames, {rate:,.0f} frames/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("table", nargs="?", default="q_table_two_passenger.npy")
+    parser.add_argument("--episodes", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--downsample", type=int, default=1, choices=DOWNSAMPLE_FACTORS)
+    parser.add_argument("--no-legend", action="store_true", help="crop frames to the board")
+    parser.add_argument("--out", default="episodes.frames.npy")
+    parser.add_argument("--bench", action="store_true", help="measure rendering throughput instead")
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.downsample)
+    else:
+        from checkpoint import load_q_table
+
+        raster = FrameRasterizer(downsample=args.downsample, legend=not args.no_legend)
+        start = time.perf_counter()
+        with FrameWriter(args.out, raster) as writer:
+            offsets = record_episodes(load_q_table(args.table), writer, args.episodes, args.seed)
+        index = args.out.removesuffix(".npy") + ".episodes.npy"
+        np.save(index, offsets)
+        print(f"Wrote {writer.count} frames of {args.episodes} episodes to {args.out} "
+              f"in {time.perf_counter() - start:.2f}s; episode start indices in {index}")
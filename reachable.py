@@ -0,0 +1,120 @@
+"""Reachable-state index: which encoded states can actually occur in an episode.
+
+A breadth-first search runs over extended states (observation + hidden delivered
+flags), starting from every state `_generate_random_state` can produce. Terminal
+states are recorded but not expanded. For the two-passenger env this finds
+13 052 of the 40 000 extended states and 9 344 of the 10 000 observations. For
+K = 3 it finds 301 268 of 1.6 M extended states and 173 056 of 200 000
+observations. Tables keyed by this index (see `q_storage.CompactQ`) scale with
+what is reachable rather than with the encoding's cartesian product.
+
+    python reachable.py              # two-passenger env
+    python reachable.py --k 3 --out reachable_k3.npz
+"""
+import argparse
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from multi_taxi import TaxiTwoPassengerEnv
+
+
+def bfs(starts: np.ndarray, successors) -> np.ndarray:
+    """Sorted extended states reachable from `starts`.
+
+    ``successors(states)`` returns (next_states, terminated), both shaped [len(states), n_actions].
+    """
+    visited = np.unique(starts)
+    frontier = visited
+    while len(frontier):
+        next_states, terminated = successors(frontier)
+        live = np.setdiff1d(np.unique(next_states[~terminated]), visited, assume_unique=True)
+        ends = np.setdiff1d(np.unique(next_states[terminated]), visited, assume_unique=True)
+        visited = np.union1d(visited, np.union1d(live, ends))
+        frontier = live
+    return visited
+
+
+class ReachableIndex:
+    """Dense numbering of reachable extended states and of the observations they produce.
+
+    `ext_states` and `observations` are sorted, so position ``i`` is the index of a
+    state; `index` maps states to positions with -1 for unreachable ones.
+    """
+
+    def __init__(self, ext_states: np.ndarray, k: int, n_states: int):
+        self.k = k
+        self.n_states = n_states
+        self.ext_states = np.asarray(ext_states, dtype=np.int64)
+        self.observations = np.unique(self.ext_states >> k)
+
+    def __len__(self) -> int:
+        return len(self.observations)
+
+    @staticmethod
+    def _positions(sorted_states: np.ndarray, states) -> np.ndarray:
+        states = np.asarray(states, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(sorted_states, states), len(sorted_states) - 1)
+        return np.where(sorted_states[pos] == states, pos, -1)
+
+    def index(self, observations) -> np.ndarray:
+        """Position of each observation in `observations`, or -1 if it can never occur."""
+        return self._positions(self.observations, observations)
+
+    def ext_index(self, ext_states) -> np.ndarray:
+        return self._positions(self.ext_states, ext_states)
+
+    def save(self, path: str):
+        np.savez(path, ext_states=self.ext_states, k=self.k, n_states=self.n_states)
+
+    @classmethod
+    def load(cls, path: str) -> "ReachableIndex":
+        with np.load(path) as f:
+            return cls(f["ext_states"], int(f["k"]), int(f["n_states"]))
+
+
+def _two_passenger_search() -> np.ndarray:
+    from batch_evaluate import all_start_states
+
+    model = TaxiTwoPassengerEnv().model
+    return bfs(all_start_states(), lambda s: (model.next_state[s].astype(np.int64), model.terminated[s]))
+
+
+def _k_passenger_search(k: int) -> np.ndarray:
+    from k_passenger_taxi import TaxiKPassengerEnv
+
+    env = TaxiKPassengerEnv(k)
+    digits = np.meshgrid(*(np.arange(n) for n in (5, 5) + (4, 4) * k), indexing="ij")
+    starts = env.codec.encode_batch(*(g.ravel() for g in digits)) << k
+
+    def successors(states):
+        actions = np.tile(np.arange(6), len(states))
+        next_states, _, terminated, _ = env.step_batch(np.repeat(states, 6), actions)
+        return next_states.reshape(-1, 6), terminated.reshape(-1, 6)
+
+    return bfs(starts, successors)
+
+
+@lru_cache(maxsize=None)
+def reachable_index(k: int = 2) -> ReachableIndex:
+    """The index for the two-passenger env (``k=2``) or `TaxiKPassengerEnv(k)`, built once per process."""
+    if k == 2:
+        return ReachableIndex(_two_passenger_search(), 2, TaxiTwoPassengerEnv.observation_space.n)
+    return ReachableIndex(_k_passenger_search(k), k, 25 * 20**k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=2, help="number of passengers")
+    parser.add_argument("--out", default=None, help="save the index as .npz")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = reachable_index(args.k)
+    n_obs = index.n_states
+    print(f"K={args.k}: {len(index.ext_states):,} of {n_obs << args.k:,} extended states and "
+          f"{len(index):,} of {n_obs:,} observations reachable ({len(index) / n_obs:.1%}), "
+          f"found in {time.perf_counter() - start:.2f}s")
+    if args.out:
+        index.save(args.out)
@@ -0,0 +1,227 @@
+"""Length-prefixed binary framing for the local servers (`env_server.py`, ...).
+
+Every message is one frame: a 9-byte ``<IBI`` header (payload length, opcode,
+request id) followed by the payload. A response echoes the opcode and id of its
+request, so a connection can carry many requests at once and they may be
+answered out of order. A failed request is answered with `OP_ERROR` and a
+UTF-8 message.
+
+Addresses are ``unix:/path/to.sock`` or ``host:port`` (TCP, meant for localhost).
+
+Backpressure works per connection. Once `max_inflight` requests are unanswered,
+the server stops reading that socket until replies go out. The kernel buffers
+then fill and the client's writes block (or its ``drain()`` waits). Replies go
+through the transport's flow control the same way.
+"""
+import asyncio
+import os
+import socket
+import struct
+
+HEADER = struct.Struct("<IBI")  # payload length, opcode, request id
+OP_ERROR = 0xFF
+MAX_PAYLOAD = 1 << 24
+
+
+class RpcError(RuntimeError):
+    """A request the server answered with `OP_ERROR`, or a malformed one it refused."""
+
+
+def parse_address(address: str):
+    """``("unix", path)`` or ``("tcp", (host, port))``."""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    if not port.isdigit():
+        raise ValueError(f"bad address {address!r}; expected unix:/path or host:port")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+def pack_frame(op: int, req_id: int, payload: bytes = b"") -> bytes:
+    return HEADER.pack(len(payload), op, req_id) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """The next ``(op, req_id, payload)``, or None on a clean EOF between frames."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError("connection closed mid-frame") from None
+        return None
+    length, op, req_id = HEADER.unpack(header)
+    if length > MAX_PAYLOAD:
+        raise ConnectionError(f"frame of {length} bytes exceeds MAX_PAYLOAD")
+    try:
+        return op, req_id, await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("connection closed mid-frame") from None
+
+
+# -----------------------------------------------------------------------------
+#  Server side
+# -----------------------------------------------------------------------------
+class Connection:
+    """Server end of one client connection.
+
+    The handler answers each request exactly once, right away or later (e.g. from a
+    batch flush), with `reply`, `reply_frames` or `error`.
+    """
+
+    def __init__(self, reader, writer, max_inflight: int):
+        self.reader, self.writer = reader, writer
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.closed = False
+        self._room = asyncio.Event()
+        self._room.set()
+
+    def _answered(self, n: int):
+        self.inflight -= n
+        if self.inflight < self.max_inflight:
+            self._room.set()
+
+    def reply(self, op: int, req_id: int, payload: bytes = b""):
+        if not self.closed:
+            self.writer.write(pack_frame(op, req_id, payload))
+        self._answered(1)
+
+    def reply_frames(self, frames: bytes, n: int):
+        """Send `n` already-packed response frames in one write."""
+        if not self.closed:
+            self.writer.write(frames)
+        self._answered(n)
+
+    def error(self, req_id: int, message: str):
+        self.reply(OP_ERROR, req_id, message.encode())
+
+    async def serve(self, handler):
+        """Read requests and pass them to ``handler.handle(conn, op, req_id, payload)`` until EOF."""
+        try:
+            while True:
+                if self.inflight >= self.max_inflight:
+                    self._room.clear()
+                    await self._room.wait()
+                frame = await read_frame(self.reader)
+                if frame is None:
+                    break
+                op, req_id, payload = frame
+                self.inflight += 1
+                try:
+                    handler.handle(self, op, req_id, payload)
+                except (RpcError, ValueError, KeyError, struct.error) as e:
+                    self.error(req_id, f"{type(e).__name__}: {e}")
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.closed = True
+            handler.disconnected(self)
+            self.writer.close()
+
+
+async def start_server(handler, address: str, max_inflight: int = 64):
+    """Serve `handler` (an object with ``handle`` and ``disconnected``) at `address`."""
+    async def on_connect(reader, writer):
+        await Connection(reader, writer, max_inflight).serve(handler)
+
+    kind, where = parse_address(address)
+    if kind == "unix":
+        if os.path.exists(where):  # stale socket from an earlier run
+            os.unlink(where)
+        return await asyncio.start_unix_server(on_connect, where)
+    return await asyncio.start_server(on_connect, *where)
+
+
+# -----------------------------------------------------------------------------
+#  Client side
+# -----------------------------------------------------------------------------
+class RpcClient:
+    """Asyncio client: many concurrent `call`s share one connection."""
+
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+        self._pending: dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_responses())
+
+    @classmethod
+    async def connect(cls, address: str) -> "RpcClient":
+        kind, where = parse_address(address)
+        if kind == "unix":
+            reader, writer = await asyncio.open_unix_connection(where)
+        else:
+            reader, writer = await asyncio.open_connection(*where)
+        return cls(reader, writer)
+
+    async def _read_responses(self):
+        error = ConnectionError("connection closed")
+        try:
+            while (frame := await read_frame(self.reader)) is not None:
+                op, req_id, payload = frame
+                fut = self._pending.pop(req_id, None)
+                if fut is None or fut.done():
+                    continue
+                if op == OP_ERROR:
+                    fut.set_exception(RpcError(payload.decode()))
+                else:
+                    fut.set_result(payload)
+        except ConnectionError as e:
+            error = e
+        finally:
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(error)
+            self._pending.clear()
+
+    async def call(self, op: int, payload: bytes = b"") -> bytes:
+        req_id = self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        self.writer.write(pack_frame(op, req_id, payload))
+        await self.writer.drain()
+        return await fut
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self._reader_task
+
+
+class BlockingRpcClient:
+    """Plain-socket client, one request at a time; for synchronous agent loops."""
+
+    def __init__(self, address: str):
+        kind, where = parse_address(address)
+        if kind == "unix":
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect(where)
+        self._file = self.sock.makefile("rb")
+        self._next_id = 0
+
+    def _read(self, n: int) -> bytes:
+        data = self._file.read(n)
+        if len(data) < n:
+            raise ConnectionError("connection closed")
+        return data
+
+    def call(self, op: int, payload: bytes = b"") -> bytes:
+        req_id = self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+        self.sock.sendall(pack_frame(op, req_id, payload))
+        length, r_op, r_id = HEADER.unpack(self._read(HEADER.size))
+        payload = self._read(length) if length else b""
+        if r_id != req_id:
+            raise ConnectionError(f"response id {r_id} does not match request {req_id}")
+        if r_op == OP_ERROR:
+            raise RpcError(payload.decode())
+        return payload
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
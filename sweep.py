@@ -0,0 +1,243 @@
+"""Hyperparameter sweeps: grid or random search, a process pool and successive halving.
+
+Every trial is one `VectorQLearner` configuration with its own seed, derived
+from ``--seed`` with `np.random.SeedSequence.spawn`. A rerun with the same
+arguments therefore repeats every trial exactly, however the pool schedules
+them.
+
+Trials advance in rungs of growing episode budgets: ``--min-episodes``, times
+``--eta`` per rung, up to ``--episodes``. Budgets are minimums: a trial stops
+at the end of the tick that reaches its budget, which can be up to
+``num_envs - 1`` episodes later. After each rung every surviving trial
+is scored headlessly with `batch_evaluate.evaluate`: the greedy success rate
+(return >= ``reward_threshold``), with mean return as the tie-break. Only the
+best ``1/eta`` go on. A trial continues from its own checkpoint in
+``--workdir``, so no episodes are re-run between rungs. Each pool task is one
+trial's rung. A checkpoint whose seed or parameters differ from its trial's
+(say, one left by another sweep in the same ``--workdir``) is refused.
+
+The results table has one row per trial and keeps the last rung each trial
+reached. It is printed and written to ``--results``. The best trial's Q-table
+is saved to ``--out``.
+
+Search spaces are ``name=spec`` pairs over the `VectorQLearner` arguments:
+
+    alpha=0.05,0.1,0.2        choices (grid axis; sampled uniformly with --random)
+    epsilon_decay=0.999:0.9999  uniform range (random search only)
+    alpha=log:0.01:0.5        log-uniform range (random search only)
+
+    python sweep.py alpha=0.05,0.1,0.2 gamma=0.95,0.99 epsilon_decay=0.999,0.9998 --workers 8
+    python sweep.py --random 27 alpha=log:0.02:0.5 epsilon_decay=0.999:0.99995 --eta 3 --episodes 100000
+"""
+import argparse
+import csv
+import itertools
+import math
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from checkpoint import read_header
+from vector_q_learning import VectorQLearner
+
+TUNABLE = ("num_envs", "alpha", "gamma", "epsilon_decay", "min_epsilon", "action_mask")
+_INT_PARAMS = ("num_envs",)
+
+
+# -----------------------------------------------------------------------------
+#  Search spaces
+# -----------------------------------------------------------------------------
+def _value(name: str, text: str):
+    if name in _INT_PARAMS:
+        return int(text)
+    if name == "action_mask":
+        return text.lower() in ("1", "true", "yes")
+    return float(text)
+
+
+def parse_space(specs: list[str]) -> dict:
+    """``{name: ("choice", values) | ("uniform", lo, hi) | ("log", lo, hi)}`` from ``name=spec`` strings."""
+    space = {}
+    for spec in specs:
+        name, sep, text = spec.partition("=")
+        if not sep or name not in TUNABLE:
+            raise ValueError(f"expected name=spec with name in {TUNABLE}, got {spec!r}")
+        if text.startswith("log:"):
+            lo, hi = (float(v) for v in text[4:].split(":"))
+            space[name] = ("log", lo, hi)
+        elif ":" in text:
+            lo, hi = (float(v) for v in text.split(":"))
+            space[name] = ("uniform", lo, hi)
+        else:
+            space[name] = ("choice", [_value(name, v) for v in text.split(",")])
+    return space
+
+
+def grid(space: dict) -> list[dict]:
+    """Every combination of the choice axes."""
+    ranges = [n for n, axis in space.items() if axis[0] != "choice"]
+    if ranges:
+        raise ValueError(f"ranges need --random: {ranges}")
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[n][1] for n in names))]
+
+
+def sample(space: dict, n: int, rng: np.random.Generator) -> list[dict]:
+    """`n` independent draws from the space."""
+    configs = []
+    for _ in range(n):
+        config = {}
+        for name, axis in space.items():
+            if axis[0] == "choice":
+                config[name] = axis[1][rng.integers(len(axis[1]))]
+            elif axis[0] == "uniform":
+                config[name] = float(rng.uniform(axis[1], axis[2]))
+            else:
+                config[name] = float(math.exp(rng.uniform(math.log(axis[1]), math.log(axis[2]))))
+            if name in _INT_PARAMS:
+                config[name] = int(round(config[name]))
+        configs.append(config)
+    return configs
+
+
+def rungs(min_episodes: int, max_episodes: int, eta: int) -> list[int]:
+    """Cumulative episode budgets: min_episodes * eta**k, then max_episodes.
+
+    These are lower bounds. `VectorQLearner` finishes whole ticks, so a trial can
+    end a rung up to ``num_envs - 1`` episodes past its budget.
+    """
+    budgets = []
+    budget = min_episodes
+    while budget < max_episodes:
+        budgets.append(budget)
+        budget *= eta
+    return budgets + [max_episodes]
+
+
+# -----------------------------------------------------------------------------
+#  Trials
+# -----------------------------------------------------------------------------
+def _check_trial_checkpoint(path: str, task: dict):
+    """Raise ValueError unless the checkpoint at `path` was written by this trial (same seed and params)."""
+    header = read_header(path)
+    saved = header.get("hyperparameters", {})
+    wanted = {"seed": task["seed"], **task["params"]}
+    wrong = {k: (saved.get(k), v) for k, v in wanted.items() if saved.get(k) != v}
+    if wrong:
+        details = ", ".join(f"{k}={got!r} (trial has {want!r})" for k, (got, want) in wrong.items())
+        raise ValueError(f"{path} belongs to a different trial: {details}; use a fresh --workdir")
+
+
+def _run_rung(task: dict) -> dict:
+    """Train one trial up to its rung budget (continuing from its checkpoint) and evaluate it."""
+    from batch_evaluate import evaluate
+
+    start = time.perf_counter()
+    path = task["checkpoint"]
+    if os.path.exists(path):
+        _check_trial_checkpoint(path, task)
+        learner = VectorQLearner.from_checkpoint(path)
+    else:
+        learner = VectorQLearner(seed=task["seed"], **task["params"])
+    if learner.episodes_done < task["episodes"]:  # an earlier rung's last tick may already have passed the budget
+        learner.train(task["episodes"] - learner.episodes_done, report_every=0)
+        learner.save(path)
+    Q = learner.Q
+    res = evaluate(Q, samples=task["eval_samples"], seed=task["eval_seed"],
+                   action_mask=bool(task["params"].get("action_mask")))
+    return {
+        "trial": task["trial"],
+        "episodes": learner.episodes_done,
+        "env_steps": learner.env_steps,
+        "success_rate": res["success_rate"],
+        "return_mean": res["return_mean"],
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def run_sweep(configs: list[dict], workdir: str, workers: int, min_episodes: int, max_episodes: int, eta: int = 3,
+              eval_samples: int | None = 2000, seed: int = 0, log=print) -> list[dict]:
+    """Successive halving over `configs`; returns one row per trial, best first."""
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(len(configs))]
+    rows = [{"trial": i, "seed": seeds[i], **config, "rung": -1, "episodes": 0, "env_steps": 0,
+             "success_rate": float("nan"), "return_mean": float("nan"), "seconds": 0.0}
+            for i, config in enumerate(configs)]
+    alive = list(range(len(configs)))
+    budgets = rungs(min_episodes, max_episodes, eta)
+    with mp.Pool(workers) as pool:
+        for rung, budget in enumerate(budgets):
+            tasks = [{"trial": i, "seed": seeds[i], "params": configs[i], "episodes": budget,
+                      "checkpoint": os.path.join(workdir, f"trial_{i:04d}.qckpt"),
+                      "eval_samples": eval_samples, "eval_seed": seed} for i in alive]
+            start = time.perf_counter()
+            for res in pool.imap_unordered(_run_rung, tasks):
+                row = rows[res["trial"]]
+                row.update(res, rung=rung, seconds=row["seconds"] + res["seconds"])
+            alive.sort(key=lambda i: (rows[i]["success_rate"], rows[i]["return_mean"]), reverse=True)
+            best = rows[alive[0]]
+            log(f"rung {rung} ({budget:,} episodes): {len(alive)} trials in {time.perf_counter() - start:.1f}s, "
+                f"best trial {best['trial']} success {best['success_rate']:.1%} return {best['return_mean']:.1f}")
+            if rung + 1 < len(budgets):
+                alive = alive[:max(1, len(alive) // eta)]
+    return sorted(rows, key=lambda r: (r["rung"], r["success_rate"], r["return_mean"]), reverse=True)
+
+
+def write_results(path: str, rows: list[dict]):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def format_results(rows: list[dict], names: list[str], limit: int = 20) -> str:
+    lines = [f"{'trial':>5} " + " ".join(f"{n:>13}" for n in names) +
+             f" {'episodes':>9} {'success':>8} {'return':>7} {'seconds':>8}"]
+    for row in rows[:limit]:
+        values = " ".join(f"{row[n]:>13.6g}" if isinstance(row[n], float) else f"{row[n]!s:>13}" for n in names)
+        lines.append(f"{row['trial']:>5} {values} {row['episodes']:>9,} {row['success_rate']:>8.1%} "
+                     f"{row['return_mean']:>7.1f} {row['seconds']:>8.1f}")
+    if len(rows) > limit:
+        lines.append(f"... {len(rows) - limit} more in the results file")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("space", nargs="+", help="name=spec search axes (see above)")
+    parser.add_argument("--random", type=int, default=0, help="sample this many trials instead of the full grid")
+    parser.add_argument("--workers", type=int, default=mp.cpu_count())
+    parser.add_argument("--episodes", type=int, default=100000, help="budget of the trials that survive every rung")
+    parser.add_argument("--min-episodes", type=int, default=5000, help="budget of the first rung")
+    parser.add_argument("--eta", type=int, default=3, help="keep the best 1/eta trials per rung; budgets grow by eta")
+    parser.add_argument("--eval-samples", type=int, default=2000,
+                        help="seeded starts per evaluation (0: all 6 400 start configurations)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="trial checkpoints (default: a temporary directory)")
+    parser.add_argument("--results", default="sweep_results.csv")
+    parser.add_argument("--out", default="q_table_sweep_best.npy")
+    args = parser.parse_args()
+
+    space = parse_space(args.space)
+    configs = sample(space, args.random, np.random.default_rng(args.seed)) if args.random else grid(space)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="taxi_sweep_")
+    os.makedirs(workdir, exist_ok=True)
+    print(f"{len(configs)} trials, rungs {rungs(args.min_episodes, args.episodes, args.eta)}, "
+          f"{args.workers} workers, checkpoints in {workdir}")
+    try:
+        start = time.perf_counter()
+        rows = run_sweep(configs, workdir, args.workers, args.min_episodes, args.episodes, args.eta,
+                         args.eval_samples or None, args.seed)
+        elapsed = time.perf_counter() - start
+        write_results(args.results, rows)
+        best = VectorQLearner.from_checkpoint(os.path.join(workdir, f"trial_{rows[0]['trial']:04d}.qckpt"))
+        np.save(args.out, best.Q)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print(format_results(rows, list(space)))
+    print(f"\nSweep finished in {elapsed:.1f}s; results in {args.results}, "
+          f"best trial {rows[0]['trial']} Q-table saved as {args.out}.")
@@ -0,0 +1,186 @@
+"""Training telemetry: a preallocated ring buffer of episode records, flushed in the background.
+
+The training loop only writes into a NumPy ring buffer and updates running sums,
+so recording an episode costs a few array stores. A daemon thread drains new
+records to disk every `flush_interval` seconds, either as raw fixed-width binary
+records (`.bin`, readable with ``np.fromfile(path, RECORD_DTYPE)``) or as CSV.
+
+    python telemetry.py tail training_telemetry.bin --follow
+"""
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+RECORD_DTYPE = np.dtype([
+    ("episode", np.int64),
+    ("return", np.int32),
+    ("length", np.int16),
+    ("deliveries", np.int8),
+    ("epsilon", np.float32),
+    ("wall_time", np.float64),  # seconds since the stream was opened
+])
+
+
+class EpisodeRing:
+    """Fixed-capacity ring of `RECORD_DTYPE` records with rolling sums over the last `capacity` episodes."""
+
+    def __init__(self, capacity: int = 65536):
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=RECORD_DTYPE)
+        self.head = 0  # total records ever appended
+        self._sum_return = 0
+        self._sum_length = 0
+        self._sum_deliveries = 0
+
+    def append(self, episode: int, ret: int, length: int, deliveries: int, epsilon: float, wall_time: float):
+        i = self.head % self.capacity
+        if self.head >= self.capacity:
+            old = self.data[i]
+            self._sum_return -= int(old["return"])
+            self._sum_length -= int(old["length"])
+            self._sum_deliveries -= int(old["deliveries"])
+        self.data[i] = (episode, ret, length, deliveries, epsilon, wall_time)
+        self._sum_return += ret
+        self._sum_length += length
+        self._sum_deliveries += deliveries
+        self.head += 1
+
+    def extend(self, episodes, returns, lengths, deliveries, epsilon: float, wall_time: float):
+        """Append a batch of episodes (e.g. everything a vector trainer finished in one tick)."""
+        for e, r, l, d in zip(np.asarray(episodes).tolist(), np.asarray(returns).tolist(),
+                              np.asarray(lengths).tolist(), np.asarray(deliveries).tolist()):
+            self.append(e, r, l, d, epsilon, wall_time)
+
+    def window(self) -> int:
+        return min(self.head, self.capacity)
+
+    def rolling(self) -> dict:
+        n = self.window()
+        if not n:
+            return {"episodes": 0}
+        return {
+            "episodes": n,
+            "mean_return": self._sum_return / n,
+            "mean_length": self._sum_length / n,
+            "mean_deliveries": self._sum_deliveries / n,
+        }
+
+    def records(self, start: int, stop: int) -> np.ndarray:
+        """Copy of records with absolute indices [start, stop); they must still be in the ring."""
+        idx = np.arange(start, stop) % self.capacity
+        return self.data[idx]
+
+
+class TelemetryStream:
+    """An `EpisodeRing` plus a background thread appending new records to `path`."""
+
+    def __init__(self, path: str, capacity: int = 65536, window: int = 1000, flush_interval: float = 0.5,
+                 append: bool = False):
+        self.path = path
+        self.csv = path.endswith(".csv")
+        self.ring = EpisodeRing(capacity)
+        self.recent = EpisodeRing(window)  # small ring for the rolling aggregates shown in progress lines
+        self.flush_interval = flush_interval
+        self.flushed = 0
+        self.dropped = 0
+        self.start = time.perf_counter()
+        fresh = not (append and os.path.exists(path) and os.path.getsize(path))
+        self._file = open(path, ("w" if fresh else "a") + ("" if self.csv else "b"))
+        if self.csv and fresh:
+            self._file.write(",".join(RECORD_DTYPE.names) + "\n")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="telemetry-flush", daemon=True)
+        self._thread.start()
+
+    def record(self, episode: int, ret: int, length: int, deliveries: int, epsilon: float):
+        wall = time.perf_counter() - self.start
+        self.ring.append(episode, ret, length, deliveries, epsilon, wall)
+        self.recent.append(episode, ret, length, deliveries, epsilon, wall)
+
+    def record_batch(self, first_episode: int, returns, lengths, deliveries, epsilon: float):
+        wall = time.perf_counter() - self.start
+        episodes = np.arange(first_episode, first_episode + len(returns))
+        self.ring.extend(episodes, returns, lengths, deliveries, epsilon, wall)
+        self.recent.extend(episodes, returns, lengths, deliveries, epsilon, wall)
+
+    def rolling(self) -> dict:
+        return self.recent.rolling()
+
+    def flush(self):
+        head = self.ring.head
+        start = max(self.flushed, head - self.ring.capacity)
+        self.dropped += start - self.flushed
+        if head > start:
+            chunk = self.ring.records(start, head)
+            if self.csv:
+                self._file.write("".join(",".join(map(str, row)) + "\n" for row in chunk.tolist()))
+            else:
+                self._file.write(chunk.tobytes())
+            self._file.flush()
+        self.flushed = head
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_records(path: str, offset: int = 0) -> np.ndarray:
+    """Records from a telemetry file, skipping the first `offset` records (binary or CSV)."""
+    if path.endswith(".csv"):
+        return np.loadtxt(path, delimiter=",", skiprows=1 + offset, dtype=RECORD_DTYPE, ndmin=1)
+    with open(path, "rb") as f:
+        f.seek(offset * RECORD_DTYPE.itemsize)
+        buf = f.read()
+    usable = len(buf) - len(buf) % RECORD_DTYPE.itemsize  # ignore a partially written tail
+    return np.frombuffer(buf[:usable], dtype=RECORD_DTYPE)
+
+
+def summarize(records: np.ndarray) -> str:
+    if not len(records):
+        return "no episodes yet"
+    last = records[-1]
+    rate = len(records) / max(1e-9, records["wall_time"][-1] - records["wall_time"][0])
+    return (f"episode {int(last['episode']):>7}  epsilon={float(last['epsilon']):.3f}  "
+            f"mean_return={records['return'].mean():8.1f}  mean_len={records['length'].mean():6.1f}  "
+            f"deliveries={records['deliveries'].mean():.2f}  ({rate:,.0f} episodes/s)")
+
+
+def tail(path: str, window: int, follow: bool, interval: float):
+    total = 0
+    recent = np.zeros(0, dtype=RECORD_DTYPE)
+    while True:
+        new = read_records(path, total) if os.path.exists(path) else recent[:0]
+        if len(new) or not follow:
+            total += len(new)
+            recent = np.concatenate([recent, new])[-window:]
+            print(summarize(recent), flush=True)
+        if not follow:
+            return
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("tail", help="print rolling stats of a telemetry file")
+    p.add_argument("path")
+    p.add_argument("--window", type=int, default=1000, help="episodes in the rolling summary")
+    p.add_argument("--follow", "-f", action="store_true", help="keep reading as the file grows")
+    p.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args()
+    tail(args.path, args.window, args.follow, args.interval)
@@ -2,13 +2,6 @@ import gymnasium as gym
 from multi_taxi import TaxiTwoPassengerEnv  
 import time
 
-gym.register(
-    id="TaxiTwoPassenger-v0",
-    entry_point="multi_taxi:TaxiTwoPassengerEnv",
-    max_episode_steps=200,     # tweak as you like
-    reward_threshold=40        # 2 passengers × 20
-)
-
 # Load the Taxi-v3 environment with rendering enabled
 # Use render_mode="human" to see the visual output
 # Use render_mode=None if you don't need the visualization yet
@@ -0,0 +1,127 @@
+"""Exact dynamic-programming solver for the two-passenger taxi MDP.
+
+Solves the compiled model over extended states (observation + delivered flags),
+then projects the result onto the `(n_states, 6)` float32 Q-table that
+`evaluate_q_learning.py` loads. The projection averages the hidden-flag variants of
+each observation, weighted by how often the optimal policy visits them.
+
+    python value_iteration.py --method value --tol 1e-6 --out q_table_two_passenger_optimal.npy
+"""
+import argparse
+import time
+
+import numpy as np
+
+from multi_taxi import CODEC, N_EXT_STATES, TaxiTwoPassengerEnv, TransitionModel
+
+
+def _backup(model: TransitionModel, V: np.ndarray, gamma: float) -> np.ndarray:
+    return model.reward + gamma * np.where(model.terminated, 0.0, V[model.next_state])
+
+
+def value_iteration(model: TransitionModel, gamma: float = 0.99, tol: float = 1e-6, max_iters: int = 10000):
+    """Synchronous Bellman optimality backups until the largest Q change is below `tol`.
+
+    Returns the extended-state Q-table and the per-iteration residuals.
+    """
+    Q = np.zeros(model.reward.shape, dtype=np.float64)
+    residuals = []
+    for _ in range(max_iters):
+        new_Q = _backup(model, Q.max(axis=1), gamma)
+        residuals.append(float(np.abs(new_Q - Q).max()))
+        Q = new_Q
+        if residuals[-1] < tol:
+            break
+    return Q, residuals
+
+
+def policy_iteration(model: TransitionModel, gamma: float = 0.99, tol: float = 1e-6, max_iters: int = 100):
+    """Howard policy iteration; each evaluation sweeps the fixed policy to `tol`.
+
+    Returns the extended-state Q-table and the number of evaluation sweeps per
+    improvement step.
+    """
+    states = np.arange(N_EXT_STATES)
+    policy = np.zeros(N_EXT_STATES, dtype=np.int64)
+    V = np.zeros(N_EXT_STATES)
+    sweeps = []
+    for _ in range(max_iters):
+        ns, r, t = model.next_state[states, policy], model.reward[states, policy], model.terminated[states, policy]
+        n = 0
+        while True:
+            new_V = r + gamma * np.where(t, 0.0, V[ns])
+            n += 1
+            if np.abs(new_V - V).max() < tol:
+                V = new_V
+                break
+            V = new_V
+        sweeps.append(n)
+        Q = _backup(model, V, gamma)
+        best = Q.max(axis=1, keepdims=True)
+        # keep the current action on ties so the loop terminates
+        keep = Q[states, policy] >= best[:, 0] - tol
+        new_policy = np.where(keep, policy, Q.argmax(axis=1))
+        if (new_policy == policy).all():
+            return Q, sweeps
+        policy = new_policy
+    return Q, sweeps
+
+
+def visitation(model: TransitionModel, policy: np.ndarray, horizon: int = 200) -> np.ndarray:
+    """Expected visits per extended state when following `policy` from the reset distribution."""
+    n_obs = TaxiTwoPassengerEnv.observation_space.n
+    r, c, p1, d1, p2, d2 = CODEC.decode_batch(np.arange(n_obs))
+    start = ((p1 < 4) & (p2 < 4)).astype(np.float64)
+    dist = np.zeros(N_EXT_STATES)
+    dist[::4] = start / start.sum()
+
+    states = np.arange(N_EXT_STATES)
+    ns, t = model.next_state[states, policy], model.terminated[states, policy]
+    visits = np.zeros(N_EXT_STATES)
+    for _ in range(horizon):
+        visits += dist
+        dist = np.bincount(ns, weights=np.where(t, 0.0, dist), minlength=N_EXT_STATES)
+    return visits
+
+
+def project_to_observations(model: TransitionModel, Q_ext: np.ndarray) -> np.ndarray:
+    """Collapse an extended-state Q-table onto observations, weighting by on-policy visits.
+
+    Observations the policy never reaches fall back to the "nothing delivered" variant.
+    """
+    w = visitation(model, Q_ext.argmax(axis=1)).reshape(-1, 4)
+    Q4 = Q_ext.reshape(-1, 4, Q_ext.shape[1])
+    total = w.sum(axis=1, keepdims=True)
+    weighted = (Q4 * w[:, :, None]).sum(axis=1) / np.where(total > 0, total, 1)
+    return np.where(total > 0, weighted, Q4[:, 0]).astype(np.float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--method", choices=("value", "policy"), default="value")
+    parser.add_argument("--gamma", type=float, default=0.99)
+    parser.add_argument("--tol", type=float, default=1e-6)
+    parser.add_argument("--out", default="q_table_two_passenger_optimal.npy")
+    parser.add_argument("--ext-out", default=None, help="also save the (40000, 6) extended-state table")
+    args = parser.parse_args()
+
+    model = TaxiTwoPassengerEnv().model
+    start = time.perf_counter()
+    if args.method == "value":
+        Q_ext, residuals = value_iteration(model, args.gamma, args.tol)
+        print(f"Value iteration: {len(residuals)} iterations, final residual {residuals[-1]:.2e}")
+        for i in sorted({0, 9, 99, len(residuals) - 1} & set(range(len(residuals)))):
+            print(f"  iter {i + 1:>5}: max |ΔQ| = {residuals[i]:.3e}")
+    else:
+        Q_ext, sweeps = policy_iteration(model, args.gamma, args.tol)
+        print(f"Policy iteration: {len(sweeps)} improvement steps, {sum(sweeps)} evaluation sweeps")
+    solve_time = time.perf_counter() - start
+
+    Q = project_to_observations(model, Q_ext)
+    np.save(args.out, Q)
+    if args.ext_out:
+        np.save(args.ext_out, Q_ext.astype(np.float32))
+    from batch_evaluate import all_start_states
+    starts = Q_ext[all_start_states()].max(axis=1)  # the 6 400 states an episode can start in
+    print(f"Solved in {solve_time:.2f}s (projection {time.perf_counter() - start - solve_time:.2f}s); "
+          f"mean optimal start value {starts.mean():.2f}. Q-table saved as {args.out}.")
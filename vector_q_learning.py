@@ -0,0 +1,257 @@
+"""Tabular Q-learning over many lockstep episodes, straight against the compiled model.
+
+The hyperparameters and TD target of `q_learning_taxi.py` (no bootstrap past a
+terminating step), but every tick advances `num_envs` episodes with a handful of
+array operations instead of one `gym.make` step per episode. Updates within a
+tick are applied together by `scatter_q_update`, and exploration draws from one
+NumPy stream, so it is not step-for-step the scalar loop.
+
+    python vector_q_learning.py --episodes 100000 --num-envs 256
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from checkpoint import load_checkpoint, read_header, save_checkpoint
+from multi_taxi import TaxiTwoPassengerEnv, sample_ext_starts
+from q_storage import LAYOUTS, make_q_store
+from telemetry import TelemetryStream
+
+
+def greedy_actions(q_rows: np.ndarray, rng: np.random.Generator, mask: np.ndarray | None = None) -> np.ndarray:
+    """Row-wise argmax with uniform tie-breaking, using the `np.isclose(..., atol=1e-8)` tie rule.
+
+    With a boolean `mask` only the allowed actions of each row are considered.
+    """
+    if mask is not None:
+        q_rows = np.where(mask, q_rows, -np.inf)
+    best = q_rows.max(axis=1, keepdims=True)
+    ties = np.abs(q_rows - best) <= 1e-8 + 1e-5 * np.abs(best)
+    return np.argmax(ties * rng.random(q_rows.shape), axis=1)
+
+
+def scatter_q_update(Q: np.ndarray, states, actions, td_errors, alpha: float):
+    """Apply one batch of TD errors to `Q`, coping with repeated (state, action) pairs.
+
+    Plain fancy assignment keeps only the last write and `np.add.at` applies every
+    update at full step size. Here each pair moves by its mean TD error at rate
+    ``1 - (1 - alpha) ** k``. That is exactly what k sequential updates would do if
+    the k duplicates shared one target. Duplicates within a tick come from
+    different envs, with their own rewards and next states, so it approximates
+    the sequential updates.
+    """
+    flat = states * Q.shape[1] + actions
+    pairs, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+    mean_td = np.bincount(inverse, weights=td_errors) / counts
+    Q.reshape(-1)[pairs] += ((1 - (1 - alpha) ** counts) * mean_td).astype(Q.dtype)
+
+
+def _next_multiple(n: int, every: int) -> float:
+    return n - n % every + every if every else float("inf")
+
+
+class VectorQLearner:
+    """Epsilon-greedy Q-learning over `num_envs` lockstep episodes.
+
+    Epsilon decays once per finished episode, exactly as in the scalar loop. Calling
+    `train` again continues from where the previous call stopped. `storage` picks
+    the `q_storage` layout; `Q` is always available as a dense table. With
+    `action_mask`, exploration, greedy choice and the TD target only consider the
+    actions `TransitionModel.action_mask` allows.
+    """
+
+    def __init__(
+        self,
+        num_envs: int = 256,
+        alpha: float = 0.1,
+        gamma: float = 0.99,
+        epsilon: float = 1.0,
+        epsilon_decay: float = 0.9998,
+        min_epsilon: float = 0.01,
+        max_steps: int = 200,
+        seed: int | None = None,
+        storage: str = "dense",
+        action_mask: bool = False,
+    ):
+        self.num_envs = num_envs
+        self.alpha, self.gamma = alpha, gamma
+        self.epsilon_start, self.epsilon_decay, self.min_epsilon = epsilon, epsilon_decay, min_epsilon
+        self.max_steps = max_steps
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.model = TaxiTwoPassengerEnv().model
+
+        self.storage = storage
+        self.action_mask = action_mask
+        self.n_states = TaxiTwoPassengerEnv.observation_space.n
+        self.store = make_q_store(storage, self.n_states)
+        self.states = sample_ext_starts(self.rng, num_envs)
+        self.steps = np.zeros(num_envs, dtype=np.int32)
+        self.returns = np.zeros(num_envs, dtype=np.int64)
+        self.episodes_done = 0
+        self.env_steps = 0
+
+    def save(self, path: str):
+        """Write a checkpoint holding everything needed to continue bit-for-bit."""
+        save_checkpoint(
+            path, self.Q,
+            trainer="vector_q_learning",
+            hyperparameters={
+                "num_envs": self.num_envs, "alpha": self.alpha, "gamma": self.gamma,
+                "epsilon": self.epsilon_start, "epsilon_decay": self.epsilon_decay,
+                "min_epsilon": self.min_epsilon, "max_steps": self.max_steps, "storage": self.storage,
+                "action_mask": self.action_mask, "seed": self.seed,
+            },
+            epsilon=self.epsilon,
+            episode=self.episodes_done,
+            env_steps=self.env_steps,
+            rng_state=self.rng.bit_generator.state,
+            slots={"states": self.states.tolist(), "steps": self.steps.tolist(), "returns": self.returns.tolist()},
+        )
+
+    @classmethod
+    def from_checkpoint(cls, path: str) -> "VectorQLearner":
+        Q, header = load_checkpoint(path, mmap=False)
+        if header.get("trainer") != "vector_q_learning":
+            raise ValueError(f"{path} was not written by VectorQLearner")
+        learner = cls(**header["hyperparameters"])
+        learner.store.load_dense(Q)
+        learner.rng.bit_generator.state = header["rng_state"]
+        learner.episodes_done, learner.env_steps = header["episode"], header["env_steps"]
+        slots = header["slots"]
+        learner.states = np.array(slots["states"], dtype=np.int64)
+        learner.steps = np.array(slots["steps"], dtype=np.int32)
+        learner.returns = np.array(slots["returns"], dtype=np.int64)
+        return learner
+
+    @property
+    def Q(self) -> np.ndarray:
+        return self.store.to_dense(self.n_states)
+
+    @property
+    def epsilon(self) -> float:
+        return max(self.min_epsilon, self.epsilon_start * self.epsilon_decay ** self.episodes_done)
+
+    def tick(self):
+        """Advance every slot by one step; returns (returns, lengths, deliveries) of the episodes that ended."""
+        rng, model, store = self.rng, self.model, self.store
+        rows = store.rows(self.states >> 2, insert=True)
+        mask = model.action_mask[self.states] if self.action_mask else None
+        explore = rng.random(self.num_envs) < self.epsilon
+        if mask is None:
+            random_actions = rng.integers(6, size=self.num_envs)
+        else:
+            random_actions = np.argmax(mask * rng.random(mask.shape), axis=1)
+        actions = np.where(explore, random_actions, greedy_actions(store.values[rows], rng, mask))
+        next_states = model.next_state[self.states, actions].astype(np.int64)
+        rewards = model.reward[self.states, actions]
+        terminated = model.terminated[self.states, actions]
+
+        next_rows = store.rows(next_states >> 2, insert=True)
+        Q = store.values  # after the inserts, which may have grown it
+        next_q = Q[next_rows]
+        if self.action_mask:
+            next_q = np.where(model.action_mask[next_states], next_q, -np.inf)
+        td = rewards + np.where(terminated, 0.0, self.gamma * next_q.max(axis=1)) - Q[rows, actions]
+        scatter_q_update(Q, rows, actions, td, self.alpha)
+
+        self.steps += 1
+        self.returns += rewards
+        self.states = next_states
+        self.env_steps += self.num_envs
+
+        done = terminated | (self.steps >= self.max_steps)
+        if not done.any():
+            return self.returns[:0], self.steps[:0], self.steps[:0]
+        finished = self.returns[done].copy(), self.steps[done].copy(), (next_states[done] & 1) + (next_states[done] >> 1 & 1)
+        self.episodes_done += int(done.sum())
+        self.states[done] = sample_ext_starts(rng, int(done.sum()))
+        self.steps[done] = 0
+        self.returns[done] = 0
+        return finished
+
+    def train(self, episodes: int, report_every: int = 3000, log=print,
+              checkpoint_path: str | None = None, checkpoint_every: int = 10000, telemetry=None):
+        """Run until `episodes` more episodes have finished, checkpointing every `checkpoint_every`.
+
+        Finished episodes are also recorded into `telemetry` (a `TelemetryStream`) if given.
+        """
+        target = self.episodes_done + episodes
+        next_report = _next_multiple(self.episodes_done, report_every)
+        next_checkpoint = _next_multiple(self.episodes_done, checkpoint_every if checkpoint_path else 0)
+        recent = []
+        start = time.perf_counter()
+        first = self.episodes_done
+        while self.episodes_done < target:
+            first_of_tick = self.episodes_done + 1
+            epsilon = self.epsilon
+            returns, lengths, deliveries = self.tick()
+            if telemetry is not None and len(returns):
+                telemetry.record_batch(first_of_tick, returns, lengths, deliveries, epsilon)
+            if report_every:
+                recent.append(returns)
+            if self.episodes_done >= next_report:
+                window = np.concatenate(recent)
+                rate = (self.episodes_done - first) / (time.perf_counter() - start)
+                log(f"Episode {self.episodes_done:>6}/{target}: epsilon={self.epsilon:.3f}  "
+                    f"mean_reward={window.mean():.1f}  ({rate:,.0f} episodes/s)")
+                next_report += report_every
+                recent = []
+            if self.episodes_done >= next_checkpoint:
+                self.save(checkpoint_path)
+                next_checkpoint += checkpoint_every
+        elapsed = time.perf_counter() - start
+        return (self.episodes_done - first) / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--episodes", type=int, default=100000)
+    parser.add_argument("--num-envs", type=int, default=256)
+    parser.add_argument("--alpha", type=float, default=0.1)
+    parser.add_argument("--gamma", type=float, default=0.99)
+    parser.add_argument("--epsilon-decay", type=float, default=0.9998)
+    parser.add_argument("--min-epsilon", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--storage", choices=LAYOUTS, default="dense", help="Q-table layout while training")
+    parser.add_argument("--action-mask", action="store_true", help="never explore or bootstrap from masked actions")
+    parser.add_argument("--out", default="q_table_two_passenger.npy")
+    parser.add_argument("--checkpoint", default=None, help="periodic checkpoint file (.qckpt)")
+    parser.add_argument("--checkpoint-every", type=int, default=10000)
+    parser.add_argument("--resume", action="store_true", help="continue from --checkpoint if it exists; hyperparameter flags given must match it")
+    parser.add_argument("--telemetry", default=None, help="per-episode telemetry file (.bin or .csv)")
+    # Hyperparameter flags start out as None, so the ones given on the command line can be told apart
+    hyper = ("num_envs", "alpha", "gamma", "epsilon_decay", "min_epsilon", "seed", "storage", "action_mask")
+    args = parser.parse_args(namespace=argparse.Namespace(**dict.fromkeys(hyper)))
+    given = {name: getattr(args, name) for name in hyper if getattr(args, name) is not None}
+    for name in hyper:
+        if getattr(args, name) is None:
+            setattr(args, name, parser.get_default(name))
+
+    if args.resume and args.checkpoint and os.path.exists(args.checkpoint):
+        learner = VectorQLearner.from_checkpoint(args.checkpoint)
+        saved = read_header(args.checkpoint)["hyperparameters"]
+        differ = {name: (saved.get(name), value) for name, value in given.items() if saved.get(name) != value}
+        if differ:
+            parser.error(f"{args.checkpoint} was trained with different settings: " + ", ".join(
+                f"--{name.replace('_', '-')} {got!r} (given {want!r})" for name, (got, want) in differ.items()))
+        print(f"Resuming from {args.checkpoint} at episode {learner.episodes_done}")
+    else:
+        learner = VectorQLearner(
+            num_envs=args.num_envs, alpha=args.alpha, gamma=args.gamma,
+            epsilon_decay=args.epsilon_decay, min_epsilon=args.min_epsilon, seed=args.seed,
+            storage=args.storage, action_mask=args.action_mask,
+        )
+    telemetry = TelemetryStream(args.telemetry, append=learner.episodes_done > 0) if args.telemetry else None
+    start = time.perf_counter()
+    eps_per_sec = learner.train(max(0, args.episodes - learner.episodes_done), checkpoint_path=args.checkpoint,
+                                checkpoint_every=args.checkpoint_every, telemetry=telemetry)
+    if telemetry is not None:
+        telemetry.close()
+    np.save(args.out, learner.Q)
+    if args.checkpoint:
+        learner.save(args.checkpoint)
+    print(f"\nTrained {learner.episodes_done} episodes ({learner.env_steps:,} env steps) in "
+          f"{time.perf_counter() - start:.1f}s — {eps_per_sec:,.0f} episodes/s. Q-table saved as {args.out}.")